@@ -0,0 +1,231 @@
+"""
+Benchmark the vector index parameters for recall and latency.
+
+Exact flat search is used as the ground truth. For every engine and parameter combination in the grid we measure
+recall@k, p50/p95/p99 single query latency, build time and index size. The vectors are synthetic 1536-d vectors, or
+vectors loaded from a .npy file or the embedding cache, so the benchmark runs offline. Optionally the OpenSearch
+mapping from the config files is benchmarked against a local OpenSearch.
+
+    python -m benchmark.index_benchmark --num-vectors 20000 --output benchmark_report.json
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import sqlite3
+import time
+from datetime import datetime
+
+import faiss
+import numpy as np
+
+from retriever.faiss_store import create_faiss_index
+
+bench_log = logging.getLogger("benchmark")
+
+DEFAULT_GRID = {
+    "flat": {},
+    "hnsw": {"m": [16, 32, 64], "ef_construction": [64, 512], "ef_search": [32, 128, 512]},
+    "ivf": {"nlist": [4, 64, 256], "nprobe": [1, 2, 8, 32]},
+    "ivfpq": {"nlist": [64, 256], "nprobe": [8, 32], "pq_m": [48, 96], "pq_bits": [8]}
+}
+
+
+def synthetic_vectors(num_vectors: int, dimension: int = 1536, num_clusters: int = 64, seed: int = 42) -> np.ndarray:
+    """ Unit length vectors grouped around random centers, closer to real embeddings than uniform noise. """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_clusters, dimension), dtype=np.float32)
+    assignment = rng.integers(0, num_clusters, num_vectors)
+    vectors = centers[assignment] + 0.5 * rng.standard_normal((num_vectors, dimension), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def load_vectors(path: str) -> np.ndarray:
+    """ Load vectors from a .npy file or from the SQLite file of the embedding cache. """
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r").astype(np.float32)
+
+    with sqlite3.connect(path) as connection:
+        rows = connection.execute("SELECT vector FROM embeddings").fetchall()
+    return np.vstack([np.frombuffer(row[0], dtype=np.float32) for row in rows])
+
+
+def expand_grid(grid: dict):
+    for engine, params in grid.items():
+        names = list(params.keys())
+        for values in itertools.product(*[params[name] for name in names]):
+            yield engine, dict(zip(names, values))
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    hits = sum(len(set(found_row[:k]) & set(truth_row)) for found_row, truth_row in zip(found, truth))
+    return hits / truth.size
+
+
+def latency_percentiles(latencies: list) -> dict:
+    millis = np.asarray(latencies) * 1000
+    return {
+        "p50_ms": float(np.percentile(millis, 50)),
+        "p95_ms": float(np.percentile(millis, 95)),
+        "p99_ms": float(np.percentile(millis, 99)),
+        "mean_ms": float(millis.mean())
+    }
+
+
+def benchmark_faiss(engine: str, params: dict, vectors: np.ndarray, queries: np.ndarray, truth: np.ndarray,
+                    k: int) -> dict:
+    start = time.perf_counter()
+    index = create_faiss_index(vectors, index_type=engine, **params)
+    build_seconds = time.perf_counter() - start
+
+    latencies = []
+    found = np.empty((len(queries), k), dtype=np.int64)
+    for position, query in enumerate(queries):
+        start = time.perf_counter()
+        _, positions = index.search(query.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - start)
+        found[position] = positions[0]
+
+    return {
+        "engine": f"faiss-{engine}",
+        "params": params,
+        f"recall@{k}": recall_at_k(found, truth),
+        "build_seconds": build_seconds,
+        "index_bytes": int(faiss.serialize_index(index).nbytes),
+        **latency_percentiles(latencies)
+    }
+
+
+def benchmark_opensearch(config: dict, vectors: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int) -> dict:
+    """ Benchmark the product mapping and settings from the config files on a local OpenSearch. """
+    from retriever import OpenSearchClient
+    from util import load_json_body_from_file
+
+    client = OpenSearchClient(config, alias_name="benchmark-vectors")
+    index_name = f"benchmark-vectors-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    mappings = load_json_body_from_file("./config_files/sg_product_component_mappings.json")["template"]["mappings"]
+    settings = load_json_body_from_file("./config_files/sg_product_component_settings.json")["template"]["settings"]
+    mappings["properties"]["title_vector"]["dimension"] = vectors.shape[1]
+
+    client.opensearch.indices.create(index=index_name, body={"settings": settings, "mappings": mappings})
+    try:
+        start = time.perf_counter()
+        documents = ({"_id": str(position), "_source": {"title_vector": vector.tolist()}}
+                     for position, vector in enumerate(vectors))
+        client.bulk_index(documents=documents, index_name=index_name)
+        client.opensearch.indices.refresh(index=index_name)
+        build_seconds = time.perf_counter() - start
+
+        latencies = []
+        took = []
+        found = np.full((len(queries), k), -1, dtype=np.int64)
+        for position, query in enumerate(queries):
+            body = {"size": k, "_source": False,
+                    "query": {"knn": {"title_vector": {"vector": query.tolist(), "k": k}}}}
+            start = time.perf_counter()
+            response = client.search(body=body, size=k, index_name=index_name)
+            latencies.append(time.perf_counter() - start)
+            took.append(response["took"])
+            hit_ids = [int(hit["_id"]) for hit in response["hits"]["hits"]]
+            found[position, :len(hit_ids)] = hit_ids
+
+        stats = client.opensearch.indices.stats(index=index_name)
+        return {
+            "engine": "opensearch-" + mappings["properties"]["title_vector"]["method"]["engine"],
+            "params": mappings["properties"]["title_vector"]["method"]["parameters"],
+            f"recall@{k}": recall_at_k(found, truth),
+            "build_seconds": build_seconds,
+            "index_bytes": stats["indices"][index_name]["total"]["store"]["size_in_bytes"],
+            "took_mean_ms": float(np.mean(took)),
+            **latency_percentiles(latencies)
+        }
+    finally:
+        client.delete_index(index_name)
+
+
+def run_benchmark(vectors: np.ndarray, num_queries: int = 200, k: int = 10, grid: dict = None,
+                  opensearch_config: dict = None, seed: int = 42) -> dict:
+    """
+    Run all engines and parameters in the grid against the same vectors and queries.
+    :return: The report with the dataset description and one result per engine and parameter combination
+    """
+    rng = np.random.default_rng(seed)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    sample = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+    queries = vectors[sample] + 0.05 * rng.standard_normal((len(sample), vectors.shape[1]), dtype=np.float32)
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    results = []
+    for engine, params in expand_grid(grid or DEFAULT_GRID):
+        num_centroids = max(params.get("nlist", 0), 2 ** params.get("pq_bits", 8) if engine == "ivfpq" else 0)
+        if num_centroids * 39 > len(vectors):
+            bench_log.warning(f"Skip {engine} {params}, not enough vectors to train {num_centroids} centroids")
+            continue
+        bench_log.info(f"Benchmark {engine} with {params}")
+        results.append(benchmark_faiss(engine, params, vectors, queries, truth, k))
+
+    if opensearch_config:
+        results.append(benchmark_opensearch(opensearch_config, vectors, queries, truth, k))
+
+    return {
+        "created_at": datetime.now().isoformat(),
+        "platform": platform.platform(),
+        "faiss_version": faiss.__version__,
+        "num_vectors": len(vectors),
+        "dimension": vectors.shape[1],
+        "num_queries": len(queries),
+        "k": k,
+        "results": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vector index parameters for recall and latency")
+    parser.add_argument("--vectors", help="A .npy file or the embedding cache SQLite file, synthetic if not provided")
+    parser.add_argument("--num-vectors", type=int, default=10_000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--grid", help="JSON file with the engines and parameter lists to benchmark")
+    parser.add_argument("--opensearch-host", help="Host of a local OpenSearch to benchmark the mapping against")
+    parser.add_argument("--opensearch-port", type=int, default=9200)
+    parser.add_argument("--output", default="benchmark_report.json")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.vectors:
+        vectors = load_vectors(args.vectors)
+    else:
+        vectors = synthetic_vectors(args.num_vectors, dimension=args.dimension)
+
+    grid = None
+    if args.grid:
+        with open(args.grid) as file:
+            grid = json.load(file)
+
+    opensearch_config = None
+    if args.opensearch_host:
+        opensearch_config = {"host": args.opensearch_host, "port": args.opensearch_port, "use_ssl": False,
+                             "verify_certs": False, "auth": None}
+
+    report = run_benchmark(vectors, num_queries=args.num_queries, k=args.k, grid=grid,
+                           opensearch_config=opensearch_config)
+    output_dir = os.path.dirname(args.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    for result in report["results"]:
+        print(f"{result['engine']:20s} {json.dumps(result['params']):70s} "
+              f"recall@{args.k}={result[f'recall@{args.k}']:.3f} p95={result['p95_ms']:.3f}ms")
+
+
+if __name__ == '__main__':
+    main()
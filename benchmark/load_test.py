@@ -0,0 +1,346 @@
+"""
+Load test the query paths of the retriever and the Streamlit app without AWS or OpenAI.
+
+The OpenSearch and OpenAI stand-ins from benchmark.stand_in are started in this process. The products, the help
+content and the stores are indexed with the templates and ingestion code of this project. Next a weighted mix of
+scenarios is replayed by a number of concurrent workers, every worker starts the next query when the previous one is
+finished. The report contains the throughput, the latency percentiles per scenario, the errors and the metrics that
+the code recorded, so the effect of a change in the query path can be compared between runs. The stand-in embeddings
+are a bag of words, most queries stay below the minimal score of the intent router and take the LLM fallback.
+
+    python -m benchmark.load_test --concurrency 16 --duration 60 --openai-latency-ms 150 --output load_report.json
+
+Provide --opensearch-host and --openai-api-base to run the same mix against real endpoints with existing indexes.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import openai
+
+from benchmark.index_benchmark import latency_percentiles
+from benchmark.stand_in import OpenAIStandIn, OpenSearchStandIn, serve
+from ingest.content import discover_files, ingest_content
+from ingest.products import derive_fields, embed_products, hash_products, read_rows, to_upsert_actions, \
+    unique_products
+from retriever import CachedEmbeddings, ContentAnswerer, EmbeddingPipeline, IntentRouter, OpenSearchClient, \
+    OpenSearchTemplate, StoreDirectory, create_vector_store
+from util import PrometheusMetrics, load_json_body_from_file, set_metrics
+
+load_log = logging.getLogger("load_test")
+
+DEFAULT_MIX = {
+    "lexical": 2,
+    "knn": 2,
+    "hybrid": 2,
+    "product": 2,
+    "content": 1,
+    "opening_hours": 1,
+    "route": 2
+}
+
+TEMPLATES = {
+    "sg-products": "sg_product",
+    "sg-content": "sg_content",
+    "sg-stores": "sg_stores"
+}
+
+STORE_FIELD_PATTERN = re.compile(r"\*\*(?P<key>[^*]+):\*\*\s*(?P<value>.*)")
+OPENING_HOURS_PATTERN = re.compile(r"-\s*(?P<week_day>\w+):\s*(?P<hours>.+)")
+
+
+def parse_stores(path: str = "./data/help-shop-locations.txt") -> list:
+    """ Parse the shop locations into the documents of the stores index, like the handle_stores notebook does. """
+    stores = []
+    with open(path) as file:
+        for line in file:
+            field = STORE_FIELD_PATTERN.search(line)
+            opening_hours = OPENING_HOURS_PATTERN.match(line.strip())
+            if field and field.group("key") == "Store Name":
+                stores.append({"store_name": field.group("value").strip(), "opening_hours": []})
+            elif field and field.group("value").strip() and stores:
+                stores[-1][field.group("key").strip().lower().replace(" ", "_")] = field.group("value").strip()
+            elif opening_hours and stores:
+                times = opening_hours.group("hours").strip().split("-")
+                open_time, closing_time = times if len(times) == 2 else ("00:00", "00:00")
+                stores[-1]["opening_hours"].append({"week_day": opening_hours.group("week_day"),
+                                                    "open_time": open_time, "closing_time": closing_time})
+    return stores
+
+
+def start_stand_ins(opensearch_latency_ms: float = 0.0, openai_latency_ms: float = 0.0,
+                    openai_token_latency_ms: float = 0.0) -> tuple:
+    """
+    Start both stand-ins on free ports and point the OpenAI library to the stand-in.
+    :return: Tuple with the OpenSearch config and the OpenAI api base
+    """
+    opensearch_server = serve(OpenSearchStandIn(latency_ms=opensearch_latency_ms), port=0)
+    openai_server = serve(OpenAIStandIn(latency_ms=openai_latency_ms, token_latency_ms=openai_token_latency_ms),
+                          port=0)
+    config = {"host": "127.0.0.1", "port": opensearch_server.server_port, "use_ssl": False, "verify_certs": False,
+              "auth": None, "pool_maxsize": 64}
+    return config, f"http://127.0.0.1:{openai_server.server_port}/v1"
+
+
+def seed_indexes(client: OpenSearchClient, embeddings, data_folder: str = "./data") -> dict:
+    """ Sync the templates and index the products, the help content and the stores behind their aliases. """
+    for alias_name, prefix in TEMPLATES.items():
+        OpenSearchTemplate(client=client,
+                           index_template_name=f"{prefix}_index_template",
+                           component_name_settings=f"{prefix}_component_settings",
+                           component_name_dyn_mappings=f"{prefix}_component_dynamic_mappings",
+                           component_name_mappings=f"{prefix}_component_mappings").create_update_template()
+
+    product_files = [os.path.join(data_folder, name) for name in ("extract-data-brickheadz.csv", "all_brickheadz.csv")]
+    products = hash_products(unique_products(derive_fields(read_rows(product_files))))
+    client.reindex(documents=to_upsert_actions(embed_products(products, embeddings), pending={}),
+                   provided_alias_name="sg-products")
+
+    ingest_content(client, embeddings, paths=discover_files(data_folder), alias_name="sg-content", max_workers=1)
+    client.reindex(documents=parse_stores(os.path.join(data_folder, "help-shop-locations.txt")),
+                   provided_alias_name="sg-stores")
+
+    return {alias_name: client.count_docs(alias_name)["count"] for alias_name in TEMPLATES}
+
+
+def create_scenarios(config: dict, api_base: str, embeddings) -> tuple:
+    """
+    Create the components of the app once and a function per scenario that executes one query.
+    :return: Tuple with the scenario functions by name and the queries by scenario name
+    """
+    from langchain import OpenAI
+    from langchain.chains.openai_functions import create_openai_fn_chain
+    from langchain.chat_models import ChatOpenAI
+    from langchain.prompts import ChatPromptTemplate
+
+    client = OpenSearchClient(config, alias_name="sg-products")
+    store_directory = StoreDirectory(client, alias_name="sg-stores")
+    intent_router = IntentRouter.from_file(embeddings=embeddings,
+                                           argument_extractors={"execute_opening_hours": store_directory.extract_city})
+    vector_store_products = create_vector_store(config=config, index_name="sg-products", embedding_function=embeddings)
+    content_answerer = ContentAnswerer(
+        vector_store=create_vector_store(config=config, index_name="sg-content", embedding_function=embeddings),
+        llm=OpenAI(openai_api_key=openai.api_key, openai_api_base=api_base, streaming=True)
+    )
+
+    examples = load_json_body_from_file(file_name="./config_files/intent_examples.json")
+    functions = [
+        {"name": name, "description": f"Search with {name}", "parameters": {
+            "type": "object",
+            "properties": {"city" if name == "execute_opening_hours" else "query": {"type": "string"}}}}
+        for name in examples
+    ]
+    fn_chain = create_openai_fn_chain(
+        functions=functions,
+        llm=ChatOpenAI(model="gpt-4-0613", temperature=0, openai_api_key=openai.api_key, openai_api_base=api_base),
+        prompt=ChatPromptTemplate.from_messages([
+            ("system", "You are a system to search for answers on a provided question."),
+            ("human", "Make calls to the relevant function to using the following input: {input}"),
+            ("human", "Tip: Make sure to answer in the correct format"),
+        ])
+    )
+
+    def route(query: str):
+        chain_response = intent_router.route(query)
+        if chain_response["name"] is None:
+            chain_response = fn_chain.run(query)
+        return chain_response
+
+    scenarios = {
+        "lexical": lambda query: client.search(body={"query": {"match": {"title": query}}}, size=10),
+        "knn": lambda query: client.knn_search(embeddings.embed_query(query), k=10),
+        "hybrid": lambda query: client.hybrid_search(query, embeddings.embed_query(query)),
+        "product": lambda query: vector_store_products.similarity_search_with_score(query=query, text_field="title",
+                                                                                    vector_field="title_vector"),
+        "content": lambda query: content_answerer.answer(query),
+        "opening_hours": lambda city: store_directory.find_store(city),
+        "route": route
+    }
+
+    cities = sorted({store["city"] for store in parse_stores()})
+    queries = {
+        "lexical": examples["execute_product_search"],
+        "knn": examples["execute_product_search"],
+        "hybrid": examples["execute_product_search"],
+        "product": examples["execute_product_search"],
+        "content": examples["execute_content_search"],
+        "opening_hours": cities,
+        "route": [query for tool_queries in examples.values() for query in tool_queries]
+    }
+    return scenarios, queries
+
+
+def run_load(scenarios: dict, queries: dict, mix: dict, concurrency: int = 8, duration_seconds: float = 30.0,
+             max_requests: int = None, warmup_requests: int = 0, seed: int = 42) -> dict:
+    """
+    Replay the weighted mix of scenarios with a fixed number of concurrent workers.
+    :param mix: Weight per scenario name, scenarios with weight 0 are not executed
+    :param concurrency: Number of workers, each worker has one query in flight
+    :param duration_seconds: Stop starting new queries after this many seconds
+    :param max_requests: Stop after this many queries, even if the duration has not passed
+    :param warmup_requests: Number of queries per scenario executed before the measurement
+    :return: Dict with the overall and per scenario throughput, latency percentiles and errors
+    """
+    names = [name for name, weight in mix.items() if weight > 0]
+    weights = [mix[name] for name in names]
+    unknown = [name for name in names if name not in scenarios]
+    if unknown:
+        raise ValueError(f"Unknown scenarios in the mix: {unknown}, choose from {sorted(scenarios)}")
+
+    for name in names:
+        for query in queries[name][:warmup_requests]:
+            scenarios[name](query)
+
+    samples = []
+    errors = {}
+    started = 0
+    lock = threading.Lock()
+
+    def worker(worker_id: int):
+        nonlocal started
+        rng = random.Random(seed + worker_id)
+        while time.perf_counter() < deadline:
+            with lock:
+                if max_requests is not None and started >= max_requests:
+                    return
+                started += 1
+            name = rng.choices(names, weights=weights)[0]
+            query = rng.choice(queries[name])
+            start = time.perf_counter()
+            try:
+                scenarios[name](query)
+                succeeded = True
+            except Exception as error:
+                succeeded = False
+                with lock:
+                    errors.setdefault(name, {}).setdefault(f"{type(error).__name__}: {error}"[:200], 0)
+                    errors[name][f"{type(error).__name__}: {error}"[:200]] += 1
+            with lock:
+                samples.append((name, time.perf_counter() - start, succeeded))
+
+    load_log.info(f"Run {names} with {concurrency} workers for {duration_seconds}s")
+    start = time.perf_counter()
+    deadline = start + duration_seconds
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    per_scenario = {}
+    for name in names:
+        latencies = [latency for sample_name, latency, _ in samples if sample_name == name]
+        if latencies:
+            per_scenario[name] = {
+                "requests": len(latencies),
+                "errors": sum(1 for sample_name, _, ok in samples if sample_name == name and not ok),
+                "throughput_per_second": len(latencies) / elapsed,
+                **latency_percentiles(latencies)
+            }
+
+    all_latencies = [latency for _, latency, _ in samples]
+    return {
+        "elapsed_seconds": elapsed,
+        "requests": len(samples),
+        "errors": sum(1 for _, _, ok in samples if not ok),
+        "throughput_per_second": len(samples) / elapsed,
+        **(latency_percentiles(all_latencies) if all_latencies else {}),
+        "scenarios": per_scenario,
+        "error_messages": errors
+    }
+
+
+def parse_mix(value: str) -> dict:
+    """ Parse a mix like knn=3,content=1 into the weight per scenario. """
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the query paths against local stand-ins")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run the mix")
+    parser.add_argument("--max-requests", type=int, default=None)
+    parser.add_argument("--warmup", type=int, default=2, help="Queries per scenario before the measurement")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help=f"Weights per scenario like knn=3,content=1, choose from {', '.join(DEFAULT_MIX)}")
+    parser.add_argument("--opensearch-latency-ms", type=float, default=0.0)
+    parser.add_argument("--openai-latency-ms", type=float, default=0.0)
+    parser.add_argument("--openai-token-latency-ms", type=float, default=0.0)
+    parser.add_argument("--no-embedding-cache", action="store_true", help="Embed every query, also repeated queries")
+    parser.add_argument("--opensearch-host", help="Use this OpenSearch with existing indexes instead of the stand-in")
+    parser.add_argument("--opensearch-port", type=int, default=9200)
+    parser.add_argument("--openai-api-base", help="Use this OpenAI compatible endpoint instead of the stand-in")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="load_report.json")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # One log line per request drowns the progress of the load test
+    logging.getLogger("opensearch").setLevel(logging.WARNING)
+    metrics = PrometheusMetrics()
+    set_metrics(metrics)
+
+    if args.opensearch_host:
+        config = {"host": args.opensearch_host, "port": args.opensearch_port, "use_ssl": False,
+                  "verify_certs": False, "auth": None, "pool_maxsize": max(20, args.concurrency)}
+        api_base = args.openai_api_base or openai.api_base
+        openai.api_key = os.getenv('OPEN_AI_API_KEY')
+    else:
+        config, api_base = start_stand_ins(opensearch_latency_ms=args.opensearch_latency_ms,
+                                           openai_latency_ms=args.openai_latency_ms,
+                                           openai_token_latency_ms=args.openai_token_latency_ms)
+        openai.api_key = "stand-in"
+    openai.api_base = api_base
+
+    pipeline = EmbeddingPipeline(api_key=openai.api_key)
+    embeddings = pipeline if args.no_embedding_cache else CachedEmbeddings(pipeline, cache_path=None)
+
+    documents = None
+    if not args.opensearch_host:
+        documents = seed_indexes(OpenSearchClient(config), embeddings)
+        load_log.info(f"Seeded the stand-in with {documents}")
+
+    scenarios, queries = create_scenarios(config, api_base, embeddings)
+    result = run_load(scenarios, queries, mix=args.mix, concurrency=args.concurrency,
+                      duration_seconds=args.duration, max_requests=args.max_requests,
+                      warmup_requests=args.warmup, seed=args.seed)
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "platform": platform.platform(),
+        "target": "real" if args.opensearch_host else "stand-in",
+        "documents": documents,
+        "concurrency": args.concurrency,
+        "mix": args.mix,
+        "latency_ms": {"opensearch": args.opensearch_latency_ms, "openai": args.openai_latency_ms,
+                       "openai_token": args.openai_token_latency_ms},
+        **result,
+        "embedding_cache": None if args.no_embedding_cache else embeddings.stats(),
+        "metrics": metrics.snapshot()
+    }
+    output_dir = os.path.dirname(args.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2, default=lambda value: float(value) if np.isscalar(value) else str(value))
+
+    print(f"{'scenario':15s} {'requests':>9s} {'errors':>7s} {'req/s':>8s} {'p50':>9s} {'p95':>9s} {'p99':>9s}")
+    for name, stats in report["scenarios"].items():
+        print(f"{name:15s} {stats['requests']:9d} {stats['errors']:7d} {stats['throughput_per_second']:8.1f} "
+              f"{stats['p50_ms']:7.1f}ms {stats['p95_ms']:7.1f}ms {stats['p99_ms']:7.1f}ms")
+    print(f"{'total':15s} {report['requests']:9d} {report['errors']:7d} {report['throughput_per_second']:8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,738 @@
+"""
+Local stand-ins for OpenSearch and OpenAI, to measure the query paths without AWS or OpenAI credentials.
+
+The OpenSearch stand-in keeps the documents in memory and implements the subset of the API that the OpenSearchClient,
+the AsyncOpenSearchClient and the langchain OpenSearchVectorSearch use: index and alias management, settings,
+component and index templates, bulk, search with match, knn and match_all queries, msearch, point in time and count.
+k-NN is exact, so results do not depend on graph parameters.
+
+The OpenAI stand-in serves deterministic embeddings, completions and chat completions with function calls. An
+embedding is the normalized sum of a pseudo random vector per word, so texts that share words are similar. Both
+stand-ins add a configurable latency to every request, completions also per streamed token.
+
+    python -m benchmark.stand_in --opensearch-port 9200 --openai-port 8089 --openai-latency-ms 200
+
+Point the clients to the stand-ins with the config {"host": "localhost", "port": 9200, "use_ssl": False} and the
+environment variable OPENAI_API_BASE=http://localhost:8089/v1 (or openai.api_base).
+"""
+import argparse
+import fnmatch
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import numpy as np
+
+stand_in_log = logging.getLogger("stand_in")
+
+WORD_PATTERN = re.compile(r"\w+")
+READ_OPERATIONS = ("_search", "_msearch", "_count")
+
+
+class StandInError(Exception):
+    def __init__(self, status: int, error_type: str, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.error_type = error_type
+        self.reason = reason
+
+
+class ReadWriteLock:
+    """
+    Many readers at the same time or one writer. A waiting writer holds back new readers, so the writes of a reindex
+    are not starved by a running load test.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writers_waiting = 0
+        self.writing = False
+
+    @contextmanager
+    def read(self):
+        with self.condition:
+            while self.writing or self.writers_waiting:
+                self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self.condition:
+            self.writers_waiting += 1
+            while self.writing or self.readers:
+                self.condition.wait()
+            self.writers_waiting -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+
+def tokenize(text) -> list:
+    return WORD_PATTERN.findall(str(text).casefold())
+
+
+def flatten_settings(settings: dict, prefix: str = "") -> dict:
+    """ Flatten nested settings into the index.* keys that flat_settings=true returns. """
+    flat = {}
+    for key, value in settings.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_settings(value, prefix=f"{name}."))
+        else:
+            flat[name if name.startswith("index.") else f"index.{name}"] = None if value is None else str(value)
+    return flat
+
+
+def merge_mappings(target: dict, source: dict) -> dict:
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge_mappings(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+def field_value(source: dict, field: str):
+    value = source
+    for part in field.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def filter_source(source: dict, source_filter) -> dict:
+    if source_filter is None or source_filter is True:
+        return source
+    if source_filter is False:
+        return None
+    if isinstance(source_filter, (str, list)):
+        source_filter = {"includes": [source_filter] if isinstance(source_filter, str) else source_filter}
+    includes = source_filter.get("includes") or []
+    excludes = source_filter.get("excludes") or []
+    return {key: value for key, value in source.items()
+            if (not includes or any(fnmatch.fnmatch(key, pattern) for pattern in includes))
+            and not any(fnmatch.fnmatch(key, pattern) for pattern in excludes)}
+
+
+class StandInIndex:
+    def __init__(self, name: str, settings: dict, mappings: dict):
+        self.name = name
+        self.settings = settings
+        self.mappings = mappings
+        self.documents = {}
+        self.version = 0
+        self.columns = {}
+
+    def vectors(self, field: str) -> tuple:
+        """ The positions and the matrix of the documents with the field, rebuilt only after the documents changed. """
+        return self.__column(("vectors", field), lambda values: (
+            [position for position, value in values],
+            np.asarray([value for _, value in values], dtype=np.float32)))
+
+    def terms(self, field: str) -> list:
+        """ The positions and the tokens of the documents with the field. """
+        return self.__column(("terms", field),
+                             lambda values: [(position, tokenize(value)) for position, value in values])
+
+    def __column(self, key: tuple, build):
+        # Concurrent searches may both build a missing column, the documents do not change while they search
+        cached = self.columns.get(key)
+        if cached is None or cached[0] != self.version:
+            values = [(position, field_value(source, key[1]))
+                      for position, source in enumerate(self.documents.values())]
+            cached = (self.version, build([(position, value) for position, value in values if value is not None]))
+            self.columns[key] = cached
+        return cached[1]
+
+    def stored_source(self, source: dict) -> dict:
+        excludes = self.mappings.get("_source", {}).get("excludes")
+        return filter_source(source, {"excludes": excludes}) if excludes else source
+
+
+def is_read_request(method: str, parts: list) -> bool:
+    if "point_in_time" in parts:
+        return False
+    return method in ("GET", "HEAD") or any(part in READ_OPERATIONS for part in parts[:2])
+
+
+class OpenSearchStandIn:
+    """ In memory implementation of the OpenSearch API subset used by this project. """
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.indices = {}
+        self.aliases = {}
+        self.component_templates = {}
+        self.index_templates = {}
+        self.pits = {}
+        self.lock = ReadWriteLock()
+
+    def handle(self, method: str, path: str, params: dict, body: bytes) -> tuple:
+        """
+        Searches, counts and other reads run concurrently, requests that change the indexes, aliases, templates or
+        points in time run one at a time.
+        :return: Tuple with the HTTP status and the JSON response, None for a HEAD request
+        """
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        parts = [unquote(part) for part in path.strip("/").split("/") if part]
+        try:
+            with self.lock.read() if is_read_request(method, parts) else self.lock.write():
+                return self.__route(method, parts, params, body)
+        except StandInError as error:
+            return error.status, {"error": {"type": error.error_type, "reason": error.reason}, "status": error.status}
+
+    def __route(self, method: str, parts: list, params: dict, body: bytes) -> tuple:
+        if not parts:
+            return 200, {"version": {"distribution": "opensearch", "number": "2.11.0"}, "tagline": "stand-in"}
+
+        if parts[0] == "_aliases":
+            return self.update_aliases(json.loads(body))
+        if parts[0] == "_alias":
+            return self.get_alias(parts[1], method)
+        if parts[0] == "_component_template":
+            return self.__template(self.component_templates, "component_templates", "component_template",
+                                   parts[1] if len(parts) > 1 else "*", method, body)
+        if parts[0] == "_index_template":
+            return self.__template(self.index_templates, "index_templates", "index_template",
+                                   parts[1] if len(parts) > 1 else "*", method, body)
+        if parts[:2] == ["_cluster", "health"]:
+            return self.health(parts[2] if len(parts) > 2 else "*")
+        if parts[0] == "_bulk":
+            return self.bulk(None, body)
+        if parts[0] == "_msearch":
+            return self.multi_search(None, body)
+        if parts == ["_search", "point_in_time"] and method == "DELETE":
+            return self.delete_pit(json.loads(body))
+        if parts[0] == "_search":
+            return self.search(None, json.loads(body) if body else {})
+
+        target = parts[0]
+        if len(parts) == 1:
+            if method == "PUT":
+                return self.create_index(target, json.loads(body) if body else {})
+            if method == "DELETE":
+                return self.delete_index(target, ignore_unavailable=params.get("ignore_unavailable") == "true")
+            if method == "HEAD":
+                return (200 if self.resolve(target, allow_missing=True) else 404), None
+            return self.get_indices(target)
+
+        operation = parts[1]
+        if operation == "_search" and len(parts) == 3 and parts[2] == "point_in_time":
+            return self.create_pit(target, params.get("keep_alive", "1m"))
+        if operation == "_search":
+            return self.search(target, json.loads(body) if body else {})
+        if operation == "_msearch":
+            return self.multi_search(target, body)
+        if operation == "_bulk":
+            return self.bulk(target, body)
+        if operation == "_count":
+            return self.count(target, json.loads(body) if body else {})
+        if operation == "_settings":
+            return self.settings(target, method, body)
+        if operation == "_alias":
+            return self.get_alias(parts[2], method, index_pattern=target)
+        if operation in ("_refresh", "_forcemerge", "_flush"):
+            self.resolve(target)
+            return 200, {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+        if operation == "_doc" and len(parts) == 3:
+            return self.index_document(target, parts[2], json.loads(body))
+        raise StandInError(400, "illegal_argument_exception",
+                           f"The stand-in does not support {method} /{'/'.join(parts)}")
+
+    def resolve(self, target: str, allow_missing: bool = False) -> list:
+        """ Resolve comma separated index names, aliases and wildcards to the names of existing indexes. """
+        names = []
+        for part in target.split(","):
+            if part in self.aliases:
+                names.extend(sorted(self.aliases[part]))
+            elif "*" in part:
+                names.extend(sorted(name for name in self.indices if fnmatch.fnmatch(name, part)))
+            elif part in self.indices:
+                names.append(part)
+            elif not allow_missing:
+                raise StandInError(404, "index_not_found_exception", f"no such index [{part}]")
+        return list(dict.fromkeys(names))
+
+    def create_index(self, name: str, body: dict) -> tuple:
+        if name in self.indices:
+            raise StandInError(400, "resource_already_exists_exception", f"index [{name}] already exists")
+
+        settings, mappings = {}, {}
+        matching = [template for template in self.index_templates.values()
+                    if any(fnmatch.fnmatch(name, pattern) for pattern in template.get("index_patterns", []))]
+        if matching:
+            template = max(matching, key=lambda item: item.get("priority", 0))
+            for component_name in template.get("composed_of", []):
+                component = self.component_templates.get(component_name, {}).get("template", {})
+                settings.update(flatten_settings(component.get("settings", {})))
+                merge_mappings(mappings, component.get("mappings", {}))
+            settings.update(flatten_settings(template.get("template", {}).get("settings", {})))
+            merge_mappings(mappings, template.get("template", {}).get("mappings", {}))
+        settings.update(flatten_settings(body.get("settings", {})))
+        merge_mappings(mappings, body.get("mappings", {}))
+        settings.setdefault("index.number_of_replicas", "1")
+
+        self.indices[name] = StandInIndex(name, settings, mappings)
+        return 200, {"acknowledged": True, "shards_acknowledged": True, "index": name}
+
+    def delete_index(self, target: str, ignore_unavailable: bool) -> tuple:
+        for name in self.resolve(target, allow_missing=ignore_unavailable or "*" in target):
+            del self.indices[name]
+            for indexes in self.aliases.values():
+                indexes.discard(name)
+        self.aliases = {alias: indexes for alias, indexes in self.aliases.items() if indexes}
+        return 200, {"acknowledged": True}
+
+    def get_indices(self, target: str) -> tuple:
+        names = self.resolve(target, allow_missing="*" in target)
+        return 200, {name: {"aliases": {alias: {} for alias, indexes in self.aliases.items() if name in indexes},
+                            "mappings": self.indices[name].mappings,
+                            "settings": self.indices[name].settings} for name in names}
+
+    def settings(self, target: str, method: str, body: bytes) -> tuple:
+        names = self.resolve(target)
+        if method == "PUT":
+            update = flatten_settings(json.loads(body))
+            for name in names:
+                for key, value in update.items():
+                    if value is None:
+                        self.indices[name].settings.pop(key, None)
+                    else:
+                        self.indices[name].settings[key] = value
+            return 200, {"acknowledged": True}
+        return 200, {name: {"settings": dict(self.indices[name].settings)} for name in names}
+
+    def health(self, target: str) -> tuple:
+        """ The stand-in has no replicas to allocate, every index is green. """
+        self.resolve(target)
+        return 200, {"cluster_name": "stand-in", "status": "green", "timed_out": False, "number_of_nodes": 1}
+
+    def update_aliases(self, body: dict) -> tuple:
+        for action in body.get("actions", []):
+            (kind, details), = action.items()
+            names = self.resolve(details["index"], allow_missing=kind == "remove")
+            if kind == "add":
+                self.aliases.setdefault(details["alias"], set()).update(names)
+            elif kind == "remove":
+                self.aliases.get(details["alias"], set()).difference_update(names)
+        self.aliases = {alias: indexes for alias, indexes in self.aliases.items() if indexes}
+        return 200, {"acknowledged": True}
+
+    def get_alias(self, name: str, method: str, index_pattern: str = None) -> tuple:
+        indexes = sorted(index for alias, members in self.aliases.items() if fnmatch.fnmatch(alias, name)
+                         for index in members
+                         if index_pattern is None or index in self.resolve(index_pattern, allow_missing=True))
+        if not indexes:
+            if method == "HEAD":
+                return 404, None
+            raise StandInError(404, "aliases_not_found_exception", f"alias [{name}] missing")
+        if method == "HEAD":
+            return 200, None
+        return 200, {index: {"aliases": {alias: {} for alias, members in self.aliases.items()
+                                         if index in members and fnmatch.fnmatch(alias, name)}}
+                     for index in indexes}
+
+    def __template(self, store: dict, list_key: str, item_key: str, name: str, method: str, body: bytes) -> tuple:
+        if method == "PUT" or (method == "POST" and body):
+            store[name] = json.loads(body)
+            return 200, {"acknowledged": True}
+        if method == "DELETE":
+            store.pop(name, None)
+            return 200, {"acknowledged": True}
+
+        names = sorted(template for template in store if fnmatch.fnmatch(template, name))
+        if method == "HEAD":
+            return (200 if names else 404), None
+        if not names and "*" not in name:
+            raise StandInError(404, "resource_not_found_exception", f"{item_key} matching [{name}] not found")
+        return 200, {list_key: [{"name": template, item_key: store[template]} for template in names]}
+
+    def index_document(self, target: str, doc_id: str, source: dict) -> tuple:
+        index = self.indices[self.__write_index(target)]
+        result = "updated" if doc_id in index.documents else "created"
+        index.documents[doc_id] = source
+        index.version += 1
+        return (200 if result == "updated" else 201), {"_index": index.name, "_id": doc_id, "result": result}
+
+    def bulk(self, target: str, body: bytes) -> tuple:
+        start = time.perf_counter()
+        lines = [line for line in body.decode("utf-8").split("\n") if line.strip()]
+        items = []
+        position = 0
+        while position < len(lines):
+            (operation, meta), = json.loads(lines[position]).items()
+            position += 1
+            source = None
+            if operation != "delete":
+                source = json.loads(lines[position])
+                position += 1
+            items.append({operation: self.__bulk_item(operation, meta, source, target)})
+        took = int((time.perf_counter() - start) * 1000)
+        return 200, {"took": took, "errors": any(list(item.values())[0]["status"] >= 300 for item in items),
+                     "items": items}
+
+    def __bulk_item(self, operation: str, meta: dict, source: dict, target: str) -> dict:
+        try:
+            index = self.indices[self.__write_index(meta.get("_index") or target)]
+        except StandInError as error:
+            return {"_index": meta.get("_index") or target, "_id": meta.get("_id"), "status": error.status,
+                    "error": {"type": error.error_type, "reason": error.reason}}
+
+        doc_id = str(meta.get("_id") or uuid.uuid4().hex)
+        item = {"_index": index.name, "_id": doc_id}
+        if operation == "delete":
+            if doc_id not in index.documents:
+                return {**item, "status": 404, "result": "not_found"}
+            del index.documents[doc_id]
+            index.version += 1
+            return {**item, "status": 200, "result": "deleted"}
+        if operation == "create" and doc_id in index.documents:
+            return {**item, "status": 409, "error": {"type": "version_conflict_engine_exception",
+                                                     "reason": f"[{doc_id}]: document already exists"}}
+        if operation == "update":
+            if doc_id not in index.documents:
+                return {**item, "status": 404, "error": {"type": "document_missing_exception",
+                                                         "reason": f"[{doc_id}]: document missing"}}
+            source = merge_mappings(dict(index.documents[doc_id]), source.get("doc", {}))
+
+        result = "updated" if doc_id in index.documents else "created"
+        index.documents[doc_id] = source
+        index.version += 1
+        return {**item, "status": 200 if result == "updated" else 201, "result": result}
+
+    def __write_index(self, target: str) -> str:
+        names = self.resolve(target)
+        if len(names) != 1:
+            raise StandInError(400, "illegal_argument_exception", f"[{target}] does not point to one write index")
+        return names[0]
+
+    def create_pit(self, target: str, keep_alive: str) -> tuple:
+        snapshot = [(index_name, doc_id, source) for index_name in self.resolve(target)
+                    for doc_id, source in self.indices[index_name].documents.items()]
+        pit_id = uuid.uuid4().hex
+        self.pits[pit_id] = snapshot
+        return 200, {"pit_id": pit_id, "creation_time": int(time.time() * 1000)}
+
+    def delete_pit(self, body: dict) -> tuple:
+        deleted = [{"pit_id": pit_id, "successful": self.pits.pop(pit_id, None) is not None}
+                   for pit_id in body.get("pit_id", [])]
+        return 200, {"pits": deleted}
+
+    def search(self, target: str, body: dict) -> tuple:
+        start = time.perf_counter()
+        if "pit" in body:
+            if body["pit"]["id"] not in self.pits:
+                raise StandInError(404, "search_context_missing_exception", "No search context found for the pit")
+            documents = self.pits[body["pit"]["id"]]
+        else:
+            documents = [(index_name, doc_id, source) for index_name in self.resolve(target)
+                         for doc_id, source in self.indices[index_name].documents.items()]
+
+        # Without a point in time all documents come from one index, its columns are reused between searches
+        names = {index_name for index_name, _, _ in documents}
+        cached = self.indices[names.pop()] if "pit" not in body and len(names) == 1 else None
+        scored = self.__score(documents, body.get("query", {"match_all": {}}), cached)
+        size = body.get("size", 10)
+        if "sort" in body:
+            # Sorting is only supported in document order, like the _doc sort used to page through a point in time
+            positions = sorted(scored)
+            after = body.get("search_after", [-1])[0]
+            selected = [(position, scored[position]) for position in positions if position > after][:size]
+        else:
+            ranked = sorted(scored.items(), key=lambda item: (-item[1], item[0]))
+            selected = ranked[body.get("from", 0):body.get("from", 0) + size]
+
+        hits = []
+        for position, score in selected:
+            index_name, doc_id, source = documents[position]
+            stored = self.indices[index_name].stored_source(source) if index_name in self.indices else source
+            hit = {"_index": index_name, "_id": doc_id, "_score": score,
+                   "_source": filter_source(stored, body.get("_source"))}
+            if "sort" in body:
+                hit["sort"] = [position]
+            hits.append(hit)
+
+        took = int((time.perf_counter() - start) * 1000)
+        response = {
+            "took": took,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": {"value": len(scored), "relation": "eq"},
+                     "max_score": max(scored.values()) if scored else None,
+                     "hits": hits}
+        }
+        if "pit" in body:
+            response["pit_id"] = body["pit"]["id"]
+        return 200, response
+
+    def __score(self, documents: list, query: dict, index: StandInIndex = None) -> dict:
+        """ Score per position of the matching documents, the documents of the index when it is provided. """
+        (query_type, clause), = query.items()
+        if query_type == "match_all":
+            return {position: 1.0 for position in range(len(documents))}
+
+        if query_type == "match":
+            (field, value), = clause.items()
+            terms = set(tokenize(value["query"] if isinstance(value, dict) else value))
+            if index is not None:
+                field_terms_list = index.terms(field)
+            else:
+                field_terms_list = [(position, tokenize(field_value(source, field)))
+                                    for position, (_, _, source) in enumerate(documents)
+                                    if field_value(source, field) is not None]
+            scores = {}
+            for position, field_terms in field_terms_list:
+                matches = sum(1 for term in field_terms if term in terms)
+                if matches:
+                    scores[position] = matches / (1.0 + 0.1 * len(field_terms))
+            return scores
+
+        if query_type == "knn":
+            (field, value), = clause.items()
+            query_vector = np.asarray(value["vector"], dtype=np.float32)
+            if index is not None:
+                positions, vectors = index.vectors(field)
+            else:
+                values = [(position, field_value(source, field)) for position, (_, _, source) in enumerate(documents)]
+                positions = [position for position, value in values if value is not None]
+                vectors = np.asarray([value for _, value in values if value is not None], dtype=np.float32)
+            if not positions:
+                return {}
+            distances = ((vectors - query_vector) ** 2).sum(axis=1)
+            nearest = np.argsort(distances)[:value.get("k", 10)]
+            return {positions[row]: float(1.0 / (1.0 + distances[row])) for row in nearest}
+
+        raise StandInError(400, "parsing_exception", f"The stand-in does not support the {query_type} query")
+
+    def multi_search(self, target: str, body: bytes) -> tuple:
+        start = time.perf_counter()
+        lines = [json.loads(line) for line in body.decode("utf-8").split("\n") if line.strip()]
+        responses = []
+        for header, search_body in zip(lines[0::2], lines[1::2]):
+            try:
+                _, response = self.search(header.get("index", target), search_body)
+                responses.append({**response, "status": 200})
+            except StandInError as error:
+                responses.append({"error": {"type": error.error_type, "reason": error.reason},
+                                  "status": error.status})
+        return 200, {"took": int((time.perf_counter() - start) * 1000), "responses": responses}
+
+    def count(self, target: str, body: dict) -> tuple:
+        documents = [(index_name, doc_id, source) for index_name in self.resolve(target)
+                     for doc_id, source in self.indices[index_name].documents.items()]
+        count = len(self.__score(documents, body["query"])) if "query" in body else len(documents)
+        return 200, {"count": count, "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0}}
+
+
+def fake_embedding(text: str, dimension: int = 1536) -> np.ndarray:
+    """ Deterministic embedding, the normalized sum of a pseudo random vector per word. """
+    vector = np.zeros(dimension, dtype=np.float32)
+    for word in tokenize(text) or [""]:
+        seed = int.from_bytes(hashlib.sha256(word.encode("utf-8")).digest()[:8], "little")
+        vector += np.random.default_rng(seed).standard_normal(dimension, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class OpenAIStandIn:
+    """ Deterministic stand-in for the embeddings, completions and chat completions endpoints of OpenAI. """
+
+    def __init__(self, latency_ms: float = 0.0, token_latency_ms: float = 0.0, dimension: int = 1536):
+        self.latency_ms = latency_ms
+        self.token_latency_ms = token_latency_ms
+        self.dimension = dimension
+
+    def handle(self, method: str, path: str, params: dict, body: bytes) -> tuple:
+        """ :return: Tuple with the HTTP status and the JSON response, or a generator of events for a stream """
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        request = json.loads(body) if body else {}
+        if path.endswith("/embeddings"):
+            return 200, self.embeddings(request)
+        if path.endswith("/chat/completions"):
+            return 200, self.chat_completion(request)
+        if path.endswith("/completions"):
+            return 200, self.completion(request)
+        return 404, {"error": {"message": f"Unknown path {path}", "type": "invalid_request_error"}}
+
+    def embeddings(self, request: dict) -> dict:
+        texts = request["input"] if isinstance(request["input"], list) else [request["input"]]
+        data = [{"object": "embedding", "index": position, "embedding": fake_embedding(text, self.dimension).tolist()}
+                for position, text in enumerate(texts)]
+        num_tokens = sum(len(tokenize(text)) for text in texts)
+        return {"object": "list", "data": data, "model": request.get("model"),
+                "usage": {"prompt_tokens": num_tokens, "total_tokens": num_tokens}}
+
+    def completion(self, request: dict):
+        prompt = request["prompt"][0] if isinstance(request["prompt"], list) else request["prompt"]
+        context = prompt.split("Question:")[0]
+        answer = " ".join(context.split()[-40:]) or "I don't know."
+        return self.__respond(request, "text_completion", prompt, answer,
+                              lambda text: {"text": text, "index": 0, "logprobs": None})
+
+    def chat_completion(self, request: dict):
+        messages = request.get("messages", [])
+        prompt = "\n".join(str(message.get("content") or "") for message in messages)
+        if request.get("functions"):
+            return self.__function_call(request, prompt)
+        answer = " ".join(prompt.split()[-40:])
+        return self.__respond(request, "chat.completion", prompt, answer,
+                              lambda text: {"index": 0, "delta": {"content": text}},
+                              message=lambda text: {"role": "assistant", "content": text})
+
+    def __function_call(self, request: dict, prompt: str) -> dict:
+        question = prompt.split("following input:")[-1].split("\n")[0].strip()
+        words = tokenize(question)
+        names = [function["name"] for function in request["functions"]]
+        if any(word in words for word in ("open", "opening", "hours", "close", "store", "shop")):
+            wanted = "opening_hours"
+        elif words and words[0] in ("how", "what", "can", "where", "why", "is", "do", "does"):
+            wanted = "content"
+        else:
+            wanted = "product"
+        function = next((item for item in request["functions"] if wanted in item["name"]), request["functions"][0])
+
+        capitalized = [word.strip("?.,!") for word in question.split()[1:] if word[:1].isupper()]
+        arguments = {name: (capitalized[-1] if capitalized else words[-1] if words else "") if name == "city"
+                     else question
+                     for name in function.get("parameters", {}).get("properties", {})}
+        stand_in_log.debug(f"Chose {function['name']} from {names} for '{question}'")
+        num_tokens = len(tokenize(prompt))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+            "model": request.get("model"),
+            "choices": [{"index": 0, "finish_reason": "function_call",
+                         "message": {"role": "assistant", "content": None,
+                                     "function_call": {"name": function["name"],
+                                                       "arguments": json.dumps(arguments)}}}],
+            "usage": {"prompt_tokens": num_tokens, "completion_tokens": 10, "total_tokens": num_tokens + 10}
+        }
+
+    def __respond(self, request: dict, kind: str, prompt: str, answer: str, chunk, message=None):
+        tokens = [f" {word}" if position else word for position, word in enumerate(answer.split())]
+        if request.get("stream"):
+            return self.__stream(request, kind, tokens, chunk)
+
+        if self.token_latency_ms:
+            time.sleep(self.token_latency_ms * len(tokens) / 1000)
+        choice = {"index": 0, "finish_reason": "stop"}
+        choice.update({"message": message(answer)} if message else {"text": answer, "logprobs": None})
+        num_prompt_tokens = len(tokenize(prompt))
+        return {"id": f"cmpl-{uuid.uuid4().hex}", "object": kind, "created": int(time.time()),
+                "model": request.get("model"), "choices": [choice],
+                "usage": {"prompt_tokens": num_prompt_tokens, "completion_tokens": len(tokens),
+                          "total_tokens": num_prompt_tokens + len(tokens)}}
+
+    def __stream(self, request: dict, kind: str, tokens: list, chunk):
+        stream_id = f"cmpl-{uuid.uuid4().hex}"
+        for token in tokens:
+            if self.token_latency_ms:
+                time.sleep(self.token_latency_ms / 1000)
+            yield {"id": stream_id, "object": f"{kind}.chunk" if kind.startswith("chat") else kind,
+                   "created": int(time.time()), "model": request.get("model"),
+                   "choices": [{**chunk(token), "finish_reason": None}]}
+        yield {"id": stream_id, "object": f"{kind}.chunk" if kind.startswith("chat") else kind,
+               "created": int(time.time()), "model": request.get("model"),
+               "choices": [{**chunk(""), "finish_reason": "stop"}]}
+
+
+def serve(app, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """ Serve the stand-in from a daemon thread, port 0 picks a free port, see server.server_port. """
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # The headers and the body are separate writes, with Nagle every response on a kept alive connection waits
+        # for the delayed ACK of the client
+        disable_nagle_algorithm = True
+
+        def __handle(self):
+            url = urlparse(self.path)
+            params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            if self.headers.get("Content-Encoding") == "gzip":
+                import gzip
+                body = gzip.decompress(body)
+
+            status, payload = app.handle(self.command, url.path, params, body)
+            if payload is not None and not isinstance(payload, dict):
+                self.__send_stream(payload)
+                return
+
+            data = b"" if payload is None else json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(data)
+
+        def __send_stream(self, events):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for event in events:
+                self.__write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.__write_chunk(b"data: [DONE]\n\n")
+            self.__write_chunk(b"")
+
+        def __write_chunk(self, data: bytes):
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = __handle
+
+        def log_message(self, format, *args):
+            stand_in_log.debug(format % args)
+
+    server = ThreadingHTTPServer((host, port), StandInHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stand_in_log.info(f"Serving {type(app).__name__} on http://{host}:{server.server_port}")
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the local OpenSearch and OpenAI stand-ins")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--opensearch-port", type=int, default=9200)
+    parser.add_argument("--opensearch-latency-ms", type=float, default=0.0)
+    parser.add_argument("--openai-port", type=int, default=8089)
+    parser.add_argument("--openai-latency-ms", type=float, default=0.0)
+    parser.add_argument("--openai-token-latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    serve(OpenSearchStandIn(latency_ms=args.opensearch_latency_ms), port=args.opensearch_port, host=args.host)
+    serve(OpenAIStandIn(latency_ms=args.openai_latency_ms, token_latency_ms=args.openai_token_latency_ms),
+          port=args.openai_port, host=args.host)
+    print(f"OPENAI_API_BASE=http://{args.host}:{args.openai_port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
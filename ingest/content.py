@@ -0,0 +1,168 @@
+"""
+Ingestion of the help documents into a new generation of the content index.
+
+Files are discovered in the data folder and chunked in a process pool. The chunks are streamed through a generator
+pipeline: drop chunks with the same text as an earlier chunk, embed the unique chunks in batches and bulk index them.
+Only a bounded number of files and one batch of chunks are in memory at the same time. When all chunks are indexed,
+the alias is switched to the new index.
+
+    python -m ingest.content --folder data
+"""
+import argparse
+import fnmatch
+import hashlib
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator
+
+from dotenv import load_dotenv
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from retriever import CachedEmbeddings, EmbeddingPipeline, OpenSearchClient, find_auth_opensearch
+from retriever.embedding_cache import normalize_text
+from util.iter_util import batched
+
+ingest_log = logging.getLogger("ingest")
+
+# The shop locations are indexed as stores, they are not help content
+EXCLUDE_FILES = ("help-shop-locations.txt",)
+
+
+def discover_files(folder: str = "./data", pattern: str = "help-*.txt", exclude: Iterable[str] = EXCLUDE_FILES) -> list:
+    """ Find the files to ingest in the folder and its sub folders, sorted to make the runs repeatable. """
+    found = []
+    for root, _, file_names in os.walk(folder):
+        for file_name in file_names:
+            if fnmatch.fnmatch(file_name, pattern) and file_name not in exclude:
+                found.append(os.path.join(root, file_name))
+    return sorted(found)
+
+
+def chunk_file(path: str, chunk_size: int = 300, chunk_overlap: int = 100) -> list:
+    """
+    Split the file into chunks, runs in a worker process so it can only use picklable arguments and results.
+    :return: List of dicts with the text of the chunk and the source and start_index metadata
+    """
+    with open(path, encoding="utf-8") as file:
+        text = file.read()
+
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        is_separator_regex=False,
+        add_start_index=True
+    )
+
+    return [{"text": document.page_content,
+             "metadata": {"source": os.path.basename(path), "start_index": document.metadata["start_index"]}}
+            for document in text_splitter.create_documents([text])]
+
+
+def chunk_files(paths: Iterable[str], chunk_size: int = 300, chunk_overlap: int = 100, max_workers: int = None,
+                max_pending_files: int = None) -> Iterator[dict]:
+    """
+    Chunk the files in a process pool and yield the chunks in the order of the files. At most max_pending_files are
+    submitted to the pool before their chunks are consumed, a slow consumer therefore halts the chunking.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending_files = max_pending_files or max_workers * 2
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append(executor.submit(chunk_file, path, chunk_size, chunk_overlap))
+            if len(pending) >= max_pending_files:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def unique_chunks(chunks: Iterable[dict], duplicates: dict) -> Iterator[tuple]:
+    """
+    Skip chunks with the same normalized text as an earlier chunk, the id of a chunk is the hash of that text. The
+    number of skipped chunks per source is counted in duplicates.
+    """
+    seen = set()
+    for chunk in chunks:
+        chunk_id = hashlib.sha256(normalize_text(chunk["text"]).encode("utf-8")).hexdigest()
+        if chunk_id in seen:
+            source = chunk["metadata"]["source"]
+            duplicates[source] = duplicates.get(source, 0) + 1
+            continue
+        seen.add(chunk_id)
+        yield chunk_id, chunk
+
+
+def embed_chunks(chunks: Iterable[tuple], embeddings, batch_size: int = 256) -> Iterator[tuple]:
+    """ Embed the texts per batch, only one batch of chunks is kept in memory. """
+    for batch in batched(chunks, batch_size):
+        vectors = embeddings.embed_documents([chunk["text"] for _, chunk in batch])
+        for (chunk_id, chunk), vector in zip(batch, vectors):
+            yield chunk_id, chunk, vector
+
+
+def to_index_actions(embedded_chunks: Iterable[tuple]) -> Iterator[dict]:
+    """ Create the same document structure as OpenSearchVectorSearch.add_documents with the default field names. """
+    for chunk_id, chunk, vector in embedded_chunks:
+        yield {
+            "_id": chunk_id,
+            "_source": {"text": chunk["text"], "vector_field": vector, "metadata": chunk["metadata"]}
+        }
+
+
+def ingest_content(client: OpenSearchClient, embeddings, paths: list, alias_name: str = None,
+                   chunk_size: int = 300, chunk_overlap: int = 100, batch_size: int = 256, max_workers: int = None,
+                   keep_generations: int = None) -> dict:
+    """
+    Chunk, embed and index the files into a new index and switch the alias to it.
+    :param paths: The files to ingest, see discover_files
+    :param max_workers: Number of processes to chunk with, defaults to the number of cores
+    :param keep_generations: Number of old indexes to keep after switching the alias, None keeps all
+    :return: Dict with the new index, the number of files, indexed chunks and duplicate chunks per source
+    """
+    duplicates = {}
+    chunks = unique_chunks(chunk_files(paths, chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                       max_workers=max_workers), duplicates)
+    actions = to_index_actions(embed_chunks(chunks, embeddings, batch_size=batch_size))
+    index_name = client.reindex(documents=actions, provided_alias_name=alias_name, keep_generations=keep_generations)
+
+    summary = {
+        "index": index_name,
+        "files": len(paths),
+        "chunks": client.count_docs(index_name)["count"],
+        "duplicates": duplicates
+    }
+    ingest_log.info(f"Ingested content from {len(paths)} files: {summary}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunk, embed and index the help documents into OpenSearch")
+    parser.add_argument("--folder", default="./data")
+    parser.add_argument("--pattern", default="help-*.txt")
+    parser.add_argument("--alias", default="sg-content")
+    parser.add_argument("--chunk-size", type=int, default=300)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=None, help="Number of chunking processes")
+    parser.add_argument("--keep-generations", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    paths = discover_files(args.folder, pattern=args.pattern)
+    if not paths:
+        raise ValueError(f"No files matching {args.pattern} found in {args.folder}")
+
+    client = OpenSearchClient(find_auth_opensearch(), alias_name=args.alias)
+    embeddings = CachedEmbeddings(EmbeddingPipeline(api_key=os.getenv('OPEN_AI_API_KEY')))
+
+    print(ingest_content(client, embeddings, paths=paths, alias_name=args.alias, chunk_size=args.chunk_size,
+                         chunk_overlap=args.chunk_overlap, batch_size=args.batch_size, max_workers=args.workers,
+                         keep_generations=args.keep_generations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Incremental ingestion of the BrickHeadz product CSV files.
+
+Rows are streamed through a generator pipeline: parse, derive image_name and id, hash the content, skip rows with an
+unchanged hash, embed the changed rows in batches and bulk upsert them. Products that disappeared from the files are
+deleted. The hashes of the indexed products are kept in a local manifest.
+
+    python -m ingest.products data/extract-data-brickheadz.csv data/all_brickheadz.csv
+"""
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+from typing import Iterable, Iterator
+
+from dotenv import load_dotenv
+
+from retriever import CachedEmbeddings, EmbeddingPipeline, OpenSearchClient, find_auth_opensearch
+from util.iter_util import batched
+
+ingest_log = logging.getLogger("ingest")
+
+# all_brickheadz.csv uses other column names than extract-data-brickheadz.csv
+COLUMN_ALIASES = {
+    "name": "title",
+    "num_pieces": "number_of_pieces",
+    "link": "product_link"
+}
+DROP_COLUMNS = ("Position",)
+
+
+def load_manifest(path: str) -> dict:
+    if not os.path.exists(path):
+        return {"index": None, "documents": {}}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_manifest(path: str, manifest: dict):
+    """ Write to a temporary file first, an interrupted run never leaves a corrupt manifest behind. """
+    manifest_dir = os.path.dirname(path)
+    if manifest_dir:
+        os.makedirs(manifest_dir, exist_ok=True)
+    with open(f"{path}.tmp", 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_rows(paths: Iterable[str]) -> Iterator[dict]:
+    for path in paths:
+        with open(path, newline='') as file:
+            for row in csv.DictReader(file):
+                yield row
+
+
+def derive_fields(rows: Iterable[dict], image_folder: str = "./images") -> Iterator[dict]:
+    """ Align the column names, drop the position and derive the image_name and the id. """
+    for row in rows:
+        product = {COLUMN_ALIASES.get(key, key): value for key, value in row.items() if key not in DROP_COLUMNS}
+        if product.get("image_link"):
+            product["image_name"] = product["image_link"].rsplit('/')[-1]
+            product["id"] = product["image_name"].split('.')[0]
+        else:
+            product["id"] = product["product_link"].rstrip('/').rsplit('-')[-1]
+            product["image_name"] = next((f"{product['id']}.{extension}" for extension in ("png", "jpg")
+                                          if os.path.exists(os.path.join(image_folder, f"{product['id']}.{extension}"))),
+                                         f"{product['id']}.png")
+        yield product
+
+
+def unique_products(products: Iterable[dict]) -> Iterator[dict]:
+    """ The first file that contains a product wins, later rows with the same id are skipped. """
+    seen = set()
+    for product in products:
+        if product["id"] not in seen:
+            seen.add(product["id"])
+            yield product
+
+
+def hash_products(products: Iterable[dict]) -> Iterator[tuple]:
+    for product in products:
+        content = json.dumps(product, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        yield product, hashlib.sha256(content).hexdigest()
+
+
+def changed_products(hashed_products: Iterable[tuple], known_hashes: dict, seen_ids: set) -> Iterator[tuple]:
+    """ Skip the products with the same hash as in the manifest, all ids are collected in seen_ids. """
+    for product, content_hash in hashed_products:
+        seen_ids.add(product["id"])
+        if known_hashes.get(product["id"]) != content_hash:
+            yield product, content_hash
+
+
+def embed_products(hashed_products: Iterable[tuple], embeddings, batch_size: int = 256) -> Iterator[tuple]:
+    """ Embed the titles per batch, only one batch of products is kept in memory. """
+    for batch in batched(hashed_products, batch_size):
+        vectors = embeddings.embed_documents([product["title"] for product, _ in batch])
+        for (product, content_hash), vector in zip(batch, vectors):
+            yield product, content_hash, vector
+
+
+def to_upsert_actions(embedded_products: Iterable[tuple], pending: dict) -> Iterator[dict]:
+    """ Create the same document structure as OpenSearchVectorSearch.add_texts with text_field title. """
+    for product, content_hash, vector in embedded_products:
+        pending[product["id"]] = content_hash
+        yield {
+            "_op_type": "index",
+            "_id": product["id"],
+            "_source": {"title": product["title"], "title_vector": vector, "metadata": product}
+        }
+
+
+def ingest_products(client: OpenSearchClient, embeddings, paths: list, manifest_path: str, alias_name: str = None,
+                    batch_size: int = 256, delete_missing: bool = True) -> dict:
+    """
+    Bring the index behind the alias in line with the provided CSV files, only changed products are embedded.
+    When the alias points to another index than the one in the manifest, all products are indexed again. When the
+    alias does not exist yet, all products are loaded into a new index with reindex and the alias is created for it.
+    :return: Dict with the number of unchanged, upserted, deleted and failed products
+    """
+    manifest = load_manifest(manifest_path)
+    current_index = client.current_index_for(alias_name)
+    if manifest["index"] != current_index:
+        ingest_log.info(f"Manifest belongs to {manifest['index']}, the alias points to {current_index}, index all")
+        manifest = {"index": current_index, "documents": {}}
+    known_hashes = manifest["documents"]
+
+    seen_ids = set()
+    pending = {}
+    products = hash_products(unique_products(derive_fields(read_rows(paths))))
+    actions = to_upsert_actions(embed_products(changed_products(products, known_hashes, seen_ids),
+                                               embeddings, batch_size=batch_size), pending)
+
+    if current_index is None:
+        # Indexing into the missing alias would create a concrete index with that name and dynamic mappings
+        ingest_log.info(f"The alias {alias_name or client.default_alias_name} does not exist, build a new index")
+        manifest["index"] = client.reindex(documents=actions, provided_alias_name=alias_name)
+        known_hashes.update(pending)
+        save_manifest(manifest_path, manifest)
+        summary = {"unchanged": 0, "upserted": len(pending), "deleted": 0, "failed": 0}
+        ingest_log.info(f"Ingested products from {paths}: {summary}")
+        return summary
+
+    num_upserted, failures = client.bulk_index(documents=actions, index_name=alias_name)
+
+    failed_ids = {next(iter(failure.values())).get("_id") for failure in failures}
+    for product_id, content_hash in pending.items():
+        if product_id not in failed_ids:
+            known_hashes[product_id] = content_hash
+
+    num_deleted = 0
+    missing_ids = [product_id for product_id in known_hashes if product_id not in seen_ids]
+    if delete_missing and missing_ids:
+        deletes = ({"_op_type": "delete", "_id": product_id} for product_id in missing_ids)
+        num_deleted, delete_failures = client.bulk_index(documents=deletes, index_name=alias_name)
+        # A product that is already gone is fine, it should leave the manifest as well
+        failures.extend(failure for failure in delete_failures if failure["delete"].get("status") != 404)
+        failed_ids.update(failure["delete"].get("_id") for failure in delete_failures
+                          if failure["delete"].get("status") != 404)
+        for product_id in missing_ids:
+            if product_id not in failed_ids:
+                del known_hashes[product_id]
+
+    save_manifest(manifest_path, manifest)
+    summary = {
+        "unchanged": len(seen_ids) - len(pending),
+        "upserted": num_upserted,
+        "deleted": num_deleted,
+        "failed": len(failures)
+    }
+    ingest_log.info(f"Ingested products from {paths}: {summary}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally ingest the product CSV files into OpenSearch")
+    parser.add_argument("paths", nargs="+", help="CSV files with products, the first file wins for duplicate ids")
+    parser.add_argument("--alias", default="sg-products")
+    parser.add_argument("--manifest", default="./manifests/sg-products.json")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--keep-missing", action="store_true", help="Do not delete products missing from the files")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    client = OpenSearchClient(find_auth_opensearch(), alias_name=args.alias)
+    embeddings = CachedEmbeddings(EmbeddingPipeline(api_key=os.getenv('OPEN_AI_API_KEY')))
+
+    print(ingest_products(client, embeddings, paths=args.paths, manifest_path=args.manifest,
+                          alias_name=args.alias, batch_size=args.batch_size, delete_missing=not args.keep_missing))
+
+
+if __name__ == '__main__':
+    main()
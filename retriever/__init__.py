@@ -1,11 +1,53 @@
+import importlib
+
 from retriever.opensearch_auth_local import find_auth_opensearch
 from retriever.opensearch import OpenSearchClient
-from retriever.opensearch_template import OpenSearchTemplate
+from retriever.opensearch_async import AsyncOpenSearchClient, gather_searches
+from retriever.opensearch_template import OpenSearchTemplate, sync_templates
+from retriever.result_cache import QueryResultCache
+from retriever.store_directory import StoreDirectory
+
+# These modules import langchain or faiss, which takes seconds. They are imported on first use of one of their names.
+_LAZY_IMPORTS = {
+    'CachedEmbeddings': 'retriever.embedding_cache',
+    'EmbeddingPipeline': 'retriever.embedding_pipeline',
+    'FaissVectorStore': 'retriever.faiss_store',
+    'export_documents': 'retriever.export',
+    'batch_search': 'retriever.batch_search',
+    'IntentRouter': 'retriever.intent_router',
+    'ContentAnswerer': 'retriever.content_qa',
+    'get_opensearch_connection': 'retriever.connection',
+    'create_vector_store': 'retriever.connection'
+}
 
 __all__ = [
     'OpenSearchClient',
+    'AsyncOpenSearchClient',
+    'gather_searches',
     'find_auth_opensearch',
-    'OpenSearchTemplate'
+    'OpenSearchTemplate',
+    'sync_templates',
+    'CachedEmbeddings',
+    'EmbeddingPipeline',
+    'FaissVectorStore',
+    'export_documents',
+    'batch_search',
+    'QueryResultCache',
+    'IntentRouter',
+    'StoreDirectory',
+    'ContentAnswerer',
+    'get_opensearch_connection',
+    'create_vector_store'
 ]
 
 
+def __getattr__(name: str):
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f"module 'retriever' has no attribute '{name}'")
+    value = getattr(importlib.import_module(_LAZY_IMPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,263 @@
+"""
+Search thousands of queries at once, for the nightly relevance evaluation over the query logs or for bulk search.
+
+Queries are read as a stream and embedded per batch, the embedding of the next batch overlaps with the search of the
+current batch. The k-NN queries are sent to OpenSearch in _msearch requests, several requests in parallel, or searched
+on a local FAISS index with the matrix of query vectors. Every result is written to JSONL or Parquet as soon as its
+batch is done. With a labels file, recall@k and nDCG@k are computed per query and averaged in the summary.
+
+    python -m retriever.batch_search queries.txt ./results/sg-products.jsonl --labels labels.jsonl --k 10
+    python -m retriever.batch_search queries.jsonl ./results/sg-products.parquet --faiss-index ./faiss/sg-products
+
+The queries file has one query per line, or one JSON object per line with the query and optionally the query_id.
+The labels file is JSONL with the query or the query_id and the relevant document ids, as a list or with a grade per
+id, or CSV with the columns query or query_id, doc_id and optionally grade.
+"""
+import argparse
+import csv
+import json
+import logging
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain.embeddings.base import Embeddings
+
+from retriever.embedding_cache import CachedEmbeddings
+from retriever.embedding_pipeline import EmbeddingPipeline
+from retriever.export import JsonLinesWriter, ParquetWriter
+from retriever.faiss_store import FaissVectorStore
+from retriever.opensearch import OpenSearchClient, knn_search_body
+from retriever.opensearch_auth_local import find_auth_opensearch
+from retriever.result_cache import normalize_query
+from util.iter_util import batched
+from util.metrics import get_metrics
+
+batch_log = logging.getLogger("batch_search")
+
+RESULT_COLUMNS = {"query_id": "string", "query": "string", "hits": "json", "error": "string",
+                  "recall": "float64", "ndcg": "float64"}
+
+
+def read_queries(path: str) -> Iterator[dict]:
+    """ Stream the queries with their query_id, the line number is the id when the file does not provide one. """
+    with open(path, encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                yield {"query_id": str(record.get("query_id", line_number)), "query": record["query"]}
+            else:
+                yield {"query_id": str(line_number), "query": line}
+
+
+def read_labels(path: str) -> dict:
+    """
+    Read the relevance labels.
+    :return: Dict with the grade per relevant document id, keyed by the query_id or by the normalized query
+    """
+    labels = {}
+    if path.endswith(".csv"):
+        with open(path, newline='', encoding="utf-8") as file:
+            for row in csv.DictReader(file):
+                key = row.get("query_id") or normalize_query(row["query"])
+                labels.setdefault(key, {})[row["doc_id"]] = float(row.get("grade") or 1)
+        return labels
+
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            label = json.loads(line)
+            relevant = label["relevant"]
+            if isinstance(relevant, list):
+                relevant = {doc_id: 1 for doc_id in relevant}
+            key = str(label["query_id"]) if "query_id" in label else normalize_query(label["query"])
+            labels[key] = {str(doc_id): float(grade) for doc_id, grade in relevant.items()}
+    return labels
+
+
+def recall_at_k(found_ids: list, relevant: dict, k: int) -> float:
+    relevant_ids = {doc_id for doc_id, grade in relevant.items() if grade > 0}
+    if not relevant_ids:
+        return 0.0
+    return len(relevant_ids.intersection(found_ids[:k])) / len(relevant_ids)
+
+
+def ndcg_at_k(found_ids: list, relevant: dict, k: int) -> float:
+    """ Normalized discounted cumulative gain with the gain 2^grade - 1, so graded labels count more. """
+    dcg = sum((2 ** relevant.get(doc_id, 0) - 1) / math.log2(rank + 2) for rank, doc_id in enumerate(found_ids[:k]))
+    ideal_grades = sorted((grade for grade in relevant.values() if grade > 0), reverse=True)[:k]
+    ideal_dcg = sum((2 ** grade - 1) / math.log2(rank + 2) for rank, grade in enumerate(ideal_grades))
+    return dcg / ideal_dcg if ideal_dcg else 0.0
+
+
+def embed_batches(queries: Iterable[dict], embeddings: Embeddings, batch_size: int = 256) -> Iterator[tuple]:
+    """
+    Embed the queries per batch, repeated queries in a batch are embedded once. The next batch is embedded while
+    the caller searches the current one.
+    """
+    def embed(batch: list) -> tuple:
+        texts = list(dict.fromkeys(query["query"] for query in batch))
+        with get_metrics().timer("stage", stage="batch_embedding"):
+            vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+        rows = {text: row for row, text in enumerate(texts)}
+        return batch, vectors[[rows[query["query"]] for query in batch]]
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = None
+        for batch in batched(queries, batch_size):
+            next_pending = executor.submit(embed, batch)
+            if pending is not None:
+                yield pending.result()
+            pending = next_pending
+        if pending is not None:
+            yield pending.result()
+
+
+def search_opensearch(client: OpenSearchClient, vectors: np.ndarray, k: int = 10, vector_field: str = "title_vector",
+                      text_field: str = "title", msearch_size: int = 50, max_workers: int = 4,
+                      num_candidates: int = None, index_name: str = None) -> list:
+    """
+    Execute a k-NN query per vector through _msearch requests of msearch_size queries, with max_workers requests in
+    flight at the same time.
+    :return: List with the hits per vector, or the error of the failed search
+    """
+    def search_chunk(chunk: np.ndarray) -> list:
+        responses = client.multi_search([
+            (index_name, knn_search_body(vector.tolist(), vector_field=vector_field, k=k,
+                                         num_candidates=num_candidates))
+            for vector in chunk
+        ])
+        return [{"error": json.dumps(response["error"], default=str)} if "error" in response else
+                {"hits": [{"id": hit["_id"], "score": hit["_score"], "text": hit["_source"].get(text_field)}
+                          for hit in response["hits"]["hits"]]}
+                for response in responses]
+
+    chunks = [vectors[start:start + msearch_size] for start in range(0, len(vectors), msearch_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return [result for chunk_results in executor.map(search_chunk, chunks) for result in chunk_results]
+
+
+def search_faiss(vector_store: FaissVectorStore, vectors: np.ndarray, k: int = 10) -> list:
+    """ Search the matrix of query vectors in one call, FAISS spreads the queries over its threads. """
+    distances, positions = vector_store.search(vectors, k=k)
+    return [{"hits": [{"id": vector_store.documents[position]["id"], "score": 1.0 / (1.0 + float(distance)),
+                       "text": vector_store.documents[position]["text"]}
+                      for distance, position in zip(row_distances, row_positions) if position >= 0]}
+            for row_distances, row_positions in zip(distances, positions)]
+
+
+def batch_search(queries: Iterable[dict], embeddings: Embeddings, output_path: str, client: OpenSearchClient = None,
+                 vector_store: FaissVectorStore = None, labels: dict = None, k: int = 10, batch_size: int = 256,
+                 output_format: str = None, **search_kwargs) -> dict:
+    """
+    Search all queries and write one result per query to the output file.
+    :param queries: Iterable or generator with dicts with the query_id and the query, see read_queries
+    :param client: Search with k-NN queries on OpenSearch, the default alias of the client is searched
+    :param vector_store: Search on the local FAISS index instead of OpenSearch
+    :param labels: Relevant documents per query_id or normalized query, see read_labels
+    :param output_format: jsonl or parquet, by default derived from the extension of the output path
+    :param search_kwargs: Additional arguments passed to search_opensearch, like msearch_size and max_workers
+    :return: Dict with the number of queries, labelled queries and errors, the mean recall@k and nDCG@k and the rate
+    """
+    if (client is None) == (vector_store is None):
+        raise ValueError("Provide either an OpenSearch client or a FAISS vector store to search with")
+    output_format = output_format or ("parquet" if output_path.endswith(".parquet") else "jsonl")
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    writer = ParquetWriter(output_path, columns=RESULT_COLUMNS) if output_format == "parquet" \
+        else JsonLinesWriter(output_path)
+
+    labels = labels or {}
+    num_queries = num_labelled = num_errors = 0
+    recall_sum = ndcg_sum = 0.0
+    start = time.perf_counter()
+    try:
+        for batch, vectors in embed_batches(queries, embeddings, batch_size=batch_size):
+            with get_metrics().timer("stage", stage="batch_search"):
+                if vector_store is not None:
+                    results = search_faiss(vector_store, vectors, k=k)
+                else:
+                    results = search_opensearch(client, vectors, k=k, **search_kwargs)
+
+            rows = []
+            for query, result in zip(batch, results):
+                relevant = labels.get(query["query_id"], labels.get(normalize_query(query["query"])))
+                found_ids = [hit["id"] for hit in result.get("hits", [])]
+                row = {**query, "hits": result.get("hits", []), "error": result.get("error"),
+                       "recall": None, "ndcg": None}
+                if relevant is not None and "error" not in result:
+                    row["recall"] = recall_at_k(found_ids, relevant, k)
+                    row["ndcg"] = ndcg_at_k(found_ids, relevant, k)
+                    recall_sum += row["recall"]
+                    ndcg_sum += row["ndcg"]
+                    num_labelled += 1
+                num_errors += "error" in result
+                rows.append(row)
+            writer.write(rows)
+            num_queries += len(rows)
+            batch_log.info(f"Searched {num_queries} queries")
+    finally:
+        writer.close()
+
+    seconds = time.perf_counter() - start
+    summary = {
+        "queries": num_queries,
+        "labelled": num_labelled,
+        "errors": num_errors,
+        f"recall@{k}": recall_sum / num_labelled if num_labelled else None,
+        f"ndcg@{k}": ndcg_sum / num_labelled if num_labelled else None,
+        "seconds": seconds,
+        "queries_per_second": num_queries / seconds if seconds else None,
+        "output": output_path
+    }
+    batch_log.info(f"Finished the batch search: {summary}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search a file with queries and evaluate the results")
+    parser.add_argument("queries", help="Text file with a query per line, or JSONL with the query and query_id")
+    parser.add_argument("output", help="File to write the results to, .jsonl or .parquet")
+    parser.add_argument("--labels", help="JSONL or CSV file with the relevant document ids per query")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--alias", default="sg-products")
+    parser.add_argument("--text-field", default="title")
+    parser.add_argument("--vector-field", default="title_vector")
+    parser.add_argument("--num-candidates", type=int, default=None)
+    parser.add_argument("--faiss-index", help="Folder with a saved FaissVectorStore to search instead of OpenSearch")
+    parser.add_argument("--batch-size", type=int, default=256, help="Number of queries to embed and search at once")
+    parser.add_argument("--msearch-size", type=int, default=50, help="Number of queries per _msearch request")
+    parser.add_argument("--workers", type=int, default=4, help="Number of parallel _msearch requests")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    embeddings = CachedEmbeddings(EmbeddingPipeline(api_key=os.getenv('OPEN_AI_API_KEY')))
+    labels = read_labels(args.labels) if args.labels else None
+
+    if args.faiss_index:
+        summary = batch_search(read_queries(args.queries), embeddings, output_path=args.output,
+                               vector_store=FaissVectorStore.load(path=args.faiss_index, embedding_function=embeddings),
+                               labels=labels, k=args.k, batch_size=args.batch_size, output_format=args.format)
+    else:
+        summary = batch_search(read_queries(args.queries), embeddings, output_path=args.output,
+                               client=OpenSearchClient(find_auth_opensearch(), alias_name=args.alias),
+                               labels=labels, k=args.k, batch_size=args.batch_size, output_format=args.format,
+                               vector_field=args.vector_field, text_field=args.text_field,
+                               msearch_size=args.msearch_size, max_workers=args.workers,
+                               num_candidates=args.num_candidates)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import logging
+import threading
+from typing import TYPE_CHECKING
+
+from opensearchpy import OpenSearch, RequestsHttpConnection
+
+if TYPE_CHECKING:
+    from langchain.embeddings.base import Embeddings
+    from langchain.vectorstores import OpenSearchVectorSearch
+
+connection_log = logging.getLogger("connection")
+
+DEFAULT_POOL_SETTINGS = {
+    "pool_maxsize": 20,
+    "keep_alive": True,
+    "timeout": 10,
+    "max_retries": 3,
+    "retry_on_timeout": True,
+    "http_compress": False
+}
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def pool_settings(config: dict) -> dict:
+    """ The pool settings from the config, missing settings use DEFAULT_POOL_SETTINGS. """
+    return {name: config.get(name, default) for name, default in DEFAULT_POOL_SETTINGS.items()}
+
+
+def auth_identity(auth) -> tuple:
+    """
+    The principal that signs the requests with the auth. Auth objects for the same principal, like the ones every call
+    of find_auth_opensearch creates, have the same identity. Auth that does not expose its principal is only equal to
+    itself.
+    """
+    if auth is None:
+        return None
+    if isinstance(auth, (tuple, list)):
+        return "basic", auth[0]
+
+    signer = getattr(auth, "signer", None)
+    if signer is not None:
+        credentials = signer.credentials
+        identity = getattr(credentials, "identity", None) or getattr(credentials, "access_key", None)
+        if identity is not None:
+            return "aws", signer.region, signer.service, identity
+    return "object", id(auth)
+
+
+def get_opensearch_connection(config: dict) -> OpenSearch:
+    """
+    Return the shared OpenSearch connection for the host, port, ssl options, principal and pool settings in the
+    config. The first call creates the connection with its pool, next calls reuse it. With keep_alive the requests
+    session behind the pool keeps connections open, so clients and vector stores in the same process reuse sockets
+    instead of doing a new TLS handshake. Without keep_alive every request closes its connection.
+    A config with other credentials or other pool settings for the same host gets a pool of its own, see auth_identity.
+    :param config: Dict with the host, port, auth and optionally use_ssl, verify_certs and the pool settings
+    pool_maxsize, keep_alive, timeout, max_retries, retry_on_timeout and http_compress
+    :return: The shared OpenSearch connection
+    """
+    use_ssl = config.get("use_ssl", True)
+    verify_certs = config.get("verify_certs", True)
+    settings = pool_settings(config)
+    key = (config["host"], config["port"], use_ssl, verify_certs, auth_identity(config.get("auth")),
+           tuple(sorted(settings.items())))
+    with _connections_lock:
+        if key not in _connections:
+            connection_log.info(f"Create connection pool for {config['host']}:{config['port']} with {settings}")
+            keep_alive = settings.pop("keep_alive")
+            _connections[key] = OpenSearch(
+                hosts=[{'host': config["host"], 'port': config['port']}],
+                use_ssl=use_ssl,
+                verify_certs=verify_certs,
+                http_auth=config.get("auth"),
+                connection_class=RequestsHttpConnection,
+                headers=None if keep_alive else {"connection": "close"},
+                **settings
+            )
+        return _connections[key]
+
+
+def create_vector_store(config: dict, index_name: str, embedding_function: "Embeddings") -> "OpenSearchVectorSearch":
+    """ Create the langchain vector store for the index on top of the shared OpenSearch connection. """
+    from retriever.shared_vector_store import SharedConnectionVectorSearch
+
+    return SharedConnectionVectorSearch(config=config, index_name=index_name, embedding_function=embedding_function)
+
+
+def close_connections():
+    with _connections_lock:
+        for connection in _connections.values():
+            connection.close()
+        _connections.clear()
@@ -0,0 +1,144 @@
+import logging
+import time
+from typing import Callable, List, Tuple
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import Document
+
+from retriever.embedding_pipeline import count_tokens
+from util.metrics import get_metrics
+
+qa_log = logging.getLogger("content_qa")
+
+DEFAULT_PROMPT = """Use the context to answer the question. If you don't know the
+    answer, just say that you don't know, don't make up an answer.
+
+    {context}
+
+    Question: {question}:"""
+
+
+class TokenCallback(BaseCallbackHandler):
+    """ Passes every streamed token to the callback and records the time to the first token. """
+
+    def __init__(self, on_token: Callable[[str], None] = None):
+        self.on_token = on_token
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            get_metrics().observe("time_to_first_token", self.first_token_at - self.started_at, stage="content_qa")
+        if self.on_token:
+            self.on_token(token)
+
+
+def shingles(text: str, size: int = 3) -> set:
+    words = text.casefold().split()
+    return {" ".join(words[position:position + size]) for position in range(max(1, len(words) - size + 1))}
+
+
+def jaccard(first: set, second: set) -> float:
+    return len(first & second) / len(first | second) if first or second else 1.0
+
+
+class ContentAnswerer:
+    """
+    Answers questions with the help content. More chunks than needed are retrieved, overlapping chunks of the same
+    source are merged using their start_index and near duplicates are dropped. The remaining chunks are packed into
+    the prompt in order of their score until the token budget is used. The answer is streamed token by token, the
+    llm must be created with streaming=True.
+    """
+
+    def __init__(self,
+                 vector_store,
+                 llm,
+                 prompt: str = DEFAULT_PROMPT,
+                 k: int = 8,
+                 max_context_tokens: int = 800,
+                 duplicate_threshold: float = 0.6,
+                 token_model: str = None):
+        """
+        :param vector_store: Vector store with the chunks, the chunks ingested by ingest.content have the source and
+        start_index in the metadata that are required to merge overlapping chunks
+        :param llm: The langchain LLM to answer with
+        :param prompt: Template with the context and question placeholders
+        :param k: Number of chunks to retrieve before removing duplicates
+        :param max_context_tokens: Maximum number of tokens of the context in the prompt
+        :param duplicate_threshold: Jaccard similarity of the word shingles above which a chunk is a near duplicate
+        :param token_model: Model of the tokenizer to count the tokens with, defaults to the model_name of the llm
+        """
+        self.vector_store = vector_store
+        self.llm = llm
+        self.prompt = prompt
+        self.k = k
+        self.max_context_tokens = max_context_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.token_model = token_model or getattr(llm, "model_name", None) or "gpt-3.5-turbo"
+
+    def retrieve(self, question: str) -> List[Tuple[Document, float]]:
+        with get_metrics().timer("stage", stage="content_retrieval"):
+            return self.vector_store.similarity_search_with_score(query=question, k=self.k)
+
+    def select_context(self, scored_documents: List[Tuple[Document, float]]) -> List[str]:
+        """ Merge overlapping chunks, drop near duplicates and pack the best chunks within the token budget. """
+        kept = []
+        for document, score in sorted(scored_documents, key=lambda item: item[1], reverse=True):
+            chunk = {"text": document.page_content, "score": score, "source": document.metadata.get("source"),
+                     "start": document.metadata.get("start_index")}
+            if not any(self.__merge_overlap(existing, chunk) for existing in kept):
+                kept.append(chunk)
+
+        unique = []
+        for chunk in kept:
+            chunk_shingles = shingles(chunk["text"])
+            if all(jaccard(chunk_shingles, existing) < self.duplicate_threshold for _, existing in unique):
+                unique.append((chunk, chunk_shingles))
+
+        # Count the joined context, the separators between the chunks take tokens as well
+        context = []
+        used_tokens = 0
+        for chunk, _ in unique:
+            num_tokens = count_tokens("\n\n".join(context + [chunk["text"]]), model=self.token_model)
+            if num_tokens <= self.max_context_tokens:
+                context.append(chunk["text"])
+                used_tokens = num_tokens
+        qa_log.debug(f"Packed {len(context)} of {len(scored_documents)} chunks in {used_tokens} tokens")
+        return context
+
+    def answer(self, question: str, on_token: Callable[[str], None] = None) -> str:
+        """
+        Answer the question, every token of the answer is passed to on_token as soon as it arrives.
+        :return: The complete answer
+        """
+        context = self.select_context(self.retrieve(question))
+        prompt = self.prompt.format(context="\n\n".join(context), question=question)
+
+        with get_metrics().timer("stage", stage="content_qa"):
+            answer = self.llm.predict(prompt, callbacks=[TokenCallback(on_token)])
+
+        # Streamed completions do not report their usage, so we count the tokens ourselves
+        get_metrics().increment("tokens", count_tokens(prompt, model=self.token_model), source="llm",
+                                stage="content_qa", type="prompt")
+        get_metrics().increment("tokens", count_tokens(answer, model=self.token_model), source="llm",
+                                stage="content_qa", type="completion")
+        return answer.strip()
+
+    @staticmethod
+    def __merge_overlap(existing: dict, chunk: dict) -> bool:
+        """ Merge the chunk into the existing chunk when both come from the same part of the same source. """
+        if existing["source"] is None or existing["source"] != chunk["source"] \
+                or existing["start"] is None or chunk["start"] is None:
+            return False
+        existing_end = existing["start"] + len(existing["text"])
+        chunk_end = chunk["start"] + len(chunk["text"])
+        if chunk["start"] > existing_end or existing["start"] > chunk_end:
+            return False
+
+        if chunk["start"] < existing["start"]:
+            existing["text"] = chunk["text"] + existing["text"][chunk_end - existing["start"]:]
+            existing["start"] = chunk["start"]
+        elif chunk_end > existing_end:
+            existing["text"] = existing["text"] + chunk["text"][existing_end - chunk["start"]:]
+        return True
@@ -0,0 +1,174 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import List
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from util.metrics import get_metrics
+
+cache_log = logging.getLogger("embedding_cache")
+
+
+def normalize_text(text: str) -> str:
+    """ Normalize unicode and whitespace, texts that only differ in whitespace share the same embedding. """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def embedding_cache_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings implementation, like OpenAIEmbeddings, with a cache. The cache has an in-memory LRU tier and
+    an on-disk SQLite tier. Entries are keyed by the model and the hash of the normalized text. Both tiers are bounded
+    by the number of items, the disk tier can also expire items after a time to live.
+    """
+
+    def __init__(self,
+                 embeddings: Embeddings,
+                 model_name: str = None,
+                 cache_path: str = "./.cache/embeddings.sqlite",
+                 max_memory_items: int = 10_000,
+                 max_disk_items: int = None,
+                 ttl_seconds: float = None):
+        self.embeddings = embeddings
+        self.model_name = model_name or getattr(embeddings, "model", None) or type(embeddings).__name__
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.ttl_seconds = ttl_seconds
+
+        self.memory = OrderedDict()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.connection = None
+        if cache_path:
+            cache_dir = os.path.dirname(cache_path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS embeddings ("
+                                    "key TEXT PRIMARY KEY, model TEXT, vector BLOB, "
+                                    "created_at REAL, accessed_at REAL)")
+            self.connection.commit()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_cache_key(self.model_name, text) for text in texts]
+        found = self.__lookup(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            with get_metrics().timer("embedding", model=self.model_name):
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+            found.update(self.__store(list(missing.keys()), vectors))
+
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = embedding_cache_key(self.model_name, text)
+        found = self.__lookup([key])
+        if key not in found:
+            with get_metrics().timer("embedding", model=self.model_name):
+                vector = self.embeddings.embed_query(text)
+            found.update(self.__store([key], [vector]))
+
+        return found[key].tolist()
+
+    def stats(self) -> dict:
+        with self.lock:
+            hits = self.hits_memory + self.hits_disk
+            total = hits + self.misses
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "memory_items": len(self.memory)
+            }
+
+    def __lookup(self, keys: List[str]) -> dict:
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+            hits_memory = sum(1 for key in keys if key in found)
+            hits_disk = 0
+
+            # A text can occur more than once in a batch, every occurrence counts as a hit
+            key_counts = Counter(keys)
+            disk_keys = [key for key in key_counts if key not in found]
+            if disk_keys and self.connection:
+                now = time.time()
+                for offset in range(0, len(disk_keys), 500):
+                    batch = disk_keys[offset:offset + 500]
+                    rows = self.connection.execute(
+                        f"SELECT key, vector, created_at FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                        batch).fetchall()
+                    for key, vector, created_at in rows:
+                        if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+                            continue
+                        found[key] = np.frombuffer(vector, dtype=np.float32)
+                        self.__remember(key, found[key])
+                        hits_disk += key_counts[key]
+                    self.connection.executemany("UPDATE embeddings SET accessed_at = ? WHERE key = ?",
+                                                [(now, key) for key, _, _ in rows])
+                self.connection.commit()
+
+            misses = sum(1 for key in keys if key not in found)
+            self.hits_memory += hits_memory
+            self.hits_disk += hits_disk
+            self.misses += misses
+
+        metrics = get_metrics()
+        metrics.increment("cache_requests", hits_memory, cache="embedding", result="hit_memory")
+        metrics.increment("cache_requests", hits_disk, cache="embedding", result="hit_disk")
+        metrics.increment("cache_requests", misses, cache="embedding", result="miss")
+        return found
+
+    def __store(self, keys: List[str], vectors: List[List[float]]) -> dict:
+        stored = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(keys, vectors)}
+        with self.lock:
+            for key, vector in stored.items():
+                self.__remember(key, vector)
+
+            if self.connection:
+                now = time.time()
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, model, vector, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(key, self.model_name, vector.tobytes(), now, now) for key, vector in stored.items()])
+                self.__evict_disk(now)
+                self.connection.commit()
+
+        cache_log.debug(f"Stored {len(stored)} embeddings for model {self.model_name}")
+        return stored
+
+    def __remember(self, key: str, vector: np.ndarray):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_items:
+            self.memory.popitem(last=False)
+
+    def __evict_disk(self, now: float):
+        if self.ttl_seconds is not None:
+            self.connection.execute("DELETE FROM embeddings WHERE created_at < ?", (now - self.ttl_seconds,))
+        if self.max_disk_items is not None:
+            self.connection.execute("DELETE FROM embeddings WHERE key IN ("
+                                    "SELECT key FROM embeddings ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                                    (self.max_disk_items,))
@@ -0,0 +1,160 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+import numpy as np
+import openai
+import tiktoken
+from langchain.embeddings.base import Embeddings
+
+from util.metrics import get_metrics
+
+pipeline_log = logging.getLogger("embedding_pipeline")
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket. The bucket holds at most capacity tokens and refills capacity tokens every period
+    seconds. Acquiring tokens blocks until enough tokens are available.
+    """
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0):
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait_for = (amount - self.tokens) / self.rate
+            time.sleep(wait_for)
+
+
+_encodings = {}
+
+
+def count_tokens(text: str, model: str = "text-embedding-ada-002") -> int:
+    """ Count the tokens using tiktoken, estimate four characters per token if the encoding is unavailable. """
+    if model not in _encodings:
+        try:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("cl100k_base")
+        except Exception as error:
+            pipeline_log.warning(f"Could not load the tiktoken encoding, estimating tokens instead: {error}")
+            _encodings[model] = None
+    encoding = _encodings[model]
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return (getattr(error, "http_status", None) == 429
+            or getattr(error, "status_code", None) == 429
+            or type(error).__name__ == "RateLimitError")
+
+
+class EmbeddingPipeline(Embeddings):
+    """
+    Creates embeddings for many texts at once. Texts are packed into batches bounded by the number of tokens and
+    the number of texts. Batches are sent concurrently, limited by the requests and tokens per minute of our quota.
+    Requests that hit the rate limit are retried with exponential backoff and jitter.
+    """
+
+    def __init__(self,
+                 model: str = "text-embedding-ada-002",
+                 api_key: str = None,
+                 max_batch_tokens: int = 50_000,
+                 max_batch_size: int = 512,
+                 max_workers: int = 4,
+                 requests_per_minute: int = 3_000,
+                 tokens_per_minute: int = 1_000_000,
+                 max_retries: int = 6,
+                 embed_batch_fn: Callable[[List[str]], List[List[float]]] = None):
+        self.model = model
+        self.api_key = api_key
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.embed_batch_fn = embed_batch_fn or self.__embed_with_openai
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Create the embeddings for the provided texts.
+        :param texts: The texts to embed
+        :return: float32 array with one row per text, in the order of the provided texts
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        batches = list(self.__create_batches(texts))
+        pipeline_log.info(f"Embedding {len(texts)} texts in {len(batches)} batches")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda batch: self.__embed_batch(*batch), batches))
+
+        return np.vstack(results)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed([text])[0].tolist()
+
+    def count_tokens(self, text: str) -> int:
+        return count_tokens(text, model=self.model)
+
+    def __create_batches(self, texts: List[str]):
+        batch = []
+        batch_tokens = 0
+        for text in texts:
+            num_tokens = max(1, self.count_tokens(text))
+            if batch and (len(batch) >= self.max_batch_size or batch_tokens + num_tokens > self.max_batch_tokens):
+                yield batch, batch_tokens
+                batch = []
+                batch_tokens = 0
+            batch.append(text)
+            batch_tokens += num_tokens
+
+        if batch:
+            yield batch, batch_tokens
+
+    def __embed_batch(self, batch: List[str], num_tokens: int) -> np.ndarray:
+        attempt = 0
+        while True:
+            self.request_bucket.acquire()
+            self.token_bucket.acquire(num_tokens)
+            try:
+                with get_metrics().timer("embedding_request", model=self.model):
+                    vectors = np.asarray(self.embed_batch_fn(batch), dtype=np.float32)
+                get_metrics().increment("tokens", num_tokens, source="embedding", model=self.model)
+                return vectors
+            except Exception as error:
+                if not is_rate_limit_error(error) or attempt >= self.max_retries:
+                    raise
+                get_metrics().increment("rate_limited", source="embedding", model=self.model)
+                backoff = random.uniform(0, min(60.0, 2 ** attempt))
+                pipeline_log.warning(f"Rate limited while embedding {len(batch)} texts, retry in {backoff:.1f}s")
+                time.sleep(backoff)
+                attempt += 1
+
+    def __embed_with_openai(self, batch: List[str]) -> List[List[float]]:
+        response = openai.Embedding.create(model=self.model, input=batch, api_key=self.api_key)
+        data = sorted(response["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in data]
@@ -0,0 +1,197 @@
+"""
+Export the documents and vectors of an index for offline analysis or to build a local FAISS index.
+
+The vectors are written into a preallocated float32 .npy file that is memory mapped, the other fields are written per
+page to documents.jsonl or documents.parquet. Memory use does not depend on the number of documents.
+
+    python -m retriever.export sg-products ./export/sg-products --format parquet
+"""
+import argparse
+import json
+import logging
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+
+from retriever.opensearch import OpenSearchClient
+from retriever.opensearch_auth_local import find_auth_opensearch
+
+export_log = logging.getLogger("export")
+
+VECTORS_FILE_NAME = "vectors.npy"
+DOCUMENTS_FILE_NAMES = {"jsonl": "documents.jsonl", "parquet": "documents.parquet"}
+DOCUMENT_COLUMNS = {"id": "string", "text": "string", "metadata": "json"}
+
+
+class JsonLinesWriter:
+    def __init__(self, path: str):
+        self.file = open(path, 'w', encoding="utf-8")
+
+    def write(self, documents: list):
+        for document in documents:
+            self.file.write(json.dumps(document, default=str, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """
+    Writes every batch as a row group. Columns of the json type are stored as a JSON string, which keeps the schema
+    fixed for values like the metadata that differ per document.
+    """
+
+    def __init__(self, path: str, columns: dict = None):
+        """
+        :param columns: The type per column, json or a pyarrow type name like string or float64. Defaults to the id,
+        text and metadata of the exported documents.
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as error:
+            raise ImportError("Writing parquet requires pyarrow, install it or use the jsonl format") from error
+
+        self.pyarrow = pyarrow
+        self.columns = columns or DOCUMENT_COLUMNS
+        self.schema = pyarrow.schema([(name, getattr(pyarrow, "string" if kind == "json" else kind)())
+                                      for name, kind in self.columns.items()])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, documents: list):
+        columns = {
+            name: [json.dumps(document[name], default=str, ensure_ascii=False) if kind == "json" else document[name]
+                   for document in documents]
+            for name, kind in self.columns.items()
+        }
+        self.writer.write_table(self.pyarrow.table(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def export_documents(client: OpenSearchClient, path: str, index_name: str = None, text_field: str = "title",
+                     vector_field: str = "title_vector", metadata_format: str = "jsonl", page_size: int = 1000,
+                     embedding_function=None) -> dict:
+    """
+    Export all documents of the index into the folder. Row i of vectors.npy belongs to line or row i of the
+    documents file, the documents have the id, text and metadata like the side store of the FaissVectorStore.
+    :param path: The folder to write vectors.npy and the documents file into
+    :param index_name: Overrides the default_alias_name of the client
+    :param metadata_format: jsonl or parquet
+    :param page_size: Number of documents to obtain per request and to write per batch
+    :param embedding_function: Opt in to embed the text when the vector is excluded from the _source, like with the
+    quantized mappings. This calls the embedding API for every such document. Without it, these documents fail the
+    export.
+    :return: Dict with the number of documents, the number of documents that were embedded again, the dimension and
+    the files
+    """
+    if metadata_format not in DOCUMENTS_FILE_NAMES:
+        raise ValueError(f"Unknown metadata format {metadata_format}, use jsonl or parquet")
+    os.makedirs(path, exist_ok=True)
+    vectors_path = os.path.join(path, VECTORS_FILE_NAME)
+    documents_path = os.path.join(path, DOCUMENTS_FILE_NAMES[metadata_format])
+
+    stats = {"reembedded": 0}
+    hits = client.iter_documents(index_name=index_name, page_size=page_size, stats=stats)
+    first_hit = next(hits, None)
+    if first_hit is None:
+        raise ValueError(f"There are no documents to export in {index_name or client.default_alias_name}")
+
+    total = stats["total"]
+    dimension = len(_to_vectors([first_hit], text_field, vector_field, embedding_function, stats)[0])
+    stats["reembedded"] = 0
+    vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=np.float32, shape=(total, dimension))
+    writer = ParquetWriter(documents_path) if metadata_format == "parquet" else JsonLinesWriter(documents_path)
+
+    num_exported = 0
+    try:
+        for page in _pages(first_hit, hits, page_size):
+            if num_exported + len(page) > total:
+                raise Exception(f"Found more than the {total} documents the export started with")
+            vectors[num_exported:num_exported + len(page)] = _to_vectors(page, text_field, vector_field,
+                                                                         embedding_function, stats)
+            writer.write([_to_document(hit, text_field, vector_field) for hit in page])
+            num_exported += len(page)
+            export_log.debug(f"Exported {num_exported} of {total} documents")
+    finally:
+        writer.close()
+        vectors.flush()
+        del vectors
+
+    if num_exported != total:
+        raise Exception(f"Exported {num_exported} documents, but the export started with {total}")
+
+    export_log.info(f"Exported {num_exported} documents with dimension {dimension} to {path}, "
+                    f"{stats['reembedded']} embedded again")
+    return {"documents": num_exported, "reembedded": stats["reembedded"], "dimension": dimension,
+            "vectors": vectors_path, "metadata": documents_path}
+
+
+def load_export(path: str) -> tuple:
+    """ Load the memory mapped vectors and the documents of an export in the jsonl format. """
+    vectors = np.load(os.path.join(path, VECTORS_FILE_NAME), mmap_mode="r")
+    with open(os.path.join(path, DOCUMENTS_FILE_NAMES["jsonl"]), encoding="utf-8") as file:
+        documents = [json.loads(line) for line in file if line.strip()]
+    return vectors, documents
+
+
+def _pages(first_hit: dict, hits, page_size: int):
+    page = [first_hit]
+    for hit in hits:
+        if len(page) >= page_size:
+            yield page
+            page = []
+        page.append(hit)
+    yield page
+
+
+def _to_vectors(page: list, text_field: str, vector_field: str, embedding_function, stats: dict) -> list:
+    missing = [hit["_source"].get(text_field, "") for hit in page if vector_field not in hit["_source"]]
+    if missing and embedding_function is None:
+        raise ValueError(f"The {vector_field} is not in the _source, provide an embedding_function to embed the text")
+    if missing and not stats.get("warned"):
+        stats["warned"] = True
+        export_log.warning(f"The {vector_field} is not in the _source, the {text_field} of these documents is embedded "
+                           f"again through the embedding function")
+    stats["reembedded"] += len(missing)
+    embedded = iter(embedding_function.embed_documents(missing)) if missing else iter([])
+    return [hit["_source"][vector_field] if vector_field in hit["_source"] else next(embedded) for hit in page]
+
+
+def _to_document(hit: dict, text_field: str, vector_field: str) -> dict:
+    source = hit["_source"]
+    metadata = source.get("metadata", {key: value for key, value in source.items()
+                                       if key not in (text_field, vector_field)})
+    return {"id": hit["_id"], "text": source.get(text_field), "metadata": metadata}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the documents and vectors of an index")
+    parser.add_argument("alias", help="Alias or index to export, like sg-products or sg-content")
+    parser.add_argument("path", help="Folder to write the export into")
+    parser.add_argument("--text-field", default="title")
+    parser.add_argument("--vector-field", default="title_vector")
+    parser.add_argument("--format", default="jsonl", choices=sorted(DOCUMENTS_FILE_NAMES))
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--reembed", action="store_true",
+                        help="Embed the text through OpenAI when the vector is not in the _source")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    client = OpenSearchClient(find_auth_opensearch(), alias_name=args.alias)
+    embedding_function = None
+    if args.reembed:
+        from retriever.embedding_cache import CachedEmbeddings
+        from retriever.embedding_pipeline import EmbeddingPipeline
+
+        embedding_function = CachedEmbeddings(EmbeddingPipeline(api_key=os.getenv('OPEN_AI_API_KEY')))
+    print(export_documents(client, path=args.path, text_field=args.text_field, vector_field=args.vector_field,
+                           metadata_format=args.format, page_size=args.page_size,
+                           embedding_function=embedding_function))
+
+
+if __name__ == '__main__':
+    main()
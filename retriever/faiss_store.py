@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+from typing import List, Tuple
+
+import faiss
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain.schema import Document
+
+from retriever.export import load_export
+
+faiss_log = logging.getLogger("faiss")
+
+INDEX_FILE_NAME = "index.faiss"
+DOCUMENTS_FILE_NAME = "documents.jsonl"
+
+
+def create_faiss_index(vectors: np.ndarray, index_type: str = "flat", m: int = 16, ef_construction: int = 512,
+                       ef_search: int = 512, nlist: int = 4, nprobe: int = 2, pq_m: int = 64, pq_bits: int = 8):
+    """
+    Create a FAISS index with L2 distance and add the provided vectors.
+    :param vectors: float32 matrix with one vector per row
+    :param index_type: One of flat, hnsw, ivf or ivfpq
+    :param m: Number of connections per node for hnsw
+    :param ef_construction: Size of the candidate list while building hnsw
+    :param ef_search: Size of the candidate list while searching hnsw
+    :param nlist: Number of clusters for ivf and ivfpq
+    :param nprobe: Number of clusters to visit while searching ivf and ivfpq
+    :param pq_m: Number of sub quantizers for ivfpq, must divide the dimension
+    :param pq_bits: Number of bits per sub quantizer for ivfpq
+    :return: The trained index containing the vectors
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    dimension = vectors.shape[1]
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dimension)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, m)
+        index.hnsw.efConstruction = ef_construction
+        index.hnsw.efSearch = ef_search
+    elif index_type == "ivf":
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dimension), dimension, nlist)
+        index.nprobe = nprobe
+    elif index_type == "ivfpq":
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dimension), dimension, nlist, pq_m, pq_bits)
+        index.nprobe = nprobe
+    else:
+        raise ValueError(f"Unknown FAISS index type {index_type}, use flat, hnsw, ivf or ivfpq")
+
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    faiss_log.info(f"Created a FAISS {index_type} index with {index.ntotal} vectors")
+    return index
+
+
+class FaissVectorStore:
+    """
+    Local vector store backed by a FAISS index. The position of a vector in the index refers to the document with
+    the id, text and metadata in the side store. Search returns the same shape as OpenSearchVectorSearch, the score
+    is computed the way the OpenSearch k-NN plugin does for l2: 1 / (1 + squared distance).
+    """
+
+    def __init__(self, index, documents: List[dict], embedding_function: Embeddings):
+        if index.ntotal != len(documents):
+            raise ValueError(f"The index contains {index.ntotal} vectors, but we have {len(documents)} documents")
+        self.index = index
+        self.documents = documents
+        self.embedding_function = embedding_function
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding_function: Embeddings, metadatas: List[dict] = None,
+                   ids: List[str] = None, vectors: np.ndarray = None, index_type: str = "flat", **index_params):
+        """
+        Create the store for the provided texts. When no vectors are provided, we embed the texts.
+        :param index_params: Parameters passed to create_faiss_index
+        """
+        if vectors is None:
+            vectors = np.asarray(embedding_function.embed_documents(texts), dtype=np.float32)
+        metadatas = metadatas if metadatas is not None else [{} for _ in texts]
+        ids = ids if ids is not None else [str(position) for position in range(len(texts))]
+
+        documents = [{"id": str(doc_id), "text": text, "metadata": metadata}
+                     for doc_id, text, metadata in zip(ids, texts, metadatas)]
+        return cls(create_faiss_index(vectors, index_type=index_type, **index_params), documents, embedding_function)
+
+    @classmethod
+    def from_export(cls, path: str, embedding_function: Embeddings, index_type: str = "flat", **index_params):
+        """
+        Create the store from an export of retriever.export in the jsonl format, the vectors are read from the memory
+        mapped file.
+        :param index_params: Parameters passed to create_faiss_index
+        """
+        vectors, documents = load_export(path)
+        return cls(create_faiss_index(vectors, index_type=index_type, **index_params), documents, embedding_function)
+
+    def save(self, path: str):
+        """ Write the index and the side store with the documents into the provided folder. """
+        os.makedirs(path, exist_ok=True)
+        faiss.write_index(self.index, os.path.join(path, INDEX_FILE_NAME))
+        with open(os.path.join(path, DOCUMENTS_FILE_NAME), 'w') as file:
+            for document in self.documents:
+                file.write(json.dumps(document, default=str) + "\n")
+        faiss_log.info(f"Saved the FAISS index with {self.index.ntotal} vectors to {path}")
+
+    @classmethod
+    def load(cls, path: str, embedding_function: Embeddings, mmap: bool = True):
+        """
+        Load the index and the side store from the provided folder. By default the index is memory mapped, index
+        types that do not support memory mapping are read into memory.
+        """
+        index_file = os.path.join(path, INDEX_FILE_NAME)
+        index = None
+        if mmap:
+            try:
+                index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError as error:
+                faiss_log.debug(f"Could not memory map {index_file}, reading it instead: {error}")
+        if index is None:
+            index = faiss.read_index(index_file)
+
+        with open(os.path.join(path, DOCUMENTS_FILE_NAME)) as file:
+            documents = [json.loads(line) for line in file if line.strip()]
+
+        return cls(index, documents, embedding_function)
+
+    def search(self, query_vectors: np.ndarray, k: int = 4) -> Tuple[np.ndarray, np.ndarray]:
+        """ Search for a matrix of query vectors, returns the squared distances and positions per query. """
+        query_vectors = np.ascontiguousarray(np.atleast_2d(query_vectors), dtype=np.float32)
+        return self.index.search(query_vectors, k)
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        distances, positions = self.search(np.asarray(embedding, dtype=np.float32), k=k)
+        return [(self.__to_document(position), 1.0 / (1.0 + float(distance)))
+                for distance, position in zip(distances[0], positions[0]) if position >= 0]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> List[Tuple[Document, float]]:
+        """
+        Search for the documents closest to the query. Additional arguments, like text_field and vector_field for
+        OpenSearchVectorSearch, are accepted and ignored.
+        """
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k=k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query=query, k=k, **kwargs)]
+
+    def __to_document(self, position: int) -> Document:
+        document = self.documents[position]
+        return Document(page_content=document["text"], metadata=document["metadata"])
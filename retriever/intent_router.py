@@ -0,0 +1,176 @@
+"""
+Route queries to a tool with the embeddings of labelled example queries. Check the thresholds of the router against
+the labelled queries, that are not part of the examples, for the embedding model in use:
+
+    python -m retriever.intent_router --min-scores 0.75 0.78 0.8 0.82 0.85 --min-margins 0 0.01 0.02 0.03 0.05
+
+The check prints the coverage, the precision and the number of out of scope queries routed to a tool per combination
+of thresholds. Choose the thresholds with the highest coverage that do not route an out of scope query and keep the
+precision at or above the target.
+"""
+import argparse
+import json
+import logging
+import os
+from typing import Callable, Dict, List
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain.embeddings.base import Embeddings
+
+from retriever.embedding_cache import CachedEmbeddings
+from retriever.embedding_pipeline import EmbeddingPipeline
+from util import load_json_body_from_file
+from util.metrics import get_metrics
+
+router_log = logging.getLogger("intent_router")
+
+# These thresholds have NOT been validated. They are estimates for text-embedding-ada-002, whose similarities lie
+# between 0.7 and 0.9 for most pairs of texts. Run the check above against config_files/intent_labels.json with the
+# embedding model in use and replace them, or set the thresholds explicitly, before relying on the router.
+DEFAULT_MIN_SCORE = 0.8
+DEFAULT_MIN_MARGIN = 0.02
+
+
+class IntentRouter:
+    """
+    Chooses the tool for a query without calling an LLM. Every tool has labelled example queries, the centroid of
+    their embeddings represents the tool. The query is embedded once and compared to the centroids with the cosine
+    similarity. The router only decides when the best tool is similar enough and clearly better than the runner-up,
+    otherwise the caller falls back to the LLM. Wrap the embeddings in CachedEmbeddings, the examples are then only
+    embedded once and the search that follows reuses the embedding of the query.
+    """
+
+    def __init__(self,
+                 embeddings: Embeddings,
+                 examples: Dict[str, List[str]],
+                 min_score: float = DEFAULT_MIN_SCORE,
+                 min_margin: float = DEFAULT_MIN_MARGIN,
+                 argument_extractors: Dict[str, Callable[[str], dict]] = None):
+        """
+        :param embeddings: The embeddings to embed the examples and queries with
+        :param examples: The example queries per tool name
+        :param min_score: Minimal cosine similarity between the query and the centroid of the chosen tool
+        :param min_margin: Minimal difference in similarity between the best and the second best tool
+        :param argument_extractors: Function per tool that creates the arguments for the tool from the query, or
+        returns None if it cannot. Tools without an extractor receive the query as the query argument.
+        """
+        self.embeddings = embeddings
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.argument_extractors = argument_extractors or {}
+
+        self.tools = list(examples.keys())
+        centroids = []
+        for tool in self.tools:
+            vectors = np.asarray(embeddings.embed_documents(examples[tool]), dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            centroids.append(vectors.mean(axis=0))
+        self.centroids = np.vstack(centroids)
+        self.centroids /= np.linalg.norm(self.centroids, axis=1, keepdims=True)
+        router_log.info(f"Created the intent router for {len(self.tools)} tools")
+
+    @classmethod
+    def from_file(cls, embeddings: Embeddings, file_name: str = "./config_files/intent_examples.json", **kwargs):
+        return cls(embeddings=embeddings, examples=load_json_body_from_file(file_name=file_name), **kwargs)
+
+    def scores(self, query_vectors: np.ndarray) -> np.ndarray:
+        """ Cosine similarity of every query vector to the centroid of every tool, one row per query. """
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        return (query_vectors / np.linalg.norm(query_vectors, axis=1, keepdims=True)) @ self.centroids.T
+
+    def route(self, query: str) -> dict:
+        """
+        Classify the query.
+        :return: Dict with the name and arguments of the chosen tool, or None for the name if the router is not
+        confident, and the score, the margin and the scores per tool
+        """
+        with get_metrics().timer("stage", stage="intent_router"):
+            scores = self.scores([self.embeddings.embed_query(query)])[0]
+
+        ranked = np.argsort(-scores)
+        best_score = float(scores[ranked[0]])
+        margin = best_score - float(scores[ranked[1]]) if len(ranked) > 1 else best_score
+        route = {
+            "name": None,
+            "arguments": None,
+            "score": best_score,
+            "margin": margin,
+            "scores": {tool: float(score) for tool, score in zip(self.tools, scores)}
+        }
+
+        if best_score >= self.min_score and margin >= self.min_margin:
+            tool = self.tools[ranked[0]]
+            extractor = self.argument_extractors.get(tool)
+            arguments = extractor(query) if extractor else {"query": query}
+            if arguments is not None:
+                route["name"] = tool
+                route["arguments"] = arguments
+
+        get_metrics().increment("routing", route="local" if route["name"] else "fallback")
+        router_log.debug(f"Routed '{query}' to {route['name']} with score {best_score:.3f} and margin {margin:.3f}")
+        return route
+
+
+def evaluate_thresholds(router: IntentRouter, labelled: List[dict], min_scores: List[float],
+                        min_margins: List[float]) -> List[dict]:
+    """
+    Evaluate every combination of thresholds against labelled queries, the argument extractors are not applied.
+    :param labelled: Dicts with the query and the expected tool, or None for the tool if the query is out of scope
+    :return: Dict per combination with the coverage, the share of in scope queries that is routed, the precision of
+    the routed in scope queries and the number of out of scope queries routed to a tool
+    """
+    scores = router.scores(router.embeddings.embed_documents([label["query"] for label in labelled]))
+    ranked = np.sort(scores, axis=1)[:, ::-1]
+    best_scores = ranked[:, 0]
+    margins = ranked[:, 0] - ranked[:, 1] if ranked.shape[1] > 1 else ranked[:, 0]
+    predicted = [router.tools[position] for position in np.argmax(scores, axis=1)]
+    expected = [label["tool"] for label in labelled]
+    in_scope = np.array([tool is not None for tool in expected])
+    correct = np.array([tool == prediction for tool, prediction in zip(expected, predicted)])
+
+    results = []
+    for min_score in min_scores:
+        for min_margin in min_margins:
+            routed = (best_scores >= min_score) & (margins >= min_margin)
+            routed_in_scope = int((routed & in_scope).sum())
+            results.append({
+                "min_score": min_score,
+                "min_margin": min_margin,
+                "coverage": routed_in_scope / int(in_scope.sum()) if in_scope.any() else 0.0,
+                "precision": int((routed & correct).sum()) / routed_in_scope if routed_in_scope else 1.0,
+                "out_of_scope_routed": int((routed & ~in_scope).sum())
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the thresholds of the intent router against labelled queries")
+    parser.add_argument("--examples", default="./config_files/intent_examples.json")
+    parser.add_argument("--labels", default="./config_files/intent_labels.json")
+    parser.add_argument("--min-scores", type=float, nargs="+", default=[0.75, 0.78, 0.8, 0.82, 0.85])
+    parser.add_argument("--min-margins", type=float, nargs="+", default=[0.0, 0.01, 0.02, 0.03, 0.05])
+    parser.add_argument("--target-precision", type=float, default=0.95)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    embeddings = CachedEmbeddings(EmbeddingPipeline(api_key=os.getenv('OPEN_AI_API_KEY')))
+
+    router = IntentRouter.from_file(embeddings=embeddings, file_name=args.examples)
+    results = evaluate_thresholds(router, load_json_body_from_file(file_name=args.labels),
+                                  min_scores=args.min_scores, min_margins=args.min_margins)
+    for result in results:
+        print(f"min_score {result['min_score']:.2f} min_margin {result['min_margin']:.2f}: "
+              f"coverage {result['coverage']:.2f} precision {result['precision']:.2f} "
+              f"out of scope routed {result['out_of_scope_routed']}")
+
+    acceptable = [result for result in results
+                  if result["out_of_scope_routed"] == 0 and result["precision"] >= args.target_precision]
+    best = max(acceptable, key=lambda result: (result["coverage"], result["min_score"]), default=None)
+    print(json.dumps({"defaults": {"min_score": DEFAULT_MIN_SCORE, "min_margin": DEFAULT_MIN_MARGIN},
+                      "recommended": best}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
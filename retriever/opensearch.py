@@ -1,24 +1,29 @@
 import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
+from typing import Iterable
 
-from opensearchpy import OpenSearch, RequestsHttpConnection
+from opensearchpy import ConnectionError as OpenSearchConnectionError, TransportError
+
+from retriever.connection import get_opensearch_connection
+from util.metrics import get_metrics
 
 search_log = logging.getLogger("search")
 
+RETRYABLE_BULK_STATUS = 429
+HYBRID_QUERIES = ("lexical", "semantic")
+BULK_METADATA_KEYS = ("_id", "_index", "routing")
+
 
 class OpenSearchClient:
     def __init__(self, config: dict, alias_name: str = None):
         # auth = (username, password)
 
-        self.opensearch = OpenSearch(
-            hosts=[{'host': config["host"], 'port': config['port']}],
-            use_ssl=True,
-            verify_certs=True,
-            http_auth=config["auth"],
-            connection_class=RequestsHttpConnection
-        )
-        if alias_name:
-            self.default_alias_name = alias_name
+        self.opensearch = get_opensearch_connection(config)
+        self.alias_listeners = []
+        self.default_alias_name = alias_name
 
     def ping(self):
         if self.opensearch.ping():
@@ -28,17 +33,25 @@ class OpenSearchClient:
             search_log.warning('Could not connect to OpenSearch')
             return False
 
-    def create_index(self, provided_alias_name: str = None):
+    def create_index(self, provided_alias_name: str = None, replace_existing: bool = True):
         """
         Create a new index. Name of the index is a combination of the provided or default alias name and a time stamp
         in the format of YearMonthDayHourMinuteSecond. Before the index is created, we remove it if it already exists.
         The settings and mappings are obtained from the shoes_index.json in the config folder.
+        :param replace_existing: When False an existing index with the same name is kept, the new index gets a
+        sequence number after the time stamp. A reindex within the same second must not remove the current index.
         :return: The name of the created index
         """
-        alias_name = self.__get_alias_name(provided_alias_name)
-        index_name = f'{alias_name}-{datetime.now().strftime("%Y%m%d%H%M%S")}'
+        index_name = new_index_name(self.__get_alias_name(provided_alias_name))
 
-        self.opensearch.indices.delete(index=index_name, ignore_unavailable=True)
+        if replace_existing:
+            self.opensearch.indices.delete(index=index_name, ignore_unavailable=True)
+        else:
+            base_name = index_name
+            sequence = 0
+            while self.opensearch.indices.exists(index=index_name):
+                sequence += 1
+                index_name = f'{base_name}-{sequence}'
         self.opensearch.indices.create(index=index_name)
 
         search_log.info(f'Created a new index with the name {index_name}')
@@ -54,13 +67,127 @@ class OpenSearchClient:
         """
         alias_name = self.__get_alias_name(provided_alias_name)
         search_log.info(f'Assign alias {alias_name} to {index_name}')
-        body = {
-            "actions": [
-                {"remove": {"index": f'{alias_name}-*', "alias": alias_name}},
-                {"add": {"index": index_name, "alias": alias_name}}
-            ]
-        }
-        self.opensearch.indices.update_aliases(body=body)
+        self.opensearch.indices.update_aliases(body=switch_alias_body(alias_name, index_name))
+        notify_alias_listeners(self.alias_listeners, alias_name, index_name)
+
+    def add_alias_listener(self, listener):
+        """
+        Register a function that is called with the alias and the index name after switch_alias_to moved the alias.
+        """
+        self.alias_listeners.append(listener)
+
+    def current_index_for(self, provided_alias_name: str = None) -> str:
+        """
+        Find the index or indexes the alias points to.
+        :return: The names of the indexes separated by a comma, None if the alias does not exist
+        """
+        alias_name = self.__get_alias_name(provided_alias_name)
+        if not self.opensearch.indices.exists_alias(name=alias_name):
+            return None
+        return ",".join(sorted(self.opensearch.indices.get_alias(name=alias_name).keys()))
+
+    def reindex(self, documents: Iterable[dict], provided_alias_name: str = None, id_field: str = None,
+                max_num_segments: int = 1, keep_generations: int = None, wait_for_status: str = "green",
+                health_timeout: float = 300, **bulk_kwargs):
+        """
+        Load the documents into a new index and only switch the alias when the new index is complete. During the
+        load, refresh and replicas are turned off. After the load we refresh, force merge and restore the settings
+        that the index obtained from the template. The alias is switched when the replicas are allocated and the
+        number of documents matches the unique ids that were indexed and not deleted again.
+        :param documents: Iterable or generator with the documents to index, see bulk_index
+        :param provided_alias_name: Overrides the default_alias_name.
+        :param id_field: Field of the document to use as the id
+        :param max_num_segments: Number of segments to force merge the new index into
+        :param keep_generations: Number of old indexes to keep after switching the alias, None keeps all
+        :param wait_for_status: Health status the new index must reach before the alias is switched, use yellow for a
+        single node cluster or None to not wait
+        :param health_timeout: Maximum number of seconds to wait for the health status
+        :param bulk_kwargs: Additional arguments passed to bulk_index
+        :return: The name of the new index
+        """
+        alias_name = self.__get_alias_name(provided_alias_name)
+        index_name = self.create_index(provided_alias_name=alias_name, replace_existing=False)
+
+        # Updates do not add documents, repeated ids overwrite each other and deletes remove them again
+        expected_ids = set()
+        num_without_id = 0
+
+        def track_expected(items: Iterable[dict]):
+            nonlocal num_without_id
+            for document in items:
+                op_type, header, _ = parse_bulk_document(document, id_field=id_field)
+                if "_id" not in header:
+                    num_without_id += op_type in ("index", "create")
+                elif op_type in ("index", "create"):
+                    expected_ids.add(header["_id"])
+                elif op_type == "delete":
+                    expected_ids.discard(header["_id"])
+                yield document
+
+        try:
+            settings = self.opensearch.indices.get_settings(index=index_name, flat_settings=True)
+            index_settings = settings[index_name]["settings"]
+            restore_settings = {
+                "index.number_of_replicas": index_settings.get("index.number_of_replicas", 1),
+                "index.refresh_interval": index_settings.get("index.refresh_interval")
+            }
+            self.opensearch.indices.put_settings(index=index_name, body={
+                "index.number_of_replicas": 0,
+                "index.refresh_interval": "-1"
+            })
+
+            num_success, failures = self.bulk_index(documents=track_expected(documents), index_name=index_name,
+                                                    id_field=id_field, **bulk_kwargs)
+            if failures:
+                raise Exception(f"Bulk indexing into {index_name} failed for {len(failures)} items")
+
+            self.opensearch.indices.refresh(index=index_name)
+            if max_num_segments:
+                self.opensearch.indices.forcemerge(index=index_name, max_num_segments=max_num_segments)
+            self.opensearch.indices.put_settings(index=index_name, body=restore_settings)
+            self.opensearch.indices.refresh(index=index_name)
+
+            if wait_for_status:
+                # The timeout of the health request is a query parameter, the request itself may take that long
+                health = self.opensearch.cluster.health(index=index_name, wait_for_status=wait_for_status,
+                                                        params={"timeout": f"{int(health_timeout)}s"},
+                                                        request_timeout=health_timeout + 10, ignore=408)
+                if health.get("timed_out"):
+                    raise Exception(f"Index {index_name} did not reach status {wait_for_status} within "
+                                    f"{health_timeout}s, the status is {health.get('status')}")
+
+            num_docs = self.count_docs(index_name)["count"]
+            num_expected = len(expected_ids) + num_without_id
+            if num_docs != num_expected:
+                raise Exception(f"Index {index_name} contains {num_docs} documents, expected {num_expected}")
+        except Exception:
+            search_log.error(f'Reindex into {index_name} failed, the alias {alias_name} is not switched')
+            self.delete_index(index_name)
+            raise
+
+        self.switch_alias_to(index_name=index_name, provided_alias_name=alias_name)
+
+        if keep_generations is not None:
+            self.delete_old_generations(keep_generations=keep_generations, provided_alias_name=alias_name)
+
+        return index_name
+
+    def delete_old_generations(self, keep_generations: int = 1, provided_alias_name: str = None):
+        """
+        Remove the old indexes for the alias, the index the alias points to is never removed.
+        :param keep_generations: Number of old indexes to keep next to the current index
+        :param provided_alias_name: Overrides the default_alias_name.
+        :return: The names of the removed indexes
+        """
+        alias_name = self.__get_alias_name(provided_alias_name)
+        current = set(self.opensearch.indices.get_alias(name=alias_name).keys())
+        generations = sorted(self.opensearch.indices.get(index=f'{alias_name}-*').keys(), reverse=True)
+        old_generations = [name for name in generations if name not in current][keep_generations:]
+        for index_name in old_generations:
+            search_log.info(f'Remove old generation {index_name} of alias {alias_name}')
+            self.delete_index(index_name)
+
+        return old_generations
 
     def index_document(self, id: str, document: dict, index_name: str):
         """
@@ -70,17 +197,197 @@ class OpenSearchClient:
         :param index_name: The index to use for indexing the shoe
         :return:
         """
-        search_log.info(f'Indexing item: {id} into index with name {index_name}')
+        search_log.debug(f'Indexing item: {id} into index with name {index_name}')
         self.opensearch.index(index=index_name, id=id, body=document)
 
+    def bulk_index(self, documents: Iterable[dict], index_name: str = None, id_field: str = None,
+                   chunk_size: int = 500, max_chunk_bytes: int = 10 * 1024 * 1024, max_in_flight: int = 4,
+                   max_retries: int = 3, initial_backoff: float = 1.0, max_backoff: float = 30.0):
+        """
+        Stream the provided documents through the _bulk endpoint. The documents are split into chunks bounded by
+        the number of documents and the number of bytes. Multiple chunks are sent concurrently, items that are
+        rejected with a 429 or a 5xx status are retried with exponential backoff. A bulk request that fails as a whole
+        with a 429, a 5xx or a connection error is retried the same way. Other failures, and the items that are still
+        rejected after max_retries, are collected and returned, we do not stop on the first failure.
+        A document can be a plain source document, or an action with the keys _op_type (index, create, update or
+        delete), _id, _index, routing and _source. An action needs an _op_type or a _source, the keys of a plain
+        source document are never taken as action metadata.
+        :param documents: Iterable or generator with the documents to index
+        :param index_name: The index or alias to index into, defaults to the alias of the client
+        :param id_field: Field of the document to use as the id when no _id is provided
+        :param chunk_size: Maximum number of documents per bulk request
+        :param max_chunk_bytes: Maximum size in bytes of the body of a bulk request
+        :param max_in_flight: Number of bulk requests that are executed concurrently
+        :param max_retries: Number of times a rejected item is retried
+        :param initial_backoff: Seconds to wait before the first retry, doubles for every next retry
+        :param max_backoff: Maximum number of seconds to wait between retries
+        :return: Tuple with the number of successful items and a list with the failed items
+        """
+        index_or_alias = self.__get_alias_name(index_name)
+        serializer = self.opensearch.transport.serializer
+        actions = (expand_bulk_action(document, serializer=serializer, id_field=id_field)
+                   for document in documents)
+
+        num_success = 0
+        failures = []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            in_flight = set()
+            for chunk in chunk_bulk_actions(actions, chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes):
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        chunk_success, chunk_failures = future.result()
+                        num_success += chunk_success
+                        failures.extend(chunk_failures)
+                in_flight.add(executor.submit(self.__send_bulk_chunk, chunk, index_or_alias, max_retries,
+                                              initial_backoff, max_backoff))
+            for future in in_flight:
+                chunk_success, chunk_failures = future.result()
+                num_success += chunk_success
+                failures.extend(chunk_failures)
+
+        duration = time.perf_counter() - start
+        search_log.info(f'Bulk indexed {num_success} items into {index_or_alias} in {duration:.2f}s, '
+                        f'{len(failures)} items failed')
+        return num_success, failures
+
+    def __send_bulk_chunk(self, chunk: list, index_name: str, max_retries: int, initial_backoff: float,
+                          max_backoff: float):
+        bulk_retry = BulkChunkRetry(chunk, max_retries=max_retries, initial_backoff=initial_backoff,
+                                    max_backoff=max_backoff)
+        while bulk_retry.chunk:
+            try:
+                bulk_retry.handle_response(self.opensearch.bulk(body=bulk_retry.body(), index=index_name))
+            except TransportError as error:
+                bulk_retry.handle_error(error)
+            if bulk_retry.chunk:
+                time.sleep(bulk_retry.next_backoff())
+
+        return bulk_retry.num_success, bulk_retry.failures
+
     def search(self, body, explain: bool = False, size: int = 10, index_name: str = None):
         index_or_alias = self.__get_alias_name(index_name)
-        search_results = self.opensearch.search(index=index_or_alias, body=body, explain=explain, size=size)
+        with get_metrics().timer("opensearch_request", operation="search"):
+            search_results = self.opensearch.search(index=index_or_alias, body=body, explain=explain, size=size)
+        observe_took(search_results, operation="search")
         return search_results
 
+    def iter_documents(self, index_name: str = None, query: dict = None, page_size: int = 1000,
+                       source_includes: list = None, source_excludes: list = None, keep_alive: str = "1m",
+                       sort: list = None, stats: dict = None):
+        """
+        Generator over all hits that match the query, one page is in memory at a time. The pages are read from a
+        point in time with search_after, so documents indexed during the export do not shift the pages. Domains
+        without point in time support fall back to a scroll.
+        :param index_name: Overrides the default_alias_name.
+        :param query: The query to match, defaults to all documents
+        :param page_size: Number of hits to obtain per request
+        :param source_includes: Fields of the _source to return
+        :param source_excludes: Fields of the _source to leave out, for instance the vector
+        :param keep_alive: Time to keep the point in time or scroll alive between two pages
+        :param sort: Sort of the pages, the default _doc is the cheapest and unique for our single shard indexes. For
+        indexes with more shards provide a sort that ends with a unique field.
+        :param stats: Optional dict that receives the total number of matching hits before the first hit is yielded
+        """
+        index_or_alias = self.__get_alias_name(index_name)
+        body = document_page_body(query=query, page_size=page_size, source_includes=source_includes,
+                                  source_excludes=source_excludes, sort=sort)
+
+        try:
+            pit_id = self.opensearch.create_pit(index=index_or_alias, keep_alive=keep_alive)["pit_id"]
+        except TransportError as error:
+            if not is_pit_unavailable(error):
+                raise
+            search_log.info(f"Point in time is not available for {index_or_alias}, fall back to scroll: {error}")
+            yield from self.__scroll_documents(index_or_alias, body=body, keep_alive=keep_alive, stats=stats)
+            return
+
+        try:
+            body["pit"] = {"id": pit_id, "keep_alive": keep_alive}
+            has_next_page = True
+            while has_next_page:
+                hits, has_next_page = next_pit_page(body, self.opensearch.search(body=body), stats=stats)
+                yield from hits
+        finally:
+            self.opensearch.delete_pit(body={"pit_id": [pit_id]})
+
+    def __scroll_documents(self, index_name: str, body: dict, keep_alive: str, stats: dict = None):
+        response = self.opensearch.search(index=index_name, body=body, scroll=keep_alive)
+        scroll_id = response["_scroll_id"]
+        try:
+            record_total_hits(response, stats)
+            while response["hits"]["hits"]:
+                yield from response["hits"]["hits"]
+                response = self.opensearch.scroll(scroll_id=scroll_id, scroll=keep_alive)
+                scroll_id = response.get("_scroll_id", scroll_id)
+        finally:
+            self.opensearch.clear_scroll(scroll_id=scroll_id)
+
+    def multi_search(self, searches: list) -> list:
+        """
+        Execute multiple searches in one _msearch request, for instance a product, a content and a store lookup.
+        :param searches: List with tuples of the index or alias name and the search body, when the name is None
+        the default alias is used
+        :return: List with the response for each search, a failed search has an error instead of hits
+        """
+        body = multi_search_body([(self.__get_alias_name(index_name), search_body)
+                                  for index_name, search_body in searches])
+        with get_metrics().timer("opensearch_request", operation="msearch"):
+            multi_response = self.opensearch.msearch(body=body)
+        return multi_search_responses(multi_response)
+
+    def hybrid_search(self, query: str, query_vector: list, text_field: str = "title",
+                      vector_field: str = "title_vector", size: int = 10, fusion: str = "rrf",
+                      lexical_weight: float = 0.5, semantic_weight: float = 0.5, rank_constant: int = 60,
+                      num_candidates: int = None, index_name: str = None) -> dict:
+        """
+        Execute the lexical match and the k-NN query in one _msearch request and fuse the results into one list.
+        :param query: The query text for the match on the text_field
+        :param query_vector: The embedding of the query for the k-NN query on the vector_field
+        :param size: Number of fused results to return
+        :param fusion: rrf for reciprocal rank fusion, or score for min-max normalized score combination
+        :param lexical_weight: Weight of the lexical results in the fusion
+        :param semantic_weight: Weight of the semantic results in the fusion
+        :param rank_constant: Constant k in the reciprocal rank fusion 1 / (k + rank)
+        :param num_candidates: Number of results to obtain from each query, defaults to twice the size
+        :param index_name: Overrides the default_alias_name.
+        :return: Dict with the fused hits, the hits of the lexical and the semantic query and the names of the
+        queries that failed, see fuse_hybrid_responses
+        """
+        index_or_alias = self.__get_alias_name(index_name)
+        responses = self.multi_search([
+            (index_or_alias, body) for body in hybrid_search_bodies(query, query_vector, text_field=text_field,
+                                                                    vector_field=vector_field,
+                                                                    num_candidates=num_candidates or size * 2)
+        ])
+        return fuse_hybrid_responses(responses, size=size, fusion=fusion, weights=[lexical_weight, semantic_weight],
+                                     rank_constant=rank_constant)
+
+    def knn_search(self, query_vector: list, vector_field: str = "title_vector", k: int = 10,
+                   num_candidates: int = None, rescore: bool = False, space_type: str = "l2",
+                   index_name: str = None) -> dict:
+        """
+        Execute a k-NN query that does not return the vector field. With quantized vectors the approximate scores are
+        less precise, in that case obtain more candidates and rescore them with the exact distance.
+        :param query_vector: The embedding of the query
+        :param k: Number of hits to return
+        :param num_candidates: Number of candidates to obtain from the k-NN query, defaults to k
+        :param rescore: Rescore the candidates with the exact distance to the full precision vector
+        :param space_type: Space type of the exact distance, should match the mapping of the vector field
+        :param index_name: Overrides the default_alias_name.
+        :return: The search response
+        """
+        index_or_alias = self.__get_alias_name(index_name)
+        body = knn_search_body(query_vector, vector_field=vector_field, k=k, num_candidates=num_candidates,
+                               rescore=rescore, space_type=space_type)
+        with get_metrics().timer("opensearch_request", operation="knn"):
+            response = self.opensearch.search(index=index_or_alias, body=body)
+        observe_took(response, operation="knn")
+        return response
+
     def count_docs(self, index_name: str = None):
-        req_index = index_name if index_name is not None else self.default_alias_name
-        return self.opensearch.count(index=req_index)
+        return self.opensearch.count(index=self.__get_alias_name(index_name))
 
     def set_component_template(self, name, body):
         self.opensearch.cluster.put_component_template(name=name, body=body)
@@ -100,16 +407,374 @@ class OpenSearchClient:
     def get_component_template(self, name: str):
         return self.opensearch.cluster.get_component_template(name=name)
 
+    def get_component_templates(self, name_pattern: str = "*") -> dict:
+        """ Obtain all component templates matching the pattern in one request, keyed by their name. """
+        return component_templates_by_name(
+            self.opensearch.cluster.get_component_template(name=name_pattern, ignore=404))
+
+    def get_index_templates(self, name_pattern: str = "*") -> dict:
+        """ Obtain all index templates matching the pattern in one request, keyed by their name. """
+        return index_templates_by_name(self.opensearch.indices.get_index_template(name=name_pattern, ignore=404))
+
     def delete_index(self, index_name: str):
         self.opensearch.indices.delete(index=index_name, ignore_unavailable=True)
 
     def __get_alias_name(self, provided_alias_name: str = None) -> str:
-        alias_name = provided_alias_name if provided_alias_name is not None else self.default_alias_name
+        return resolve_alias_name(provided_alias_name, self.default_alias_name)
+
+
+# The request bodies and the handling of the responses are shared by the OpenSearchClient and the
+# AsyncOpenSearchClient, the clients only execute the requests.
+
+def resolve_alias_name(provided_alias_name: str, default_alias_name: str) -> str:
+    alias_name = provided_alias_name if provided_alias_name is not None else default_alias_name
+
+    if not alias_name:
+        search_log.warning("We mandate using aliases for an index. Provided the alias while construction the client"
+                           "or provided it with the appropriate function call")
+        raise ValueError("We mandate using aliases for an index. Provided the alias while construction the client"
+                         "or provided it with the appropriate function call")
+
+    return alias_name
+
+
+def new_index_name(alias_name: str) -> str:
+    return f'{alias_name}-{datetime.now().strftime("%Y%m%d%H%M%S")}'
+
+
+def switch_alias_body(alias_name: str, index_name: str) -> dict:
+    """ Remove the alias from all generations of the alias and add it to the index in one atomic request. """
+    return {
+        "actions": [
+            {"remove": {"index": f'{alias_name}-*', "alias": alias_name}},
+            {"add": {"index": index_name, "alias": alias_name}}
+        ]
+    }
+
+
+def notify_alias_listeners(listeners: list, alias_name: str, index_name: str):
+    for listener in listeners:
+        listener(alias_name, index_name)
+
+
+def component_templates_by_name(response: dict) -> dict:
+    return {component["name"]: component["component_template"]
+            for component in response.get("component_templates", [])}
+
+
+def index_templates_by_name(response: dict) -> dict:
+    return {template["name"]: template["index_template"] for template in response.get("index_templates", [])}
+
+
+def document_page_body(query: dict = None, page_size: int = 1000, source_includes: list = None,
+                       source_excludes: list = None, sort: list = None) -> dict:
+    """ Body for the pages of iter_documents, without the point in time. """
+    body = {
+        "size": page_size,
+        "query": query or {"match_all": {}},
+        "sort": sort or ["_doc"],
+        "track_total_hits": True
+    }
+    if source_includes or source_excludes:
+        body["_source"] = {"includes": source_includes or [], "excludes": source_excludes or []}
+    return body
+
+
+def is_pit_unavailable(error: TransportError) -> bool:
+    """ Domains without point in time support answer with one of these statuses, use a scroll instead. """
+    return error.status_code in (400, 404, 405)
+
+
+def record_total_hits(response: dict, stats: dict = None):
+    if stats is not None:
+        stats.setdefault("total", response["hits"]["total"]["value"])
+
+
+def next_pit_page(body: dict, response: dict, stats: dict = None) -> tuple:
+    """
+    Handle a page of a point in time search, the body is updated to request the next page.
+    :return: Tuple with the hits of the page and whether there is a next page
+    """
+    hits = response["hits"]["hits"]
+    record_total_hits(response, stats)
+    if len(hits) < body["size"]:
+        return hits, False
+    body["search_after"] = hits[-1]["sort"]
+    body["pit"]["id"] = response.get("pit_id", body["pit"]["id"])
+    return hits, True
+
+
+def multi_search_body(searches: list) -> list:
+    """ :param searches: List with tuples of the index or alias name and the search body """
+    body = []
+    for index_name, search_body in searches:
+        body.append({"index": index_name})
+        body.append(search_body)
+    return body
+
+
+def multi_search_responses(multi_response: dict) -> list:
+    observe_took(multi_response, operation="msearch")
+    responses = multi_response["responses"]
+    for response in responses:
+        if "error" in response:
+            search_log.warning(f'One of the searches in the multi search failed: {response["error"]}')
+    return responses
+
+
+def observe_took(response: dict, operation: str):
+    """ Record the time OpenSearch reports, the difference with the request time is spent in transport. """
+    if "took" in response:
+        get_metrics().observe("opensearch_took", response["took"] / 1000, operation=operation)
+
+
+def knn_search_body(query_vector: list, vector_field: str, k: int, num_candidates: int = None, rescore: bool = False,
+                    space_type: str = "l2") -> dict:
+    """
+    Body for a k-NN query on the vector field. With rescore, the top num_candidates per shard are scored again by the
+    exact knn_score script. The script reads the full precision vector from the doc values, not from the _source.
+    """
+    num_candidates = max(num_candidates or k, k)
+    body = {
+        "size": k,
+        "_source": {"excludes": [vector_field]},
+        "query": {"knn": {vector_field: {"vector": query_vector, "k": num_candidates}}}
+    }
+    if rescore:
+        body["rescore"] = {
+            "window_size": num_candidates,
+            "query": {
+                "rescore_query": {
+                    "script_score": {
+                        "query": {"match_all": {}},
+                        "script": {
+                            "source": "knn_score",
+                            "lang": "knn",
+                            "params": {"field": vector_field, "query_value": query_vector, "space_type": space_type}
+                        }
+                    }
+                },
+                "query_weight": 0.0,
+                "rescore_query_weight": 1.0
+            }
+        }
+    return body
+
+
+def hybrid_search_bodies(query: str, query_vector: list, text_field: str, vector_field: str,
+                         num_candidates: int) -> list:
+    """ Bodies of the lexical match and the k-NN query of a hybrid search, in the order of HYBRID_QUERIES. """
+    source = {"excludes": [vector_field]}
+    return [
+        {"size": num_candidates, "_source": source, "query": {"match": {text_field: query}}},
+        {"size": num_candidates, "_source": source,
+         "query": {"knn": {vector_field: {"vector": query_vector, "k": num_candidates}}}}
+    ]
+
+
+def fuse_hybrid_responses(responses: list, size: int, fusion: str, weights: list, rank_constant: int = 60) -> dict:
+    """
+    Fuse the responses of the hybrid search bodies. A query that failed is logged and left out of the fusion, the
+    results of the other query are still returned. Only when both queries failed an exception is raised.
+    :param responses: The _msearch responses for the bodies of hybrid_search_bodies
+    :param weights: The weight of the lexical and the semantic results
+    :return: Dict with the fused hits, the hits per query and the names of the failed queries
+    """
+    result = {"hits": [], "lexical": [], "semantic": [], "failed": []}
+    result_lists = []
+    result_weights = []
+    for name, response, weight in zip(HYBRID_QUERIES, responses, weights):
+        if "error" in response:
+            search_log.warning(f'The {name} query of the hybrid search failed, it is left out of the fusion: '
+                               f'{response["error"]}')
+            result["failed"].append(name)
+            continue
+        hits = response["hits"]["hits"]
+        result[name] = hits[:size]
+        result_lists.append(hits)
+        result_weights.append(weight)
+
+    if not result_lists:
+        raise Exception(f'All queries of the hybrid search failed: {[response["error"] for response in responses]}')
+
+    with get_metrics().timer("fusion", fusion=fusion):
+        fused = fuse_results(result_lists, fusion=fusion, weights=result_weights, rank_constant=rank_constant)
+    result["hits"] = fused[:size]
+    return result
+
+
+def fuse_results(result_lists: list, fusion: str, weights: list, rank_constant: int = 60) -> list:
+    """ Fuse lists of hits with rrf for reciprocal rank fusion or score for normalized score combination. """
+    if fusion == "rrf":
+        return reciprocal_rank_fusion(result_lists, weights=weights, rank_constant=rank_constant)
+    if fusion == "score":
+        return normalized_score_fusion(result_lists, weights=weights)
+    raise ValueError(f"Unknown fusion {fusion}, use rrf or score")
+
+
+def reciprocal_rank_fusion(result_lists: list, weights: list, rank_constant: int = 60) -> list:
+    """ Fuse lists of hits using the weighted sum of 1 / (rank_constant + rank) for every list a hit appears in. """
+    return _fuse_hits(result_lists, [[weight / (rank_constant + rank) for rank in range(1, len(hits) + 1)]
+                                     for hits, weight in zip(result_lists, weights)])
+
+
+def normalized_score_fusion(result_lists: list, weights: list) -> list:
+    """ Fuse lists of hits using the weighted sum of the scores, min-max normalized per list. """
+    fused_scores = []
+    for hits, weight in zip(result_lists, weights):
+        scores = [hit["_score"] for hit in hits]
+        low, high = (min(scores), max(scores)) if scores else (0.0, 0.0)
+        fused_scores.append([weight * ((score - low) / (high - low) if high > low else 1.0) for score in scores])
+    return _fuse_hits(result_lists, fused_scores)
+
+
+def _fuse_hits(result_lists: list, fused_scores: list) -> list:
+    hits_by_id = {}
+    for hits, scores in zip(result_lists, fused_scores):
+        for hit, score in zip(hits, scores):
+            if hit["_id"] not in hits_by_id:
+                hits_by_id[hit["_id"]] = {**hit, "_score": 0.0}
+            hits_by_id[hit["_id"]]["_score"] += score
+
+    return sorted(hits_by_id.values(), key=lambda hit: hit["_score"], reverse=True)
+
+
+class BulkChunkRetry:
+    """
+    Keeps track of a bulk chunk over its attempts. After every response or error the chunk only holds the actions to
+    retry, the successes and failures are counted.
+    """
+
+    def __init__(self, chunk: list, max_retries: int, initial_backoff: float, max_backoff: float):
+        self.chunk = chunk
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.attempt = 0
+        self.num_success = 0
+        self.failures = []
+
+    def body(self) -> str:
+        return "".join(line for _, lines in self.chunk for line in lines)
+
+    def handle_response(self, response: dict):
+        self.__update(*split_bulk_response(self.chunk, response, retry=self.attempt < self.max_retries))
+
+    def handle_error(self, error: TransportError):
+        self.__update(*split_bulk_error(self.chunk, error, retry=self.attempt < self.max_retries))
+
+    def next_backoff(self) -> float:
+        """ Seconds to wait before retrying the remaining chunk, exponential with jitter. """
+        backoff = min(self.max_backoff, self.initial_backoff * (2 ** self.attempt))
+        search_log.warning(f'Retrying {len(self.chunk)} rejected bulk items in {backoff:.1f}s')
+        self.attempt += 1
+        return backoff * random.uniform(0.5, 1.0)
+
+    def __update(self, num_success: int, retry_chunk: list, failures: list):
+        self.num_success += num_success
+        self.chunk = retry_chunk
+        self.failures.extend(failures)
+
+
+def is_retryable_bulk_status(status: int) -> bool:
+    return isinstance(status, int) and (status == RETRYABLE_BULK_STATUS or status >= 500)
+
+
+def split_bulk_response(chunk: list, response: dict, retry: bool) -> tuple:
+    """
+    Match the items in the bulk response with the actions in the chunk.
+    :param retry: Whether items rejected with a retryable status should be retried
+    :return: Tuple with the number of successful items, the actions to retry and the failed items
+    """
+    num_success = 0
+    retry_chunk = []
+    failures = []
+    for (action, lines), item in zip(chunk, response["items"]):
+        op_type, result = next(iter(item.items()))
+        status = result.get("status", 500)
+        if 200 <= status < 300:
+            num_success += 1
+        elif retry and is_retryable_bulk_status(status):
+            retry_chunk.append((action, lines))
+        else:
+            search_log.debug(f'Bulk {op_type} for {result.get("_id")} failed with status {status}')
+            failures.append({op_type: result})
+
+    return num_success, retry_chunk, failures
+
+
+def is_retryable_bulk_error(error: TransportError) -> bool:
+    """ The ConnectionError of opensearch-py, also raised for timeouts, has no numeric status code. """
+    return isinstance(error, OpenSearchConnectionError) or is_retryable_bulk_status(error.status_code)
+
+
+def split_bulk_error(chunk: list, error: TransportError, retry: bool) -> tuple:
+    """
+    Handle a bulk request that failed as a whole. All actions of the chunk are retried when the error is retryable,
+    otherwise they become failed items with the status and the error of the request.
+    :return: Tuple with the number of successful items, the actions to retry and the failed items
+    """
+    if retry and is_retryable_bulk_error(error):
+        search_log.warning(f'Bulk request for {len(chunk)} items failed with {error}')
+        return 0, chunk, []
+
+    search_log.warning(f'Bulk request for {len(chunk)} items failed, reporting them as failed: {error}')
+    failures = []
+    for action, _ in chunk:
+        op_type, header = next(iter(action.items()))
+        failures.append({op_type: {"_id": header.get("_id"), "_index": header.get("_index"),
+                                   "status": error.status_code, "error": str(error)}})
+    return 0, [], failures
+
+
+def parse_bulk_document(document: dict, id_field: str = None) -> tuple:
+    """
+    Separate the action metadata from the source. Only a document in action form, with an _op_type or a _source, has
+    metadata keys. A plain source document is used as is, a field like routing stays part of the source.
+    :return: Tuple with the op type, the action header with _id, _index and routing, and the source
+    """
+    if "_op_type" in document or "_source" in document:
+        document = document.copy()
+        op_type = document.pop("_op_type", "index")
+        header = {key: document.pop(key) for key in BULK_METADATA_KEYS if key in document}
+        source = document.pop("_source", document)
+    else:
+        op_type, header, source = "index", {}, document
+    if "_id" not in header and id_field and id_field in source:
+        header["_id"] = source[id_field]
+
+    return op_type, header, source
+
+
+def expand_bulk_action(document: dict, serializer, id_field: str = None) -> tuple:
+    """
+    Transform a document or action into the lines for the _bulk body, see parse_bulk_document.
+    :return: Tuple with the action header and the serialized lines
+    """
+    op_type, header, source = parse_bulk_document(document, id_field=id_field)
+    action = {op_type: header}
+    lines = [serializer.dumps(action) + "\n"]
+    if op_type != "delete":
+        lines.append(serializer.dumps(source) + "\n")
+
+    return action, lines
+
 
-        if not alias_name:
-            search_log.warn("We mandate using aliases for an index. Provided the alias while construction the client"
-                            "or provided it with the appropriate function call")
-            raise ValueError("We mandate using aliases for an index. Provided the alias while construction the client"
-                             "or provided it with the appropriate function call")
+def chunk_bulk_actions(actions: Iterable[tuple], chunk_size: int, max_chunk_bytes: int):
+    """
+    Group the expanded actions into chunks that stay within the number of actions and the number of bytes.
+    A single action that is larger than max_chunk_bytes becomes a chunk of its own.
+    """
+    chunk = []
+    chunk_bytes = 0
+    for action, lines in actions:
+        action_bytes = sum(len(line.encode("utf-8")) for line in lines)
+        if chunk and (len(chunk) >= chunk_size or chunk_bytes + action_bytes > max_chunk_bytes):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+        chunk.append((action, lines))
+        chunk_bytes += action_bytes
 
-        return alias_name
+    if chunk:
+        yield chunk
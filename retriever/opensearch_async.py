@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import time
+from typing import Iterable
+
+from opensearchpy import AsyncOpenSearch, AsyncHttpConnection, TransportError
+
+from retriever.connection import pool_settings
+from retriever.opensearch import BulkChunkRetry, chunk_bulk_actions, component_templates_by_name, \
+    document_page_body, expand_bulk_action, fuse_hybrid_responses, hybrid_search_bodies, index_templates_by_name, \
+    is_pit_unavailable, knn_search_body, multi_search_body, multi_search_responses, new_index_name, next_pit_page, \
+    notify_alias_listeners, observe_took, record_total_hits, resolve_alias_name, switch_alias_body
+from util.metrics import get_metrics
+
+search_log = logging.getLogger("search")
+
+
+class AsyncOpenSearchClient:
+    """
+    Asyncio variant of the OpenSearchClient with the same methods. Requests do not block, so one worker can have many
+    requests in flight. The auth in the config must support async requests, use find_auth_opensearch(use_async=True).
+    """
+
+    def __init__(self, config: dict, alias_name: str = None):
+        settings = pool_settings(config)
+        self.opensearch = AsyncOpenSearch(
+            hosts=[{'host': config["host"], 'port': config['port']}],
+            use_ssl=config.get("use_ssl", True),
+            verify_certs=config.get("verify_certs", True),
+            http_auth=config.get("auth"),
+            connection_class=AsyncHttpConnection,
+            pool_maxsize=settings["pool_maxsize"],
+            timeout=settings["timeout"],
+            max_retries=settings["max_retries"],
+            retry_on_timeout=settings["retry_on_timeout"],
+            http_compress=settings["http_compress"],
+            headers=None if settings["keep_alive"] else {"connection": "close"}
+        )
+        self.default_alias_name = alias_name
+        self.alias_listeners = []
+
+    async def close(self):
+        await self.opensearch.close()
+
+    async def ping(self):
+        if await self.opensearch.ping():
+            search_log.info('Connected to OpenSearch')
+            return True
+        else:
+            search_log.warning('Could not connect to OpenSearch')
+            return False
+
+    async def create_index(self, provided_alias_name: str = None):
+        index_name = new_index_name(self.__get_alias_name(provided_alias_name))
+
+        await self.opensearch.indices.delete(index=index_name, ignore_unavailable=True)
+        await self.opensearch.indices.create(index=index_name)
+
+        search_log.info(f'Created a new index with the name {index_name}')
+        return index_name
+
+    async def switch_alias_to(self, index_name: str, provided_alias_name: str = None):
+        alias_name = self.__get_alias_name(provided_alias_name)
+        search_log.info(f'Assign alias {alias_name} to {index_name}')
+        await self.opensearch.indices.update_aliases(body=switch_alias_body(alias_name, index_name))
+        notify_alias_listeners(self.alias_listeners, alias_name, index_name)
+
+    def add_alias_listener(self, listener):
+        """ Same as OpenSearchClient.add_alias_listener, the listener is a plain function. """
+        self.alias_listeners.append(listener)
+
+    async def index_document(self, id: str, document: dict, index_name: str):
+        search_log.debug(f'Indexing item: {id} into index with name {index_name}')
+        await self.opensearch.index(index=index_name, id=id, body=document)
+
+    async def bulk_index(self, documents: Iterable[dict], index_name: str = None, id_field: str = None,
+                         chunk_size: int = 500, max_chunk_bytes: int = 10 * 1024 * 1024, max_in_flight: int = 4,
+                         max_retries: int = 3, initial_backoff: float = 1.0, max_backoff: float = 30.0):
+        """ Same as OpenSearchClient.bulk_index, the chunks in flight are bounded by a semaphore. """
+        index_or_alias = self.__get_alias_name(index_name)
+        serializer = self.opensearch.transport.serializer
+        actions = (expand_bulk_action(document, serializer=serializer, id_field=id_field)
+                   for document in documents)
+
+        semaphore = asyncio.Semaphore(max_in_flight)
+        tasks = []
+        start = time.perf_counter()
+        for chunk in chunk_bulk_actions(actions, chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes):
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(self.__send_bulk_chunk(chunk, index_or_alias, semaphore, max_retries,
+                                                                    initial_backoff, max_backoff)))
+
+        num_success = 0
+        failures = []
+        for chunk_success, chunk_failures in await asyncio.gather(*tasks):
+            num_success += chunk_success
+            failures.extend(chunk_failures)
+
+        duration = time.perf_counter() - start
+        search_log.info(f'Bulk indexed {num_success} items into {index_or_alias} in {duration:.2f}s, '
+                        f'{len(failures)} items failed')
+        return num_success, failures
+
+    async def __send_bulk_chunk(self, chunk: list, index_name: str, semaphore: asyncio.Semaphore, max_retries: int,
+                                initial_backoff: float, max_backoff: float):
+        bulk_retry = BulkChunkRetry(chunk, max_retries=max_retries, initial_backoff=initial_backoff,
+                                    max_backoff=max_backoff)
+        try:
+            while bulk_retry.chunk:
+                try:
+                    bulk_retry.handle_response(await self.opensearch.bulk(body=bulk_retry.body(), index=index_name))
+                except TransportError as error:
+                    bulk_retry.handle_error(error)
+                if bulk_retry.chunk:
+                    await asyncio.sleep(bulk_retry.next_backoff())
+        finally:
+            semaphore.release()
+
+        return bulk_retry.num_success, bulk_retry.failures
+
+    async def search(self, body, explain: bool = False, size: int = 10, index_name: str = None):
+        index_or_alias = self.__get_alias_name(index_name)
+        with get_metrics().timer("opensearch_request", operation="search"):
+            response = await self.opensearch.search(index=index_or_alias, body=body, explain=explain, size=size)
+        observe_took(response, operation="search")
+        return response
+
+    async def iter_documents(self, index_name: str = None, query: dict = None, page_size: int = 1000,
+                             source_includes: list = None, source_excludes: list = None, keep_alive: str = "1m",
+                             sort: list = None, stats: dict = None):
+        """ Same as OpenSearchClient.iter_documents, as an async generator. """
+        index_or_alias = self.__get_alias_name(index_name)
+        body = document_page_body(query=query, page_size=page_size, source_includes=source_includes,
+                                  source_excludes=source_excludes, sort=sort)
+
+        try:
+            pit_id = (await self.opensearch.create_pit(index=index_or_alias, keep_alive=keep_alive))["pit_id"]
+        except TransportError as error:
+            if not is_pit_unavailable(error):
+                raise
+            search_log.info(f"Point in time is not available for {index_or_alias}, fall back to scroll: {error}")
+            async for hit in self.__scroll_documents(index_or_alias, body=body, keep_alive=keep_alive, stats=stats):
+                yield hit
+            return
+
+        try:
+            body["pit"] = {"id": pit_id, "keep_alive": keep_alive}
+            has_next_page = True
+            while has_next_page:
+                hits, has_next_page = next_pit_page(body, await self.opensearch.search(body=body), stats=stats)
+                for hit in hits:
+                    yield hit
+        finally:
+            await self.opensearch.delete_pit(body={"pit_id": [pit_id]})
+
+    async def __scroll_documents(self, index_name: str, body: dict, keep_alive: str, stats: dict = None):
+        response = await self.opensearch.search(index=index_name, body=body, scroll=keep_alive)
+        scroll_id = response["_scroll_id"]
+        try:
+            record_total_hits(response, stats)
+            while response["hits"]["hits"]:
+                for hit in response["hits"]["hits"]:
+                    yield hit
+                response = await self.opensearch.scroll(scroll_id=scroll_id, scroll=keep_alive)
+                scroll_id = response.get("_scroll_id", scroll_id)
+        finally:
+            await self.opensearch.clear_scroll(scroll_id=scroll_id)
+
+    async def multi_search(self, searches: list) -> list:
+        body = multi_search_body([(self.__get_alias_name(index_name), search_body)
+                                  for index_name, search_body in searches])
+        with get_metrics().timer("opensearch_request", operation="msearch"):
+            multi_response = await self.opensearch.msearch(body=body)
+        return multi_search_responses(multi_response)
+
+    async def hybrid_search(self, query: str, query_vector: list, text_field: str = "title",
+                            vector_field: str = "title_vector", size: int = 10, fusion: str = "rrf",
+                            lexical_weight: float = 0.5, semantic_weight: float = 0.5, rank_constant: int = 60,
+                            num_candidates: int = None, index_name: str = None) -> dict:
+        """ Same as OpenSearchClient.hybrid_search. """
+        index_or_alias = self.__get_alias_name(index_name)
+        responses = await self.multi_search([
+            (index_or_alias, body) for body in hybrid_search_bodies(query, query_vector, text_field=text_field,
+                                                                    vector_field=vector_field,
+                                                                    num_candidates=num_candidates or size * 2)
+        ])
+        return fuse_hybrid_responses(responses, size=size, fusion=fusion, weights=[lexical_weight, semantic_weight],
+                                     rank_constant=rank_constant)
+
+    async def knn_search(self, query_vector: list, vector_field: str = "title_vector", k: int = 10,
+                         num_candidates: int = None, rescore: bool = False, space_type: str = "l2",
+                         index_name: str = None) -> dict:
+        """ Same as OpenSearchClient.knn_search. """
+        index_or_alias = self.__get_alias_name(index_name)
+        body = knn_search_body(query_vector, vector_field=vector_field, k=k, num_candidates=num_candidates,
+                               rescore=rescore, space_type=space_type)
+        with get_metrics().timer("opensearch_request", operation="knn"):
+            response = await self.opensearch.search(index=index_or_alias, body=body)
+        observe_took(response, operation="knn")
+        return response
+
+    async def count_docs(self, index_name: str = None):
+        return await self.opensearch.count(index=self.__get_alias_name(index_name))
+
+    async def set_component_template(self, name, body):
+        await self.opensearch.cluster.put_component_template(name=name, body=body)
+
+    async def set_index_template(self, name, body):
+        await self.opensearch.indices.put_index_template(name=name, body=body)
+
+    async def does_index_template_exist(self, name: str):
+        return await self.opensearch.indices.exists_index_template(name=name)
+
+    async def get_index_template(self, name: str):
+        return await self.opensearch.indices.get_index_template(name=name)
+
+    async def does_component_template_exist(self, name: str):
+        return await self.opensearch.cluster.exists_component_template(name=name)
+
+    async def get_component_template(self, name: str):
+        return await self.opensearch.cluster.get_component_template(name=name)
+
+    async def get_component_templates(self, name_pattern: str = "*") -> dict:
+        return component_templates_by_name(
+            await self.opensearch.cluster.get_component_template(name=name_pattern, ignore=404))
+
+    async def get_index_templates(self, name_pattern: str = "*") -> dict:
+        return index_templates_by_name(await self.opensearch.indices.get_index_template(name=name_pattern, ignore=404))
+
+    async def delete_index(self, index_name: str):
+        await self.opensearch.indices.delete(index=index_name, ignore_unavailable=True)
+
+    def __get_alias_name(self, provided_alias_name: str = None) -> str:
+        return resolve_alias_name(provided_alias_name, self.default_alias_name)
+
+
+async def gather_searches(client: AsyncOpenSearchClient, searches: list, return_exceptions: bool = False) -> list:
+    """
+    Fan out the searches concurrently and wait for all of them.
+    :param client: The async client to search with
+    :param searches: List with tuples of the index or alias name and the search body
+    :param return_exceptions: Return a failed search as the exception instead of raising it
+    :return: The responses in the order of the searches
+    """
+    return await asyncio.gather(*(client.search(body=body, size=body.get("size", 10), index_name=index_name)
+                                  for index_name, body in searches), return_exceptions=return_exceptions)
@@ -1,53 +1,141 @@
+import json
+import logging
 import os
+import threading
+import time
 
 import boto3
-from opensearchpy import AWSV4SignerAuth
-from requests_aws4auth import AWS4Auth
+from botocore.credentials import RefreshableCredentials
+from botocore.exceptions import NoCredentialsError
+from opensearchpy import AWSV4SignerAuth, AWSV4SignerAsyncAuth
 
 from retriever.opensearch import OpenSearchClient
 
+auth_log = logging.getLogger("auth")
 
-def find_auth_opensearch(profile_name: str = 'sandbox'):
-    is_local = 'AWS_SAGEMAKER_PYTHONNOUSERSITE' not in os.environ
-    if is_local:
-        session = boto3.Session(profile_name=profile_name)
-    else:
-        session = boto3.Session()
+STACK_NAME = 'OSSGStack-OpenSearchNestedStackOpenSearchNestedStackResource203C0F43-58JJBAIMFZI5'
+REGION = 'eu-west-1'
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "openai-aws-opensearch", "stack_outputs.json")
+
+
+class LazyCredentials:
+    """
+    Credentials that are resolved on the first signed request instead of when the auth object is created. The
+    signer only calls get_frozen_credentials, refreshable credentials renew themselves shortly before they expire.
+    The identity names the principal, like the role ARN, without resolving the credentials. The shared connection
+    pools are keyed on it.
+    """
+
+    def __init__(self, resolve, identity: str = None):
+        self.resolve = resolve
+        self.identity = identity
+        self.credentials = None
+        self.lock = threading.Lock()
+
+    def get_frozen_credentials(self):
+        if self.credentials is None:
+            with self.lock:
+                if self.credentials is None:
+                    credentials = self.resolve()
+                    if credentials is None:
+                        auth_log.error(f"No AWS credentials found for {self.identity or 'the session'}")
+                        raise NoCredentialsError()
+                    self.credentials = credentials
+        return self.credentials.get_frozen_credentials()
+
+
+def load_stack_outputs(session, stack_name: str = STACK_NAME, cache_path: str = DEFAULT_CACHE_PATH,
+                       cache_ttl_seconds: float = 24 * 3600) -> dict:
+    """
+    Obtain the exported outputs of the CloudFormation stack. The outputs are cached on disk, within the time to live
+    we do not call CloudFormation.
+    """
+    cached = {}
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as file:
+                cached = json.load(file)
+        except (OSError, ValueError) as error:
+            auth_log.debug(f"Could not read the stack outputs cache {cache_path}: {error}")
+
+    entry = cached.get(stack_name)
+    if entry and time.time() - entry["fetched_at"] < cache_ttl_seconds:
+        return entry["outputs"]
 
     # Fetch outputs of the CloudFormation stack
     cfn = session.client('cloudformation')
-    response = cfn.describe_stacks(
-        StackName='OSSGStack-OpenSearchNestedStackOpenSearchNestedStackResource203C0F43-58JJBAIMFZI5'
-    )
-
+    response = cfn.describe_stacks(StackName=stack_name)
     outputs = {
         output['ExportName']: output['OutputValue']
         for output in response['Stacks'][0]['Outputs']
         if 'ExportName' in output
     }
 
+    if cache_path:
+        cached[stack_name] = {"fetched_at": time.time(), "outputs": outputs}
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path, 'w') as file:
+                json.dump(cached, file)
+        except OSError as error:
+            auth_log.debug(f"Could not write the stack outputs cache {cache_path}: {error}")
+
+    return outputs
+
+
+def assumed_role_credentials(session, role_arn: str,
+                             role_session_name: str = "assumed-opensearch-user-admin-role") -> RefreshableCredentials:
+    """ Credentials for the assumed role that assume the role again shortly before they expire. """
+    sts = session.client('sts')
+
+    def refresh():
+        auth_log.info(f"Assume role {role_arn}")
+        response = sts.assume_role(RoleArn=role_arn, RoleSessionName=role_session_name)
+        credentials = response['Credentials']
+        return {
+            "access_key": credentials['AccessKeyId'],
+            "secret_key": credentials['SecretAccessKey'],
+            "token": credentials['SessionToken'],
+            "expiry_time": credentials['Expiration'].isoformat()
+        }
+
+    return RefreshableCredentials.create_from_metadata(metadata=refresh(), refresh_using=refresh,
+                                                       method='sts-assume-role')
+
+
+def find_auth_opensearch(profile_name: str = 'sandbox', use_async: bool = False, session=None,
+                         stack_name: str = STACK_NAME, region: str = REGION, cache_path: str = DEFAULT_CACHE_PATH,
+                         cache_ttl_seconds: float = 24 * 3600):
+    """
+    Find the endpoint of the OpenSearch domain and create the auth to connect to it. Locally we assume the admin
+    role of the domain, in SageMaker we use the credentials of the notebook. Credentials are only obtained when the
+    first request is signed and renew before they expire.
+    :param profile_name: The AWS profile to use when running locally
+    :param use_async: Create auth for the AsyncOpenSearchClient
+    :param session: The boto3 session to use, mainly to provide stubbed clients
+    :param cache_path: File to cache the stack outputs in, None disables the cache
+    :param cache_ttl_seconds: Time to live of the cached stack outputs
+    :return: Dict with the host, port and auth
+    """
+    is_local = 'AWS_SAGEMAKER_PYTHONNOUSERSITE' not in os.environ
+    if session is None:
+        session = boto3.Session(profile_name=profile_name) if is_local else boto3.Session()
+
+    outputs = load_stack_outputs(session, stack_name=stack_name, cache_path=cache_path,
+                                 cache_ttl_seconds=cache_ttl_seconds)
+
     # Extract the OpenSearch endpoint
     host = outputs['cdk-os-sg-DomainEndpoint']
     port = 443
-    region = 'eu-west-1'  # e.g. us-west-1
 
     if is_local:
         # Assume Created OpenSearch Admin Role
-        sts = session.client('sts')
-        response = sts.assume_role(
-            RoleArn=outputs['cdk-os-sg-AdminUserRoleArn'],
-            RoleSessionName="assumed-opensearch-user-admin-role",
-        )
-
-        # Create OpenSearch client
-        auth = AWS4Auth(
-            response['Credentials']['AccessKeyId'], response['Credentials']['SecretAccessKey'],
-            region, 'es',
-            session_token=response['Credentials']['SessionToken']
-        )
+        role_arn = outputs['cdk-os-sg-AdminUserRoleArn']
+        credentials = LazyCredentials(lambda: assumed_role_credentials(session, role_arn=role_arn), identity=role_arn)
     else:
-        credentials = session.get_credentials()
-        auth = AWSV4SignerAuth(credentials, region)
+        credentials = LazyCredentials(session.get_credentials, identity=f"profile:{session.profile_name}")
+
+    auth = AWSV4SignerAsyncAuth(credentials, region) if use_async else AWSV4SignerAuth(credentials, region)
 
     return {"host": host, "port": port, "auth": auth}
 
@@ -1,10 +1,14 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from retriever import OpenSearchClient
 from util import load_json_body_from_file
 
 tpl_logging = logging.getLogger("template")
 
+COMPONENT = "component"
+INDEX_TEMPLATE = "index_template"
+
 
 class OpenSearchTemplate:
 
@@ -24,69 +28,118 @@ class OpenSearchTemplate:
         """ Check the version of the current template and update if necessary """
         tpl_logging.info("Initialize or update the product template in OpenSearch.")
 
-        return [
-            self.__update_component(component_name=self.component_name_settings),
-            self.__update_component(component_name=self.component_name_dyn_mappings),
-            self.__update_component(component_name=self.component_name_mappings),
-            self.__update_index_template()
-        ]
-
-    def __update_component(self, component_name: str):
-        body = load_json_body_from_file(file_name=f"./config_files/{component_name}.json")
-        required_version = body['version']
-        component_needs_update = self.__component_needs_update(component_name=component_name,
-                                                               current_version=required_version)
-        if component_needs_update:
-            self.client.set_component_template(name=component_name, body=body)
-            result = f"Update the component template {component_name} to version {required_version}."
-        else:
-            result = f"The version {required_version} of the component template {component_name} is up-to-date"
+        return [describe_action(action) for action in sync_templates(client=self.client, templates=[self])]
 
-        return result
+    def component_names(self) -> list:
+        return [self.component_name_settings, self.component_name_dyn_mappings, self.component_name_mappings]
 
-    def __update_index_template(self):
-        body = load_json_body_from_file(file_name=f"./config_files/{self.index_template_name}.json")
-        required_version = body['version']
-        template_needs_update = self.__template_needs_update(template_name=self.index_template_name,
-                                                             current_version=required_version)
+    def component_bodies(self) -> dict:
+        return {name: load_json_body_from_file(file_name=f"./config_files/{name}.json")
+                for name in self.component_names()}
 
-        if template_needs_update:
-            self.client.set_index_template(name=self.index_template_name, body=body)
-            result = f"Update the template to version {required_version}."
+    def index_template_body(self) -> dict:
+        body = load_json_body_from_file(file_name=f"./config_files/{self.index_template_name}.json")
+        body['composed_of'] = compose_components(body.get('composed_of', []), self.component_names())
+        return body
+
+
+def compose_components(template_components: list, configured_components: list) -> list:
+    """
+    Merge the configured components into the components of the index template file. A configured variant of a
+    listed component, named like the component plus a suffix such as sg_product_component_mappings_fp16, takes its
+    place. Configured components that are not listed are appended, the other listed components are kept.
+    """
+    composed = list(template_components)
+    for name in configured_components:
+        if name in composed:
+            continue
+        variant_of = next((component for component in composed if name.startswith(f"{component}_")), None)
+        if variant_of is not None:
+            composed[composed.index(variant_of)] = name
         else:
-            result = f"The version {required_version} of the index template is up-to-date"
-
-        return result
-
-    def __template_needs_update(self, template_name: str, current_version):
-        """ The template needs to update if there is no template or if the versions do not match """
-        if not self.client.does_index_template_exist(name=template_name):
-            tpl_logging.debug("The template with name '%s' is not found", template_name)
-            return True
-
-        response = self.client.get_index_template(name=template_name)
-        tpl_logging.debug(response)
-
-        templates = response['index_templates']
-        if len(templates) != 1:
-            raise Exception("We cannot have matching more than 1 template while looking for " + template_name)
-
-        index_template = templates[0]['index_template']
-        return not (index_template.get("version") == current_version)
-
-    def __component_needs_update(self, component_name: str, current_version):
-        """ The template needs to update if there is no template or if the versions do not match """
-        tpl_logging.debug("Obtain the component template with name '%s'", component_name)
-        if not self.client.does_component_template_exist(name=component_name):
-            tpl_logging.debug("The component template with name '%s' is not found", component_name)
-            return True
-
-        response = self.client.get_component_template(name=component_name)
-        tpl_logging.debug(response)
-
-        components = response['component_templates']
-        if len(components) != 1:
-            raise Exception("We cannot have matching more than 1 component while looking for " + component_name)
-
-        component_template = components[0]['component_template']
-        return not (component_template.get("version") == current_version)
+            composed.append(name)
+    return composed
+
+
+def plan_templates(templates: list, current_components: dict, current_index_templates: dict) -> list:
+    """
+    Compare the required versions with the templates in the cluster. A component needs an update if it does not
+    exist or the versions do not match. An index template also needs an update if it is composed of other components.
+    :param templates: List of OpenSearchTemplate objects, a component shared by templates is planned once
+    :param current_components: The component templates in the cluster, keyed by name
+    :param current_index_templates: The index templates in the cluster, keyed by name
+    :return: List of actions with the kind, name, current and required version, update flag and body
+    """
+    actions = []
+    planned = set()
+    for template in templates:
+        for name, body in template.component_bodies().items():
+            if (COMPONENT, name) not in planned:
+                planned.add((COMPONENT, name))
+                current = current_components.get(name, {})
+                actions.append(_plan_action(COMPONENT, name, body, current,
+                                            needs_update=current.get("version") != body['version']))
+
+    for template in templates:
+        name = template.index_template_name
+        if (INDEX_TEMPLATE, name) not in planned:
+            planned.add((INDEX_TEMPLATE, name))
+            body = template.index_template_body()
+            current = current_index_templates.get(name, {})
+            actions.append(_plan_action(INDEX_TEMPLATE, name, body, current,
+                                        needs_update=(current.get("version") != body['version']
+                                                      or current.get("composed_of") != body['composed_of'])))
+    return actions
+
+
+def sync_templates(client: OpenSearchClient, templates: list, dry_run: bool = False, max_workers: int = 4) -> list:
+    """
+    Bring the component and index templates of all template sets in line with the files in config_files. The
+    templates in the cluster are obtained with one request for the components and one for the index templates, the
+    versions are compared locally. The required updates are sent concurrently, first all components and then the
+    index templates that are composed of them.
+    :param client: The client of the cluster to sync
+    :param templates: List of OpenSearchTemplate objects
+    :param dry_run: Only return the plan, do not update anything
+    :param max_workers: Maximum number of concurrent updates
+    :return: The planned actions, see plan_templates
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        components_future = executor.submit(client.get_component_templates)
+        index_templates_future = executor.submit(client.get_index_templates)
+        actions = plan_templates(templates, components_future.result(), index_templates_future.result())
+
+    updates = [action for action in actions if action["needs_update"]]
+    tpl_logging.info(f"Template sync plan has {len(updates)} updates for {len(actions)} templates"
+                     f"{', dry run' if dry_run else ''}")
+    if dry_run or not updates:
+        return actions
+
+    setters = {COMPONENT: client.set_component_template, INDEX_TEMPLATE: client.set_index_template}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for kind in (COMPONENT, INDEX_TEMPLATE):
+            futures = [executor.submit(setters[kind], name=action["name"], body=action["body"])
+                       for action in updates if action["kind"] == kind]
+            # Raise the first failure before updating templates that depend on the failed component
+            for future in futures:
+                future.result()
+
+    return actions
+
+
+def describe_action(action: dict) -> str:
+    kind = "component template" if action["kind"] == COMPONENT else "index template"
+    if action["needs_update"]:
+        return f"Update the {kind} {action['name']} to version {action['required_version']}."
+    return f"The version {action['required_version']} of the {kind} {action['name']} is up-to-date"
+
+
+def _plan_action(kind: str, name: str, body: dict, current: dict, needs_update: bool) -> dict:
+    return {
+        "kind": kind,
+        "name": name,
+        "current_version": current.get("version"),
+        "required_version": body['version'],
+        "needs_update": needs_update,
+        "body": body
+    }
@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+from util.metrics import get_metrics
+
+cache_log = logging.getLogger("result_cache")
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.casefold().split())
+
+
+class QueryResultCache:
+    """
+    LRU cache with a time to live for search results, keyed by alias, normalized query, k and search type. Every
+    entry remembers the index generation the alias pointed to. When the alias moves to a new index, the entries of
+    the previous generation are no longer served. A switch in this process is picked up immediately through
+    on_alias_switched, a switch by another process is picked up by resolving the alias every check interval. A result
+    computed while the cache was invalidated is not stored, it could come from the previous generation.
+    """
+
+    def __init__(self,
+                 max_items: int = 1_000,
+                 ttl_seconds: float = 600,
+                 resolve_generation: Callable[[str], str] = None,
+                 generation_check_interval: float = 30):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.resolve_generation = resolve_generation
+        self.generation_check_interval = generation_check_interval
+
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.invalidation_counter = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.saved_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def get_or_compute(self, alias: str, query: str, k: int, search_type: str, compute: Callable[[], Any]) -> Any:
+        """
+        Return the cached result for the query, or compute and cache it.
+        :param compute: Function without arguments that executes the search
+        """
+        key = (alias, normalize_query(query), k, search_type)
+        generation = self.__current_generation(alias)
+        now = time.monotonic()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, entry_generation, created_at, compute_seconds = entry
+                if entry_generation == generation and now - created_at <= self.ttl_seconds:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    self.saved_seconds += compute_seconds
+                    get_metrics().increment("cache_requests", cache="result", result="hit", search_type=search_type)
+                    return value
+                del self.entries[key]
+            self.misses += 1
+            invalidation_counter = self.invalidation_counter
+        get_metrics().increment("cache_requests", cache="result", result="miss", search_type=search_type)
+
+        start = time.perf_counter()
+        value = compute()
+        compute_seconds = time.perf_counter() - start
+
+        with self.lock:
+            if self.invalidation_counter != invalidation_counter:
+                cache_log.debug(f"Not caching the result for {key}, the cache was invalidated during the search")
+                return value
+            self.entries[key] = (value, generation, now, compute_seconds)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_items:
+                self.entries.popitem(last=False)
+
+        return value
+
+    def on_alias_switched(self, alias: str, index_name: str):
+        """ Listener for OpenSearchClient.add_alias_listener, drops the entries of the previous generation. """
+        with self.lock:
+            self.generations[alias] = (index_name, time.monotonic())
+        self.invalidate(alias)
+
+    def invalidate(self, alias: str = None):
+        with self.lock:
+            keys = [key for key in self.entries if alias is None or key[0] == alias]
+            for key in keys:
+                del self.entries[key]
+            self.invalidation_counter += 1
+            self.invalidations += len(keys)
+        cache_log.info(f"Invalidated {len(keys)} cached results for alias {alias or 'all aliases'}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "invalidations": self.invalidations,
+                "saved_seconds": self.saved_seconds,
+                "items": len(self.entries)
+            }
+
+    def __current_generation(self, alias: str):
+        if self.resolve_generation is None:
+            return None
+
+        with self.lock:
+            generation, checked_at = self.generations.get(alias, (None, None))
+        if checked_at is not None and time.monotonic() - checked_at < self.generation_check_interval:
+            return generation
+
+        current = self.resolve_generation(alias)
+        if current != generation and checked_at is not None:
+            cache_log.info(f"Alias {alias} moved from {generation} to {current}")
+            self.invalidate(alias)
+        with self.lock:
+            self.generations[alias] = (current, time.monotonic())
+        return current
@@ -0,0 +1,18 @@
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores import OpenSearchVectorSearch
+
+from retriever.connection import get_opensearch_connection
+
+
+class SharedConnectionVectorSearch(OpenSearchVectorSearch):
+    """
+    OpenSearchVectorSearch on top of the shared OpenSearch connection. The constructor of OpenSearchVectorSearch
+    always creates a client of its own, we only replace that client, everything else is initialized by langchain.
+    """
+
+    def __init__(self, config: dict, index_name: str, embedding_function: Embeddings):
+        scheme = "https" if config.get("use_ssl", True) else "http"
+        super().__init__(opensearch_url=f"{scheme}://{config['host']}:{config['port']}", index_name=index_name,
+                         embedding_function=embedding_function, http_auth=config.get("auth"))
+        self.client.close()
+        self.client = get_opensearch_connection(config)
@@ -0,0 +1,179 @@
+import bisect
+import logging
+import threading
+import time
+import unicodedata
+from typing import List, Optional
+
+from retriever.opensearch import OpenSearchClient
+from util.metrics import get_metrics
+
+store_log = logging.getLogger("store_directory")
+
+
+def normalize_city(city: str) -> str:
+    """ Casefold, remove accents and collapse whitespace and dashes, 's-Hertogenbosch matches s hertogenbosch. """
+    decomposed = unicodedata.normalize("NFKD", city.casefold())
+    without_accents = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(without_accents.replace("-", " ").replace("'", " ").split())
+
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[position:position + 3] for position in range(len(padded) - 2)}
+
+
+def edit_distance(first: str, second: str) -> int:
+    previous = list(range(len(second) + 1))
+    for row, first_char in enumerate(first, start=1):
+        current = [row]
+        for column, second_char in enumerate(second, start=1):
+            current.append(min(previous[column] + 1, current[column - 1] + 1,
+                               previous[column - 1] + (first_char != second_char)))
+        previous = current
+    return previous[-1]
+
+
+class StoreDirectory:
+    """
+    All stores in memory, indexed by the normalized city. A city is found by an exact match, by a unique prefix or
+    by the closest city within the edit distance among the cities that share trigrams. The stores are loaded from the
+    alias and loaded again when the alias moves to another index, a switch in this process is picked up through
+    on_alias_switched, a switch by another process by resolving the alias every check interval.
+    """
+
+    def __init__(self, client: OpenSearchClient, alias_name: str = "sg-stores", generation_check_interval: float = 60,
+                 max_distance_ratio: float = 0.25):
+        """
+        :param client: The client to load the stores with and to search with when the directory has no answer
+        :param generation_check_interval: Seconds between checks if the alias points to another index
+        :param max_distance_ratio: Maximum edit distance for a fuzzy match relative to the length of the city
+        """
+        self.client = client
+        self.alias_name = alias_name
+        self.generation_check_interval = generation_check_interval
+        self.max_distance_ratio = max_distance_ratio
+
+        self.generation = None
+        self.checked_at = None
+        self.stores_by_city = {}
+        self.cities = []
+        self.trigram_index = {}
+        self.lock = threading.Lock()
+
+    def load(self, stores: List[dict] = None, generation: str = None):
+        """ Build the indexes from the provided stores, or from all stores behind the alias. """
+        if stores is None:
+            generation = self.client.current_index_for(self.alias_name)
+            stores = [hit["_source"] for hit in self.client.iter_documents(index_name=self.alias_name)]
+
+        stores_by_city = {}
+        for store in stores:
+            stores_by_city.setdefault(normalize_city(store["city"]), []).append(store)
+        trigram_index = {}
+        for city in stores_by_city:
+            for trigram in trigrams(city):
+                trigram_index.setdefault(trigram, set()).add(city)
+
+        with self.lock:
+            self.stores_by_city = stores_by_city
+            self.cities = sorted(stores_by_city)
+            self.trigram_index = trigram_index
+            self.generation = generation
+            self.checked_at = time.monotonic()
+        store_log.info(f"Loaded {len(stores)} stores in {len(stores_by_city)} cities from {generation}")
+
+    def on_alias_switched(self, alias: str, index_name: str):
+        """ Listener for OpenSearchClient.add_alias_listener, loads the stores of the new index. """
+        if alias == self.alias_name:
+            self.load()
+
+    def lookup(self, city: str) -> List[dict]:
+        """ Return the stores in the city, an empty list if no city matches. """
+        self.__refresh_if_moved()
+        normalized = normalize_city(city)
+        if not normalized:
+            return []
+
+        with self.lock:
+            stores_by_city, cities, trigram_index = self.stores_by_city, self.cities, self.trigram_index
+
+        if normalized in stores_by_city:
+            return stores_by_city[normalized]
+
+        position = bisect.bisect_left(cities, normalized)
+        prefixed = []
+        while position < len(cities) and cities[position].startswith(normalized):
+            prefixed.append(cities[position])
+            position += 1
+        if len(prefixed) == 1:
+            return stores_by_city[prefixed[0]]
+
+        candidates = set().union(*(trigram_index.get(trigram, set()) for trigram in trigrams(normalized)))
+        max_distance = max(1, int(len(normalized) * self.max_distance_ratio))
+        best_city, best_distance = None, max_distance + 1
+        for candidate in sorted(candidates):
+            distance = edit_distance(normalized, candidate)
+            if distance < best_distance:
+                best_city, best_distance = candidate, distance
+        return stores_by_city[best_city] if best_city else []
+
+    def find_store(self, city: str) -> Optional[dict]:
+        """
+        Return the first store in the city in the shape of the documents in the index. When the directory does not
+        know the city, fall back to a match query on the alias.
+        """
+        stores = self.lookup(city)
+        if stores:
+            get_metrics().increment("store_lookup", source="directory")
+            return stores[0]
+
+        get_metrics().increment("store_lookup", source="opensearch")
+        search_result = self.client.search(body={"query": {"match": {"city": city}}}, size=1,
+                                           index_name=self.alias_name)
+        if search_result["hits"]["total"]["value"] > 0:
+            return search_result["hits"]["hits"][0]["_source"]
+        return None
+
+    def extract_city(self, query: str) -> Optional[dict]:
+        """
+        Find a known city in the query, for instance to use as the argument extractor of the opening hours tool.
+        Longer word sequences are tried first, fuzzy matches only for words of four characters or more.
+        :return: Dict with the city as the tool expects it, or None if the query does not contain a known city
+        """
+        self.__refresh_if_moved()
+        words = normalize_city("".join(char if char.isalnum() or char in "-'" else " " for char in query)).split()
+        with self.lock:
+            stores_by_city = self.stores_by_city
+        longest_city = max((len(city.split()) for city in stores_by_city), default=0)
+
+        for length in range(min(longest_city, len(words)), 0, -1):
+            for start in range(len(words) - length + 1):
+                candidate = " ".join(words[start:start + length])
+                if candidate in stores_by_city:
+                    return {"city": stores_by_city[candidate][0]["city"]}
+
+        for word in words:
+            if len(word) >= 4:
+                stores = self.lookup(word)
+                if stores:
+                    return {"city": stores[0]["city"]}
+        return None
+
+    def __refresh_if_moved(self):
+        with self.lock:
+            checked_at = self.checked_at
+        if checked_at is not None and time.monotonic() - checked_at < self.generation_check_interval:
+            return
+
+        if checked_at is None:
+            self.load()
+            return
+
+        current = self.client.current_index_for(self.alias_name)
+        if current != self.generation:
+            store_log.info(f"Alias {self.alias_name} moved from {self.generation} to {current}")
+            self.load()
+        else:
+            with self.lock:
+                self.checked_at = time.monotonic()
@@ -3,64 +3,88 @@ import os
 import langchain
 import streamlit as st
 from dotenv import load_dotenv
+from langchain.callbacks import get_openai_callback
 from langchain.chains.openai_functions import create_openai_fn_chain
 from langchain.chat_models import ChatOpenAI
 from langchain.embeddings import OpenAIEmbeddings
 from langchain.prompts import ChatPromptTemplate
-from langchain.vectorstores import OpenSearchVectorSearch
-from opensearchpy import RequestsHttpConnection
 
-from retriever import find_auth_opensearch, OpenSearchClient
+from retriever import find_auth_opensearch, OpenSearchClient, CachedEmbeddings, FaissVectorStore, create_vector_store, \
+    QueryResultCache, IntentRouter, StoreDirectory, ContentAnswerer
+from util import PrometheusMetrics, set_metrics, serve_prometheus
 
 
+@st.cache_resource
+def init_metrics():
+    """ Collect the metrics once per process, set METRICS_PORT to expose them for Prometheus. """
+    metrics = PrometheusMetrics()
+    set_metrics(metrics)
+    if os.getenv('METRICS_PORT'):
+        serve_prometheus(metrics, port=int(os.getenv('METRICS_PORT')))
+    return metrics
+
+
+def record_llm_usage(callback, stage: str):
+    metrics.increment("tokens", callback.prompt_tokens, source="llm", stage=stage, type="prompt")
+    metrics.increment("tokens", callback.completion_tokens, source="llm", stage=stage, type="completion")
+
+
+@st.cache_resource
 def init_opensearch_client():
     os_config = find_auth_opensearch()
     return OpenSearchClient(os_config, alias_name="sg-products"), os_config
 
 
-def init_product_search():
-    return OpenSearchVectorSearch(
-        index_name="sg-products",
-        embedding_function=OpenAIEmbeddings(openai_api_key=os.getenv('OPEN_AI_API_KEY')),
-        opensearch_url=f"https://{config['host']}:{config['port']}",
-        use_ssl=True,
-        verify_certs=True,
-        http_auth=config["auth"],
-        connection_class=RequestsHttpConnection
-    )
+@st.cache_resource
+def init_embeddings():
+    return CachedEmbeddings(OpenAIEmbeddings(openai_api_key=os.getenv('OPEN_AI_API_KEY')))
 
 
-def init_content_search():
-    vector_store = OpenSearchVectorSearch(
-        index_name="sg-content",
-        embedding_function=OpenAIEmbeddings(openai_api_key=os.getenv('OPEN_AI_API_KEY')),
-        opensearch_url=f"https://{config['host']}:{config['port']}",
-        use_ssl=True,
-        verify_certs=True,
-        http_auth=config["auth"],
-        connection_class=RequestsHttpConnection
-    )
+@st.cache_resource
+def init_result_cache(_client: OpenSearchClient):
+    cache = QueryResultCache(resolve_generation=_client.current_index_for)
+    _client.add_alias_listener(cache.on_alias_switched)
+    return cache
 
-    from langchain.chains import RetrievalQA
-    from langchain import PromptTemplate, OpenAI
 
-    prompt_template = """Use the context to answer the question. If you don't know the 
-        answer, just say that you don't know, don't make up an answer.
+@st.cache_resource
+def init_store_directory(_client: OpenSearchClient):
+    directory = StoreDirectory(_client, alias_name="sg-stores")
+    _client.add_alias_listener(directory.on_alias_switched)
+    return directory
 
-        {context}
 
-        Question: {question}:"""
+@st.cache_resource
+def init_intent_router(_embeddings: CachedEmbeddings, _store_directory: StoreDirectory):
+    # Without a known city in the query, the LLM has to extract the arguments for the opening hours. The default
+    # thresholds are not validated, check them with python -m retriever.intent_router and set the results.
+    thresholds = {}
+    if os.getenv('INTENT_MIN_SCORE'):
+        thresholds["min_score"] = float(os.getenv('INTENT_MIN_SCORE'))
+    if os.getenv('INTENT_MIN_MARGIN'):
+        thresholds["min_margin"] = float(os.getenv('INTENT_MIN_MARGIN'))
+    return IntentRouter.from_file(embeddings=_embeddings,
+                                  argument_extractors={"execute_opening_hours": _store_directory.extract_city},
+                                  **thresholds)
 
-    custom_prompt = PromptTemplate(
-        template=prompt_template, input_variables=["context", "question"]
-    )
 
-    chain_type_kwargs = {"prompt": custom_prompt}
-    return RetrievalQA.from_chain_type(
-        llm=OpenAI(openai_api_key=os.getenv('OPEN_AI_API_KEY')),
-        chain_type="stuff",
-        retriever=vector_store.as_retriever(),
-        chain_type_kwargs=chain_type_kwargs
+@st.cache_resource
+def init_product_search(_config: dict, _embeddings: CachedEmbeddings):
+    if os.getenv('FAISS_INDEX_PATH'):
+        return FaissVectorStore.load(path=os.getenv('FAISS_INDEX_PATH'), embedding_function=_embeddings)
+
+    return create_vector_store(config=_config, index_name="sg-products", embedding_function=_embeddings)
+
+
+@st.cache_resource
+def init_content_search(_config: dict, _embeddings: CachedEmbeddings):
+    vector_store = create_vector_store(config=_config, index_name="sg-content", embedding_function=_embeddings)
+
+    from langchain import OpenAI
+
+    return ContentAnswerer(
+        vector_store=vector_store,
+        llm=OpenAI(openai_api_key=os.getenv('OPEN_AI_API_KEY'), streaming=True)
     )
 
 
@@ -70,28 +94,38 @@ def execute_product_search(query: str) -> dict:
     Args:
         query: Query to search products for
     """
-    found_docs = vector_store_products.similarity_search_with_score(query=query,
-                                                                    text_field="title",
-                                                                    vector_field="title_vector")
-    results = []
-    for doc, _score in found_docs:
-        results.append({"title": doc.page_content, "score": _score, "image_name": doc.metadata["image_name"]})
+    def search_products():
+        with metrics.timer("stage", stage="product_search"):
+            found_docs = vector_store_products.similarity_search_with_score(query=query,
+                                                                            text_field="title",
+                                                                            vector_field="title_vector")
+        with metrics.timer("stage", stage="result_mapping"):
+            results = []
+            for doc, _score in found_docs:
+                results.append({"title": doc.page_content, "score": _score, "image_name": doc.metadata["image_name"]})
+        return results
 
     return {
         "tool": "product_search",
-        "result": results
+        "result": result_cache.get_or_compute(alias="sg-products", query=query, k=4, search_type="product",
+                                              compute=search_products)
     }
 
 
-def execute_content_search(query: str) -> dict:
+def execute_content_search(query: str, *, on_token=None) -> dict:
     """Useful for obtaining answers to questions about help for the website, your account and sustainability.
 
     Args:
         query: Query to use as input for the content search
     """
+    # on_token is keyword only and not annotated, so it stays out of the function definition for the LLM
+    def answer_question():
+        return content_answerer.answer(query, on_token=on_token)
+
     return {
         "tool": "content_search",
-        "result": content_chain.run(query)
+        "result": result_cache.get_or_compute(alias="sg-content", query=query, k=4, search_type="content",
+                                              compute=answer_question)
     }
 
 
@@ -101,24 +135,16 @@ def execute_opening_hours(city: str) -> dict:
     Args:
         city: Name of the city to search for
     """
-    body = {
-        "query": {
-            "match": {
-                "city": city
-            }
-        }
-    }
-    search_result = os_client.search(body=body, size=1, index_name="sg-stores")
-    results = []
-    if search_result["hits"]["total"]["value"] > 0:
-        results = search_result["hits"]["hits"][0]["_source"]
+    with metrics.timer("stage", stage="opening_hours"):
+        store = store_directory.find_store(city)
 
     return {
         "tool": "opening_hours",
-        "result": results
+        "result": store or []
     }
 
 
+@st.cache_resource
 def init_fn_chain():
     llm = ChatOpenAI(model="gpt-4-0613", temperature=0, openai_api_key=os.getenv('OPEN_AI_API_KEY'))
     prompt = ChatPromptTemplate.from_messages(
@@ -142,9 +168,14 @@ if __name__ == '__main__':
 
     langchain.debug = False
 
+    metrics = init_metrics()
     os_client, config = init_opensearch_client()
-    vector_store_products = init_product_search()
-    content_chain = init_content_search()
+    embeddings = init_embeddings()
+    result_cache = init_result_cache(os_client)
+    store_directory = init_store_directory(os_client)
+    intent_router = init_intent_router(embeddings, store_directory)
+    vector_store_products = init_product_search(config, embeddings)
+    content_answerer = init_content_search(config, embeddings)
 
     # Start Streamlit app
     st.set_page_config(layout="wide")
@@ -161,8 +192,13 @@ if __name__ == '__main__':
     }
 
     if the_query:
-        the_chain = init_fn_chain()
-        chain_response = the_chain.run(the_query)
+        # The router embeds the query, a product search for the same query reuses the cached embedding
+        chain_response = intent_router.route(the_query)
+        if chain_response["name"] is None:
+            with metrics.timer("stage", stage="routing"):
+                with get_openai_callback() as routing_callback:
+                    chain_response = init_fn_chain().run(the_query)
+            record_llm_usage(routing_callback, stage="routing")
         print(chain_response)
         function_name = chain_response["name"]
         args = chain_response["arguments"]
@@ -170,7 +206,18 @@ if __name__ == '__main__':
         if function_name not in functions_map:
             st.write("Could not decide which content search to perform.")
         else:
-            response = functions_map[function_name](**args)
+            # The content answer is streamed into this placeholder while it is generated
+            answer_placeholder = st.empty()
+            streamed_tokens = []
+
+            def show_token(token: str):
+                streamed_tokens.append(token)
+                answer_placeholder.markdown("".join(streamed_tokens))
+
+            if function_name == 'execute_content_search':
+                args = {**args, "on_token": show_token}
+            with metrics.timer("stage", stage="tool", tool=function_name):
+                response = functions_map[function_name](**args)
 
             if response and response["tool"] == "product_search":
                 for item in response["result"]:
@@ -180,10 +227,16 @@ if __name__ == '__main__':
                     st.write(item['score'])
 
             if response and response["tool"] == "content_search":
-                st.write(response["result"])
+                answer_placeholder.markdown(response["result"])
             if response and response["tool"] == "opening_hours":
                 result = response['result']
                 st.subheader(f"Store: {result['store_name']} te {result['city']}")
                 st.write(f"{result['street']} - {result['telephone']}")
                 for ot in result["opening_hours"]:
                     st.write(f"{ot['week_day']} {ot['open_time']} - {ot['closing_time']}")
+
+    with st.sidebar:
+        st.subheader("Result cache")
+        st.json(result_cache.stats())
+        st.subheader("Metrics")
+        st.json(metrics.snapshot())
@@ -2,41 +2,43 @@ import os
 import streamlit as st
 from langchain.vectorstores import OpenSearchVectorSearch
 from langchain.embeddings import OpenAIEmbeddings
-from opensearchpy import RequestsHttpConnection
 from dotenv import load_dotenv
 
-from retriever import find_auth_opensearch, OpenSearchClient
+from retriever import find_auth_opensearch, OpenSearchClient, CachedEmbeddings, FaissVectorStore, create_vector_store
 
 load_dotenv()
 
 
+@st.cache_resource
 def init_opensearch_client():
     config = find_auth_opensearch()
     return OpenSearchClient(config, alias_name="sg-products"), config
 
 
-def init_langchain_vectorstore(os_search_url: str):
-    return OpenSearchVectorSearch(
-        index_name="sg-products",
-        embedding_function=OpenAIEmbeddings(openai_api_key=os.getenv('OPEN_AI_API_KEY')),
-        opensearch_url=os_search_url,
-        use_ssl=True,
-        verify_certs=True,
-        http_auth=config["auth"],
-        connection_class=RequestsHttpConnection
-    )
+@st.cache_resource
+def init_embeddings():
+    return CachedEmbeddings(OpenAIEmbeddings(openai_api_key=os.getenv('OPEN_AI_API_KEY')))
 
 
-def execute_lexical_search(client: OpenSearchClient, query: str):
-    body = {"query": {"match": {"title": query}}}
-    found_docs = client.search(body=body, explain=False)
+@st.cache_resource
+def init_langchain_vectorstore(_config: dict, _embeddings: CachedEmbeddings):
+    if os.getenv('FAISS_INDEX_PATH'):
+        return FaissVectorStore.load(path=os.getenv('FAISS_INDEX_PATH'), embedding_function=_embeddings)
 
-    return [{"score": hit['_score'],
-             "title": hit['_source']['title'],
-             "image_name": hit['_source']['metadata']['image_name']} for hit in found_docs["hits"]["hits"]]
+    return create_vector_store(config=_config, index_name="sg-products", embedding_function=_embeddings)
 
 
-def execute_semantic_search(vector_store: OpenSearchVectorSearch, query: str):
+def execute_hybrid_search(client: OpenSearchClient, query: str):
+    found_docs = client.hybrid_search(query=query, query_vector=embeddings.embed_query(query),
+                                      text_field="title", vector_field="title_vector", size=4)
+
+    return {name: [{"score": hit['_score'],
+                    "title": hit['_source']['title'],
+                    "image_name": hit['_source']['metadata']['image_name']} for hit in hits]
+            for name, hits in found_docs.items() if name != "failed"}
+
+
+def execute_semantic_search(vector_store: OpenSearchVectorSearch | FaissVectorStore, query: str):
     found_docs = vector_store.similarity_search_with_score(query=query, text_field="title",
                                                            vector_field="title_vector")
     return [{"score": _score,
@@ -57,8 +59,8 @@ def print_images(images: list):
 
 if __name__ == '__main__':
     os_client, config = init_opensearch_client()
-    os_search_url = f"https://{config['host']}:{config['port']}"
-    lc_vectorstore = init_langchain_vectorstore(os_search_url=os_search_url)
+    embeddings = init_embeddings()
+    lc_vectorstore = init_langchain_vectorstore(config, embeddings)
 
     # Start Streamlit app
     st.set_page_config(layout="wide")
@@ -66,7 +68,7 @@ if __name__ == '__main__':
 
     st.header('LEGO® BrickHeadz - Store™', divider='rainbow')
 
-    col_search, col_span, col_left, col_right = st.columns([1, 0.25, 2, 2])
+    col_search, col_span, col_left, col_middle, col_right = st.columns([1, 0.25, 2, 2, 2])
 
     with col_search:
         st.subheader("Specify Search")
@@ -75,12 +77,23 @@ if __name__ == '__main__':
     with col_left:
         st.subheader("Lexical Search")
 
-    with col_right:
+    with col_middle:
         st.subheader("Semantic Search")
 
+    with col_right:
+        st.subheader("Hybrid Search")
+
     if the_query:
+        # One _msearch request returns the lexical, the semantic and the fused results
+        found = execute_hybrid_search(client=os_client, query=the_query)
+        if isinstance(lc_vectorstore, FaissVectorStore):
+            found["semantic"] = execute_semantic_search(vector_store=lc_vectorstore, query=the_query)
+
         with col_left:
-            print_images(execute_lexical_search(client=os_client, query=the_query))
+            print_images(found["lexical"])
+
+        with col_middle:
+            print_images(found["semantic"])
 
         with col_right:
-            print_images(execute_semantic_search(vector_store=lc_vectorstore, query=the_query))
+            print_images(found["hits"])
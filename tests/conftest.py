@@ -0,0 +1,16 @@
+import pytest
+
+from benchmark.stand_in import OpenSearchStandIn, serve
+from retriever.connection import close_connections
+
+
+@pytest.fixture
+def stand_in():
+    """ In memory OpenSearch stand-in served on a free port. """
+    stand_in = OpenSearchStandIn()
+    server = serve(stand_in, port=0)
+    stand_in.config = {"host": "127.0.0.1", "port": server.server_port, "use_ssl": False}
+    yield stand_in
+    close_connections()
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,110 @@
+import json
+import math
+from typing import List
+
+import pytest
+
+pytest.importorskip("faiss")
+
+from langchain.embeddings.base import Embeddings  # noqa: E402
+
+from retriever.batch_search import batch_search, embed_batches, ndcg_at_k, read_labels, read_queries, \
+    recall_at_k  # noqa: E402
+from retriever.faiss_store import FaissVectorStore  # noqa: E402
+from retriever.opensearch import OpenSearchClient  # noqa: E402
+
+VECTORS = {"wally": [1.0, 0.0], "donald duck": [0.0, 1.0], "daisy duck": [0.25, 0.75]}
+
+
+class LookupEmbeddings(Embeddings):
+    def __init__(self):
+        self.batches = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.batches.append(list(texts))
+        return [VECTORS[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return VECTORS[text]
+
+
+def test_recall_counts_the_relevant_ids_in_the_top_k():
+    assert recall_at_k(["a", "b", "c"], {"a": 1, "c": 1, "d": 1, "e": 0}, k=2) == pytest.approx(1 / 3)
+    assert recall_at_k(["a"], {"a": 0}, k=10) == 0.0
+
+
+def test_ndcg_uses_the_graded_gain():
+    assert ndcg_at_k(["a", "b"], {"a": 2, "b": 1}, k=2) == pytest.approx(1.0)
+    swapped = (1 + 3 / math.log2(3)) / (3 + 1 / math.log2(3))
+    assert ndcg_at_k(["b", "a"], {"a": 2, "b": 1}, k=2) == pytest.approx(swapped)
+    assert ndcg_at_k(["x"], {}, k=2) == 0.0
+
+
+def test_queries_are_read_from_text_and_jsonl(tmp_path):
+    text_file = tmp_path / "queries.txt"
+    text_file.write_text("wally\n\ndonald duck\n", encoding="utf-8")
+    jsonl_file = tmp_path / "queries.jsonl"
+    jsonl_file.write_text('{"query_id": 7, "query": "wally"}\n{"query": "donald duck"}\n', encoding="utf-8")
+
+    assert list(read_queries(str(text_file))) == [{"query_id": "1", "query": "wally"},
+                                                  {"query_id": "3", "query": "donald duck"}]
+    assert list(read_queries(str(jsonl_file))) == [{"query_id": "7", "query": "wally"},
+                                                   {"query_id": "2", "query": "donald duck"}]
+
+
+def test_labels_are_read_from_jsonl_and_csv(tmp_path):
+    jsonl_file = tmp_path / "labels.jsonl"
+    jsonl_file.write_text('{"query_id": 7, "relevant": ["1", "2"]}\n{"query": "Donald  Duck", "relevant": {"3": 2}}\n',
+                          encoding="utf-8")
+    csv_file = tmp_path / "labels.csv"
+    csv_file.write_text("query,doc_id,grade\nWally,1,2\nWally,2,\n", encoding="utf-8")
+
+    assert read_labels(str(jsonl_file)) == {"7": {"1": 1.0, "2": 1.0}, "donald duck": {"3": 2.0}}
+    assert read_labels(str(csv_file)) == {"wally": {"1": 2.0, "2": 1.0}}
+
+
+def test_repeated_queries_in_a_batch_are_embedded_once():
+    embeddings = LookupEmbeddings()
+    queries = [{"query_id": str(position), "query": query}
+               for position, query in enumerate(["wally", "donald duck", "wally", "daisy duck"])]
+
+    batches = list(embed_batches(queries, embeddings, batch_size=3))
+
+    assert embeddings.batches == [["wally", "donald duck"], ["daisy duck"]]
+    assert [vectors.tolist() for _, vectors in batches] == [[[1.0, 0.0], [0.0, 1.0], [1.0, 0.0]],
+                                                            [[0.25, 0.75]]]
+
+
+def test_batch_search_on_faiss_writes_the_results_and_the_metrics(tmp_path):
+    vector_store = FaissVectorStore.from_texts(["wally", "donald duck"], LookupEmbeddings(), ids=["w", "d"])
+    queries = [{"query_id": "1", "query": "wally"}, {"query_id": "2", "query": "daisy duck"}]
+    output_path = str(tmp_path / "results.jsonl")
+
+    summary = batch_search(queries, LookupEmbeddings(), output_path, vector_store=vector_store,
+                           labels={"1": {"w": 1}, "daisy duck": {"w": 1}}, k=1)
+
+    assert summary["queries"] == 2
+    assert summary["labelled"] == 2
+    assert summary["recall@1"] == 0.5
+    with open(output_path) as file:
+        rows = [json.loads(line) for line in file]
+    assert [row["hits"][0]["id"] for row in rows] == ["w", "d"]
+
+
+def test_batch_search_on_opensearch_reports_failed_searches(stand_in, tmp_path):
+    client = OpenSearchClient(stand_in.config, alias_name="sg-products")
+    client.reindex([{"id": "w", "title": "wally", "title_vector": [1.0, 0.0]}], id_field="id")
+    queries = [{"query_id": "1", "query": "wally"}]
+
+    summary = batch_search(queries, LookupEmbeddings(), str(tmp_path / "results.jsonl"), client=client,
+                           labels={"1": {"w": 1}}, k=1)
+    assert summary["recall@1"] == 1.0
+
+    client.delete_index(client.current_index_for())
+    summary = batch_search(queries, LookupEmbeddings(), str(tmp_path / "results.jsonl"), client=client, k=1)
+    assert summary["errors"] == 1
+
+
+def test_exactly_one_search_backend_is_required(tmp_path):
+    with pytest.raises(ValueError):
+        batch_search([], LookupEmbeddings(), str(tmp_path / "results.jsonl"))
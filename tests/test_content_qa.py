@@ -0,0 +1,84 @@
+import pytest
+from langchain.schema import Document
+
+from retriever import content_qa
+from retriever.content_qa import ContentAnswerer
+
+
+class FixedVectorStore:
+    def __init__(self, scored_documents):
+        self.scored_documents = scored_documents
+
+    def similarity_search_with_score(self, query, k):
+        return self.scored_documents[:k]
+
+
+class EchoLLM:
+    """ Streams the words of the context back as the answer. """
+    model_name = "gpt-3.5-turbo"
+
+    def __init__(self):
+        self.prompts = []
+
+    def predict(self, prompt, callbacks):
+        self.prompts.append(prompt)
+        answer = " ".join(prompt.split("Question:")[0].split()[-5:])
+        for token in answer.split(" "):
+            for callback in callbacks:
+                callback.on_llm_new_token(token + " ")
+        return answer + " "
+
+
+@pytest.fixture(autouse=True)
+def count_words(monkeypatch):
+    monkeypatch.setattr(content_qa, "count_tokens", lambda text, model: len(text.split()))
+
+
+def scored(text: str, score: float, source: str = None, start_index: int = None) -> tuple:
+    metadata = {"source": source, "start_index": start_index} if source else {}
+    return Document(page_content=text, metadata=metadata), score
+
+
+def answerer(max_context_tokens: int = 800) -> ContentAnswerer:
+    return ContentAnswerer(vector_store=None, llm=EchoLLM(), max_context_tokens=max_context_tokens)
+
+
+def test_overlapping_chunks_of_a_source_are_merged():
+    text = "Returns are free within thirty days of the delivery of your order."
+    context = answerer().select_context([scored(text[0:30], 0.9, "help-a.txt", 0),
+                                         scored(text[20:], 0.8, "help-a.txt", 20),
+                                         scored(text[20:], 0.7, "help-b.txt", 20)])
+
+    assert context == [text, text[20:]]
+
+
+def test_near_duplicates_are_dropped_and_the_best_chunk_is_kept():
+    context = answerer().select_context([
+        scored("You can return a set within thirty days for free", 0.7),
+        scored("You can return a set within thirty days for free!", 0.9),
+        scored("Stores are open on sunday", 0.8)
+    ])
+
+    assert context == ["You can return a set within thirty days for free!", "Stores are open on sunday"]
+
+
+def test_chunks_are_packed_in_order_of_score_within_the_budget():
+    context = answerer(max_context_tokens=6).select_context([
+        scored("one two three", 0.9),
+        scored("four five six seven", 0.8),
+        scored("eight nine", 0.7)
+    ])
+
+    assert context == ["one two three", "eight nine"]
+
+
+def test_the_answer_is_streamed_and_uses_the_packed_context():
+    tokens = []
+    qa = ContentAnswerer(FixedVectorStore([scored("Stores open at ten on sunday", 0.9),
+                                           scored("Returns are free", 0.8)]), EchoLLM(), k=1)
+
+    answer = qa.answer("When do stores open?", on_token=tokens.append)
+
+    assert answer == "open at ten on sunday"
+    assert "".join(tokens).strip() == "open at ten on sunday"
+    assert "Returns are free" not in qa.llm.prompts[0]
@@ -0,0 +1,83 @@
+from typing import List
+
+from langchain.embeddings.base import Embeddings
+
+from retriever.embedding_cache import CachedEmbeddings, embedding_cache_key
+
+
+class CountingEmbeddings(Embeddings):
+    """ Embeds a text as its length and the number of words, and remembers which texts were embedded. """
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.embedded.extend(texts)
+        return [[float(len(text)), float(len(text.split()))] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def test_texts_that_only_differ_in_whitespace_share_the_key():
+    assert embedding_cache_key("ada", "Lego  Wally\n") == embedding_cache_key("ada", "Lego Wally")
+    assert embedding_cache_key("ada", "Lego Wally") != embedding_cache_key("other", "Lego Wally")
+
+
+def test_repeated_texts_are_embedded_once_and_counted_as_hits(tmp_path):
+    embeddings = CountingEmbeddings()
+    cache = CachedEmbeddings(embeddings, model_name="test", cache_path=str(tmp_path / "cache.sqlite"))
+
+    vectors = cache.embed_documents(["wally", "wally", "donald duck"])
+    assert vectors == [[5.0, 1.0], [5.0, 1.0], [11.0, 2.0]]
+    assert embeddings.embedded == ["wally", "donald duck"]
+
+    cache.embed_documents(["wally", "wally"])
+    assert cache.stats()["hits_memory"] == 2
+    assert cache.stats()["misses"] == 3
+
+
+def test_the_disk_tier_survives_a_restart(tmp_path):
+    cache_path = str(tmp_path / "cache.sqlite")
+    CachedEmbeddings(CountingEmbeddings(), model_name="test", cache_path=cache_path).embed_documents(["wally"])
+
+    embeddings = CountingEmbeddings()
+    cache = CachedEmbeddings(embeddings, model_name="test", cache_path=cache_path)
+    assert cache.embed_documents(["wally", "wally"]) == [[5.0, 1.0], [5.0, 1.0]]
+    assert embeddings.embedded == []
+    assert cache.stats()["hits_disk"] == 2
+
+
+def test_the_memory_tier_evicts_the_least_recently_used(tmp_path):
+    embeddings = CountingEmbeddings()
+    cache = CachedEmbeddings(embeddings, model_name="test", cache_path=None, max_memory_items=2)
+
+    cache.embed_documents(["a", "b"])
+    cache.embed_query("a")
+    cache.embed_query("c")
+    cache.embed_query("a")
+    cache.embed_query("b")
+
+    assert embeddings.embedded == ["a", "b", "c", "b"]
+
+
+def test_expired_disk_entries_are_embedded_again(tmp_path, monkeypatch):
+    now = 1_000_000.0
+    monkeypatch.setattr("retriever.embedding_cache.time.time", lambda: now)
+    cache_path = str(tmp_path / "cache.sqlite")
+    CachedEmbeddings(CountingEmbeddings(), model_name="test", cache_path=cache_path,
+                     ttl_seconds=60).embed_documents(["wally"])
+
+    now += 61
+    embeddings = CountingEmbeddings()
+    CachedEmbeddings(embeddings, model_name="test", cache_path=cache_path, ttl_seconds=60).embed_query("wally")
+    assert embeddings.embedded == ["wally"]
+
+
+def test_the_disk_tier_is_bounded(tmp_path):
+    cache = CachedEmbeddings(CountingEmbeddings(), model_name="test", cache_path=str(tmp_path / "cache.sqlite"),
+                             max_disk_items=2)
+
+    cache.embed_documents(["a", "b", "c"])
+
+    assert cache.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] == 2
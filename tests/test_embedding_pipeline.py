@@ -0,0 +1,114 @@
+import pytest
+
+from retriever import embedding_pipeline
+from retriever.embedding_pipeline import EmbeddingPipeline, TokenBucket
+
+
+class FakeClock:
+    """ Replaces time.monotonic and time.sleep, sleeping advances the clock. """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class RateLimitError(Exception):
+    pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(embedding_pipeline.time, "monotonic", fake_clock.monotonic)
+    monkeypatch.setattr(embedding_pipeline.time, "sleep", fake_clock.sleep)
+    return fake_clock
+
+
+def word_count_pipeline(embed_batch_fn, **kwargs) -> EmbeddingPipeline:
+    pipeline = EmbeddingPipeline(embed_batch_fn=embed_batch_fn, max_workers=1, **kwargs)
+    pipeline.count_tokens = lambda text: len(text.split())
+    return pipeline
+
+
+def test_the_bucket_only_waits_for_the_missing_tokens(clock):
+    bucket = TokenBucket(capacity=10, period=10)
+
+    bucket.acquire(10)
+    assert clock.sleeps == []
+
+    bucket.acquire(4)
+    assert clock.sleeps == [4.0]
+    assert clock.now == 4.0
+
+
+def test_the_bucket_refills_up_to_its_capacity(clock):
+    bucket = TokenBucket(capacity=10, period=10)
+    bucket.acquire(10)
+
+    clock.now += 100
+    bucket.acquire(10)
+    bucket.acquire(1)
+
+    assert clock.sleeps == [1.0]
+
+
+def test_a_request_larger_than_the_bucket_waits_for_a_full_bucket(clock):
+    bucket = TokenBucket(capacity=10, period=10)
+    bucket.acquire(3)
+
+    bucket.acquire(50)
+
+    assert clock.sleeps == [3.0]
+
+
+def test_batches_are_bounded_by_tokens_and_size_and_keep_the_order(clock):
+    batches = []
+
+    def embed_batch(batch):
+        batches.append(list(batch))
+        return [[float(len(text))] for text in batch]
+
+    pipeline = word_count_pipeline(embed_batch, max_batch_tokens=4, max_batch_size=2)
+    vectors = pipeline.embed(["a b", "c d", "e", "f g h i j", "k"])
+
+    assert batches == [["a b", "c d"], ["e"], ["f g h i j"], ["k"]]
+    assert vectors[:, 0].tolist() == [3.0, 3.0, 1.0, 9.0, 1.0]
+
+
+def test_the_request_quota_paces_the_batches(clock):
+    pipeline = word_count_pipeline(lambda batch: [[1.0]] * len(batch), max_batch_size=1, requests_per_minute=2)
+
+    pipeline.embed(["a", "b", "c"])
+
+    assert clock.sleeps == [30.0]
+
+
+def test_rate_limited_batches_are_retried(clock, monkeypatch):
+    monkeypatch.setattr(embedding_pipeline.random, "uniform", lambda low, high: high)
+    attempts = []
+
+    def embed_batch(batch):
+        attempts.append(batch)
+        if len(attempts) < 3:
+            raise RateLimitError("slow down")
+        return [[1.0]] * len(batch)
+
+    pipeline = word_count_pipeline(embed_batch)
+
+    assert pipeline.embed_documents(["a"]) == [[1.0]]
+    assert clock.sleeps == [1.0, 2.0]
+
+
+def test_other_errors_are_not_retried(clock):
+    def embed_batch(batch):
+        raise ValueError("bad input")
+
+    with pytest.raises(ValueError):
+        word_count_pipeline(embed_batch).embed(["a"])
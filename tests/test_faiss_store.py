@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+from retriever.faiss_store import FaissVectorStore, create_faiss_index  # noqa: E402
+
+
+class AxisEmbeddings:
+    """ Embeds a text as the unit vector of the axis named by its first character. """
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        vector = [0.0] * 4
+        vector["abcd".index(text[0])] = 1.0
+        return vector
+
+
+def axis_store(**index_params) -> FaissVectorStore:
+    return FaissVectorStore.from_texts(["apple", "banana", "cherry", "date"], AxisEmbeddings(),
+                                       metadatas=[{"position": position} for position in range(4)],
+                                       ids=["a1", "b2", "c3", "d4"], **index_params)
+
+
+def test_scores_follow_the_opensearch_l2_score():
+    results = axis_store().similarity_search_with_score("banana split", k=2)
+
+    assert [document.page_content for document, _ in results] == ["banana", "apple"]
+    assert [score for _, score in results] == pytest.approx([1.0, 1.0 / 3.0])
+    assert results[0][0].metadata == {"position": 1}
+
+
+def test_missing_results_are_left_out():
+    assert len(axis_store().similarity_search("cherry", k=10)) == 4
+
+
+def test_save_and_load_keep_the_documents_in_order(tmp_path):
+    axis_store(index_type="hnsw", m=4).save(str(tmp_path))
+
+    store = FaissVectorStore.load(str(tmp_path), AxisEmbeddings())
+
+    assert store.documents[2] == {"id": "c3", "text": "cherry", "metadata": {"position": 2}}
+    assert store.similarity_search("date", k=1)[0].page_content == "date"
+
+
+def test_the_number_of_vectors_must_match_the_documents():
+    with pytest.raises(ValueError):
+        FaissVectorStore(create_faiss_index(np.eye(4)), [{"id": "1", "text": "a", "metadata": {}}], AxisEmbeddings())
+
+
+def test_unknown_index_types_are_rejected():
+    with pytest.raises(ValueError):
+        create_faiss_index(np.eye(4), index_type="lsh")
@@ -0,0 +1,89 @@
+import pytest
+
+from benchmark.stand_in import StandInError
+from retriever.opensearch import OpenSearchClient, fuse_hybrid_responses, fuse_results
+
+
+def hits(*ids_and_scores) -> list:
+    return [{"_id": doc_id, "_score": score} for doc_id, score in ids_and_scores]
+
+
+def response(*ids_and_scores) -> dict:
+    return {"hits": {"hits": hits(*ids_and_scores)}, "status": 200}
+
+
+def test_reciprocal_rank_fusion_rewards_hits_in_both_lists():
+    fused = fuse_results([hits(("a", 9.0), ("b", 8.0)), hits(("b", 0.9), ("c", 0.8))], fusion="rrf",
+                         weights=[1.0, 1.0], rank_constant=1)
+
+    assert [hit["_id"] for hit in fused] == ["b", "a", "c"]
+    assert [hit["_score"] for hit in fused] == pytest.approx([1 / 3 + 1 / 2, 1 / 2, 1 / 3])
+
+
+def test_score_fusion_normalizes_the_scores_per_list():
+    fused = fuse_results([hits(("a", 20.0), ("b", 10.0)), hits(("b", 0.9), ("c", 0.5))], fusion="score",
+                         weights=[0.25, 0.75])
+
+    assert [(hit["_id"], hit["_score"]) for hit in fused] == [("b", pytest.approx(0.75)),
+                                                              ("a", pytest.approx(0.25)),
+                                                              ("c", pytest.approx(0.0))]
+
+
+def test_a_list_with_equal_scores_counts_as_fully_relevant():
+    fused = fuse_results([hits(("a", 3.0), ("b", 3.0))], fusion="score", weights=[0.5])
+
+    assert [hit["_score"] for hit in fused] == [0.5, 0.5]
+
+
+def test_unknown_fusions_are_rejected():
+    with pytest.raises(ValueError):
+        fuse_results([], fusion="max", weights=[])
+
+
+def test_a_failed_query_is_left_out_of_the_fusion():
+    result = fuse_hybrid_responses([{"error": {"type": "parsing_exception"}, "status": 400},
+                                    response(("b", 0.9), ("c", 0.8))], size=1, fusion="rrf", weights=[0.5, 0.5])
+
+    assert result["failed"] == ["lexical"]
+    assert result["lexical"] == []
+    assert [hit["_id"] for hit in result["semantic"]] == ["b"]
+    assert [hit["_id"] for hit in result["hits"]] == ["b"]
+
+
+def test_all_queries_failing_raises():
+    with pytest.raises(Exception, match="All queries of the hybrid search failed"):
+        fuse_hybrid_responses([{"error": {"type": "a"}}, {"error": {"type": "b"}}], size=10, fusion="rrf",
+                              weights=[0.5, 0.5])
+
+
+@pytest.fixture
+def client(stand_in):
+    client = OpenSearchClient(stand_in.config, alias_name="sg-products")
+    client.reindex([{"id": "1", "title": "red brick", "title_vector": [1.0, 0.0]},
+                    {"id": "2", "title": "blue brick", "title_vector": [0.0, 1.0]},
+                    {"id": "3", "title": "green plate", "title_vector": [0.9, 0.1]}], id_field="id")
+    return client
+
+
+def test_hybrid_search_fuses_the_lexical_and_semantic_results(client):
+    result = client.hybrid_search("red", [1.0, 0.0], size=2)
+
+    assert result["failed"] == []
+    assert [hit["_id"] for hit in result["hits"]] == ["1", "3"]
+    assert all("title_vector" not in hit["_source"] for hit in result["hits"])
+
+
+def test_hybrid_search_returns_the_lexical_results_when_the_knn_query_fails(client, stand_in, monkeypatch):
+    search = stand_in.search
+
+    def search_without_knn(target, body):
+        if "knn" in body.get("query", {}):
+            raise StandInError(400, "illegal_argument_exception", "no knn plugin")
+        return search(target, body)
+
+    monkeypatch.setattr(stand_in, "search", search_without_knn)
+
+    result = client.hybrid_search("brick", [1.0, 0.0], size=5)
+
+    assert result["failed"] == ["semantic"]
+    assert {hit["_id"] for hit in result["hits"]} == {"1", "2"}
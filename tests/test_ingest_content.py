@@ -0,0 +1,94 @@
+from typing import List
+
+from langchain.embeddings.base import Embeddings
+
+from benchmark.stand_in import fake_embedding
+from ingest.content import chunk_file, chunk_files, discover_files, embed_chunks, ingest_content, unique_chunks
+from retriever.opensearch import OpenSearchClient
+
+
+class FakeEmbeddings(Embeddings):
+    def __init__(self):
+        self.batches = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.batches.append(list(texts))
+        return [fake_embedding(text, dimension=8).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def write_file(folder, name: str, text: str) -> str:
+    path = folder / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def chunk(text: str, source: str = "help-a.txt") -> dict:
+    return {"text": text, "metadata": {"source": source, "start_index": 0}}
+
+
+def test_files_are_discovered_in_sub_folders_without_the_shop_locations(tmp_path):
+    write_file(tmp_path, "help-b.txt", "b")
+    write_file(tmp_path, "nested/help-a.txt", "a")
+    write_file(tmp_path, "help-shop-locations.txt", "shops")
+    write_file(tmp_path, "notes.txt", "notes")
+
+    assert discover_files(str(tmp_path)) == [str(tmp_path / "help-b.txt"), str(tmp_path / "nested/help-a.txt")]
+
+
+def test_chunks_keep_the_source_and_start_index(tmp_path):
+    text = " ".join(f"word{position}" for position in range(100))
+    path = write_file(tmp_path, "help-a.txt", text)
+
+    chunks = chunk_file(path, chunk_size=100, chunk_overlap=20)
+
+    assert len(chunks) > 1
+    assert all(chunk["metadata"]["source"] == "help-a.txt" for chunk in chunks)
+    assert all(text[chunk["metadata"]["start_index"]:].startswith(chunk["text"]) for chunk in chunks)
+
+
+def test_chunks_are_yielded_in_the_order_of_the_files(tmp_path):
+    paths = [write_file(tmp_path, f"help-{position}.txt", f"text of file {position}") for position in range(5)]
+
+    chunks = list(chunk_files(paths, max_workers=2, max_pending_files=2))
+
+    assert [chunk["text"] for chunk in chunks] == [f"text of file {position}" for position in range(5)]
+
+
+def test_duplicate_texts_are_skipped_and_counted_per_source():
+    duplicates = {}
+
+    unique = list(unique_chunks([chunk("Opening hours"), chunk("Opening  hours\n", "help-b.txt"),
+                                 chunk("Returns"), chunk("Opening hours", "help-b.txt")], duplicates))
+
+    assert [item["text"] for _, item in unique] == ["Opening hours", "Returns"]
+    assert duplicates == {"help-b.txt": 2}
+    assert len({chunk_id for chunk_id, _ in unique}) == 2
+
+
+def test_chunks_are_embedded_per_batch():
+    embeddings = FakeEmbeddings()
+    chunks = [(str(position), chunk(f"text {position}")) for position in range(5)]
+
+    embedded = list(embed_chunks(chunks, embeddings, batch_size=2))
+
+    assert [len(batch) for batch in embeddings.batches] == [2, 2, 1]
+    assert [chunk_id for chunk_id, _, _ in embedded] == ["0", "1", "2", "3", "4"]
+
+
+def test_content_is_ingested_into_a_new_generation(stand_in, tmp_path):
+    client = OpenSearchClient(stand_in.config, alias_name="sg-content")
+    paths = [write_file(tmp_path, "help-a.txt", "How do I return a set?\n\nSend it back within 30 days."),
+             write_file(tmp_path, "help-b.txt", "How do I return a set?")]
+
+    summary = ingest_content(client, FakeEmbeddings(), paths, chunk_size=40, chunk_overlap=0, max_workers=1)
+
+    assert summary["index"] == client.current_index_for()
+    assert summary["files"] == 2
+    assert summary["chunks"] == 2
+    assert summary["duplicates"] == {"help-b.txt": 1}
+    hit = client.search({"query": {"match": {"text": "return"}}})["hits"]["hits"][0]
+    assert set(hit["_source"]) == {"text", "vector_field", "metadata"}
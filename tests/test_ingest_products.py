@@ -0,0 +1,114 @@
+import csv
+from typing import List
+
+import pytest
+from langchain.embeddings.base import Embeddings
+
+from benchmark.stand_in import fake_embedding
+from ingest.products import derive_fields, ingest_products, load_manifest
+from retriever.opensearch import OpenSearchClient
+
+COLUMNS = ["Position", "product_link", "number_of_pieces", "title", "price", "image_link"]
+
+
+class FakeEmbeddings(Embeddings):
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.embedded.extend(texts)
+        return [fake_embedding(text, dimension=8).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def product_row(product_id: str, title: str, price: str = "€9,99") -> dict:
+    return {
+        "Position": "1",
+        "product_link": f"https://www.lego.com/nl-nl/product/{title.lower().replace(' ', '-')}-{product_id}",
+        "number_of_pieces": "100",
+        "title": title,
+        "price": price,
+        "image_link": f"https://www.lego.com/cdn/cs/set/assets/{product_id}.png"
+    }
+
+
+def write_csv(path, rows: list) -> str:
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return str(path)
+
+
+@pytest.fixture
+def client(stand_in):
+    return OpenSearchClient(stand_in.config, alias_name="sg-products")
+
+
+def test_the_id_comes_from_the_image_or_the_product_link():
+    from_image, from_link = derive_fields([
+        product_row("40560", "Professors"),
+        {"Position": "2", "name": "Wally", "link": "https://www.lego.com/nl-nl/product/wally-40616"}
+    ], image_folder="/does/not/exist")
+
+    assert (from_image["id"], from_image["image_name"]) == ("40560", "40560.png")
+    assert "Position" not in from_image
+    assert (from_link["id"], from_link["title"], from_link["image_name"]) == ("40616", "Wally", "40616.png")
+
+
+def test_the_first_run_builds_the_index_and_creates_the_alias(client, tmp_path):
+    paths = [write_csv(tmp_path / "products.csv", [product_row("1", "Wally"), product_row("2", "Donald")])]
+    manifest_path = str(tmp_path / "manifest.json")
+
+    summary = ingest_products(client, FakeEmbeddings(), paths, manifest_path=manifest_path)
+
+    assert summary == {"unchanged": 0, "upserted": 2, "deleted": 0, "failed": 0}
+    assert client.count_docs()["count"] == 2
+    manifest = load_manifest(manifest_path)
+    assert manifest["index"] == client.current_index_for()
+    assert sorted(manifest["documents"]) == ["1", "2"]
+
+
+def test_only_changed_products_are_embedded_and_missing_products_deleted(client, tmp_path):
+    manifest_path = str(tmp_path / "manifest.json")
+    first_file = write_csv(tmp_path / "first.csv", [product_row("1", "Wally"), product_row("2", "Donald"),
+                                                    product_row("3", "Daisy")])
+    ingest_products(client, FakeEmbeddings(), [first_file], manifest_path=manifest_path)
+
+    embeddings = FakeEmbeddings()
+    second_file = write_csv(tmp_path / "second.csv", [product_row("1", "Wally"), product_row("2", "Donald Duck"),
+                                                      product_row("4", "Goofy")])
+    summary = ingest_products(client, embeddings, [second_file], manifest_path=manifest_path)
+
+    assert summary == {"unchanged": 1, "upserted": 2, "deleted": 1, "failed": 0}
+    assert embeddings.embedded == ["Donald Duck", "Goofy"]
+    assert sorted(load_manifest(manifest_path)["documents"]) == ["1", "2", "4"]
+    assert client.count_docs()["count"] == 3
+
+
+def test_a_second_run_without_changes_embeds_nothing(client, tmp_path):
+    manifest_path = str(tmp_path / "manifest.json")
+    paths = [write_csv(tmp_path / "products.csv", [product_row("1", "Wally")])]
+    ingest_products(client, FakeEmbeddings(), paths, manifest_path=manifest_path)
+
+    embeddings = FakeEmbeddings()
+    summary = ingest_products(client, embeddings, paths, manifest_path=manifest_path)
+
+    assert summary == {"unchanged": 1, "upserted": 0, "deleted": 0, "failed": 0}
+    assert embeddings.embedded == []
+
+
+def test_a_manifest_of_another_index_indexes_everything_again(client, tmp_path):
+    manifest_path = str(tmp_path / "manifest.json")
+    paths = [write_csv(tmp_path / "products.csv", [product_row("1", "Wally")])]
+    ingest_products(client, FakeEmbeddings(), paths, manifest_path=manifest_path)
+    client.reindex([{"id": "1", "title": "Wally"}], id_field="id")
+
+    embeddings = FakeEmbeddings()
+    summary = ingest_products(client, embeddings, paths, manifest_path=manifest_path)
+
+    assert summary["upserted"] == 1
+    assert embeddings.embedded == ["Wally"]
+    assert load_manifest(manifest_path)["index"] == client.current_index_for()
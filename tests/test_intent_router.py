@@ -0,0 +1,69 @@
+from typing import List
+
+import pytest
+from langchain.embeddings.base import Embeddings
+
+from retriever.intent_router import IntentRouter, evaluate_thresholds
+
+VECTORS = {
+    "donald duck": [1.0, 0.0, 0.0],
+    "harry potter": [0.9, 0.1, 0.0],
+    "opening hours": [0.0, 1.0, 0.0],
+    "store in utrecht": [0.1, 0.9, 0.0],
+    "iron man": [0.95, 0.05, 0.0],
+    "when does utrecht open": [0.05, 0.95, 0.0],
+    "products near me": [0.6, 0.6, 0.0],
+    "weather today": [0.0, 0.0, 1.0]
+}
+
+
+class LookupEmbeddings(Embeddings):
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [VECTORS[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return VECTORS[text]
+
+
+def router(**kwargs) -> IntentRouter:
+    return IntentRouter(LookupEmbeddings(), {"execute_product_search": ["donald duck", "harry potter"],
+                                             "find_store": ["opening hours", "store in utrecht"]}, **kwargs)
+
+
+def test_a_clear_query_is_routed_with_the_query_as_argument():
+    route = router(min_score=0.8, min_margin=0.1).route("iron man")
+
+    assert route["name"] == "execute_product_search"
+    assert route["arguments"] == {"query": "iron man"}
+    assert route["score"] > route["scores"]["find_store"]
+
+
+def test_ambiguous_and_out_of_scope_queries_fall_back():
+    assert router(min_score=0.5, min_margin=0.1).route("products near me")["name"] is None
+    assert router(min_score=0.5, min_margin=0.0).route("weather today")["name"] is None
+
+
+def test_an_extractor_without_arguments_falls_back():
+    routes = router(min_score=0.8, min_margin=0.1,
+                    argument_extractors={"find_store": lambda query: {"city": "Utrecht"} if "utrecht" in query
+                                         else None})
+
+    assert routes.route("when does utrecht open")["arguments"] == {"city": "Utrecht"}
+    assert routes.route("opening hours")["name"] is None
+
+
+def test_thresholds_are_evaluated_against_the_labels():
+    labelled = [{"query": "iron man", "tool": "execute_product_search"},
+                {"query": "when does utrecht open", "tool": "find_store"},
+                {"query": "products near me", "tool": "find_store"},
+                {"query": "weather today", "tool": None}]
+
+    results = evaluate_thresholds(router(), labelled, min_scores=[0.0, 0.9], min_margins=[0.0, 0.5])
+    by_thresholds = {(result["min_score"], result["min_margin"]): result for result in results}
+
+    assert len(results) == 4
+    assert by_thresholds[(0.0, 0.0)]["coverage"] == 1.0
+    assert by_thresholds[(0.0, 0.0)]["out_of_scope_routed"] == 1
+    assert by_thresholds[(0.9, 0.5)]["coverage"] == pytest.approx(2 / 3)
+    assert by_thresholds[(0.9, 0.5)]["precision"] == 1.0
+    assert by_thresholds[(0.9, 0.5)]["out_of_scope_routed"] == 0
@@ -0,0 +1,129 @@
+import datetime
+import json
+
+import boto3
+import pytest
+from botocore.exceptions import NoCredentialsError
+from botocore.stub import Stubber
+
+from retriever.opensearch_auth_local import LazyCredentials, assumed_role_credentials, find_auth_opensearch, \
+    load_stack_outputs
+
+STACK_NAME = "test-stack"
+ROLE_ARN = "arn:aws:iam::123456789012:role/admin"
+OUTPUTS = {"cdk-os-sg-DomainEndpoint": "search-test.eu-west-1.es.amazonaws.com", "cdk-os-sg-AdminUserRoleArn": ROLE_ARN}
+
+
+class StubbedSession:
+    """ A boto3 session that hands out the same stubbed client for every call of client. """
+
+    def __init__(self):
+        self.session = boto3.Session(aws_access_key_id="test", aws_secret_access_key="test", region_name="eu-west-1")
+        self.profile_name = "test"
+        self.clients = {}
+        self.stubbers = {}
+
+    def client(self, service_name: str):
+        if service_name not in self.clients:
+            self.clients[service_name] = self.session.client(service_name)
+            self.stubbers[service_name] = Stubber(self.clients[service_name])
+            self.stubbers[service_name].activate()
+        return self.clients[service_name]
+
+    def stubber(self, service_name: str) -> Stubber:
+        self.client(service_name)
+        return self.stubbers[service_name]
+
+    def get_credentials(self):
+        return self.session.get_credentials()
+
+
+def add_describe_stacks(session: StubbedSession):
+    session.stubber("cloudformation").add_response("describe_stacks", {"Stacks": [{
+        "StackName": STACK_NAME,
+        "CreationTime": datetime.datetime(2023, 9, 1, tzinfo=datetime.timezone.utc),
+        "StackStatus": "CREATE_COMPLETE",
+        "Outputs": [{"OutputKey": key.replace("-", ""), "OutputValue": value, "ExportName": key}
+                    for key, value in OUTPUTS.items()] + [{"OutputKey": "NotExported", "OutputValue": "ignored"}]
+    }]}, {"StackName": STACK_NAME})
+
+
+def add_assume_role(session: StubbedSession, access_key: str, expires_in: datetime.timedelta):
+    session.stubber("sts").add_response("assume_role", {"Credentials": {
+        "AccessKeyId": access_key,
+        "SecretAccessKey": "secret",
+        "SessionToken": "token",
+        "Expiration": datetime.datetime.now(datetime.timezone.utc) + expires_in
+    }}, {"RoleArn": ROLE_ARN, "RoleSessionName": "assumed-opensearch-user-admin-role"})
+
+
+def test_load_stack_outputs_uses_the_cache_within_the_ttl(tmp_path):
+    session = StubbedSession()
+    add_describe_stacks(session)
+    cache_path = str(tmp_path / "stack_outputs.json")
+
+    assert load_stack_outputs(session, stack_name=STACK_NAME, cache_path=cache_path) == OUTPUTS
+    # No response is queued anymore, a second call of CloudFormation would fail
+    assert load_stack_outputs(session, stack_name=STACK_NAME, cache_path=cache_path) == OUTPUTS
+    session.stubber("cloudformation").assert_no_pending_responses()
+
+
+def test_load_stack_outputs_fetches_again_after_the_ttl(tmp_path, monkeypatch):
+    session = StubbedSession()
+    add_describe_stacks(session)
+    add_describe_stacks(session)
+    cache_path = str(tmp_path / "stack_outputs.json")
+
+    now = 1_000_000.0
+    monkeypatch.setattr("retriever.opensearch_auth_local.time.time", lambda: now)
+    load_stack_outputs(session, stack_name=STACK_NAME, cache_path=cache_path, cache_ttl_seconds=60)
+    now += 61
+    load_stack_outputs(session, stack_name=STACK_NAME, cache_path=cache_path, cache_ttl_seconds=60)
+
+    session.stubber("cloudformation").assert_no_pending_responses()
+    with open(cache_path) as file:
+        assert json.load(file)[STACK_NAME]["fetched_at"] == now
+
+
+def test_load_stack_outputs_ignores_a_corrupt_cache(tmp_path):
+    session = StubbedSession()
+    add_describe_stacks(session)
+    cache_path = tmp_path / "stack_outputs.json"
+    cache_path.write_text("{not json")
+
+    assert load_stack_outputs(session, stack_name=STACK_NAME, cache_path=str(cache_path)) == OUTPUTS
+
+
+def test_assumed_role_credentials_refresh_before_they_expire():
+    session = StubbedSession()
+    add_assume_role(session, "ASIAFIRST0000000", expires_in=datetime.timedelta(minutes=5))
+    add_assume_role(session, "ASIASECOND000000", expires_in=datetime.timedelta(hours=1))
+
+    credentials = assumed_role_credentials(session, role_arn=ROLE_ARN)
+    # The first credentials expire within the refresh window, reading them assumes the role again
+    assert credentials.get_frozen_credentials().access_key == "ASIASECOND000000"
+    assert credentials.get_frozen_credentials().access_key == "ASIASECOND000000"
+    session.stubber("sts").assert_no_pending_responses()
+
+
+def test_find_auth_opensearch_assumes_the_role_on_the_first_signed_request(tmp_path, monkeypatch):
+    monkeypatch.delenv("AWS_SAGEMAKER_PYTHONNOUSERSITE", raising=False)
+    session = StubbedSession()
+    add_describe_stacks(session)
+
+    config = find_auth_opensearch(session=session, stack_name=STACK_NAME, cache_path=str(tmp_path / "outputs.json"))
+    credentials = config["auth"].signer.credentials
+    assert config["host"] == OUTPUTS["cdk-os-sg-DomainEndpoint"]
+    assert credentials.identity == ROLE_ARN
+    assert credentials.credentials is None
+
+    add_assume_role(session, "ASIAASSUMED00000", expires_in=datetime.timedelta(hours=1))
+    assert credentials.get_frozen_credentials().access_key == "ASIAASSUMED00000"
+    session.stubber("sts").assert_no_pending_responses()
+
+
+def test_lazy_credentials_without_credentials_raise_a_clear_error():
+    credentials = LazyCredentials(lambda: None, identity="profile:missing")
+
+    with pytest.raises(NoCredentialsError):
+        credentials.get_frozen_credentials()
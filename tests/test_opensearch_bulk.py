@@ -0,0 +1,130 @@
+import json
+
+from opensearchpy import ConnectionError as OpenSearchConnectionError, TransportError
+from opensearchpy.serializer import JSONSerializer
+
+from retriever.opensearch import BulkChunkRetry, OpenSearchClient, chunk_bulk_actions, expand_bulk_action, \
+    split_bulk_error, split_bulk_response
+
+serializer = JSONSerializer()
+
+
+def expand(document: dict, id_field: str = None) -> tuple:
+    action, lines = expand_bulk_action(document, serializer=serializer, id_field=id_field)
+    return action, [json.loads(line) for line in lines]
+
+
+def make_chunk(num_items: int) -> list:
+    return [expand_bulk_action({"_id": str(position), "_source": {"title": f"product {position}"}},
+                               serializer=serializer) for position in range(num_items)]
+
+
+def test_plain_source_documents_keep_their_metadata_like_fields():
+    action, lines = expand({"id": "1", "routing": "north", "title": "Wally"}, id_field="id")
+
+    assert action == {"index": {"_id": "1"}}
+    assert lines[1] == {"id": "1", "routing": "north", "title": "Wally"}
+
+
+def test_actions_provide_the_metadata():
+    action, lines = expand({"_op_type": "create", "_id": "2", "_index": "products", "routing": "north",
+                            "_source": {"title": "Wally"}})
+
+    assert action == {"create": {"_id": "2", "_index": "products", "routing": "north"}}
+    assert lines == [action, {"title": "Wally"}]
+
+
+def test_delete_actions_have_no_source_line():
+    action, lines = expand({"_op_type": "delete", "_id": "3"})
+
+    assert lines == [{"delete": {"_id": "3"}}]
+
+
+def test_update_actions_without_source_send_the_remaining_fields():
+    _, lines = expand({"_op_type": "update", "_id": "4", "doc": {"title": "Wally"}})
+
+    assert lines[1] == {"doc": {"title": "Wally"}}
+
+
+def test_chunks_are_bounded_by_count_and_bytes():
+    actions = make_chunk(5)
+    action_bytes = sum(len(line.encode("utf-8")) for line in actions[0][1])
+
+    assert [len(chunk) for chunk in chunk_bulk_actions(actions, chunk_size=2, max_chunk_bytes=10_000)] == [2, 2, 1]
+    assert [len(chunk) for chunk in chunk_bulk_actions(actions, chunk_size=10, max_chunk_bytes=action_bytes)] == \
+           [1, 1, 1, 1, 1]
+
+
+def test_split_bulk_response_retries_429_and_5xx_only():
+    chunk = make_chunk(4)
+    response = {"items": [{"index": {"_id": "0", "status": 201}},
+                          {"index": {"_id": "1", "status": 429}},
+                          {"index": {"_id": "2", "status": 503}},
+                          {"index": {"_id": "3", "status": 400, "error": {"type": "mapper_parsing_exception"}}}]}
+
+    num_success, retry_chunk, failures = split_bulk_response(chunk, response, retry=True)
+    assert num_success == 1
+    assert retry_chunk == chunk[1:3]
+    assert failures == [{"index": {"_id": "3", "status": 400, "error": {"type": "mapper_parsing_exception"}}}]
+
+    num_success, retry_chunk, failures = split_bulk_response(chunk, response, retry=False)
+    assert retry_chunk == []
+    assert len(failures) == 3
+
+
+def test_split_bulk_error_retries_connection_errors_and_reports_the_items_at_the_end():
+    chunk = make_chunk(2)
+    error = OpenSearchConnectionError("N/A", "connection refused", None)
+
+    assert split_bulk_error(chunk, error, retry=True) == (0, chunk, [])
+
+    num_success, retry_chunk, failures = split_bulk_error(chunk, error, retry=False)
+    assert (num_success, retry_chunk) == (0, [])
+    assert [failure["index"]["_id"] for failure in failures] == ["0", "1"]
+    assert all(failure["index"]["status"] == "N/A" for failure in failures)
+
+
+def test_split_bulk_error_does_not_retry_client_errors():
+    num_success, retry_chunk, failures = split_bulk_error(make_chunk(1), TransportError(400, "bad request"),
+                                                          retry=True)
+
+    assert retry_chunk == []
+    assert failures[0]["index"]["status"] == 400
+
+
+def test_bulk_chunk_retry_backs_off_exponentially(monkeypatch):
+    monkeypatch.setattr("retriever.opensearch.random.uniform", lambda low, high: high)
+    bulk_retry = BulkChunkRetry(make_chunk(1), max_retries=5, initial_backoff=1.0, max_backoff=3.0)
+
+    assert [bulk_retry.next_backoff() for _ in range(4)] == [1.0, 2.0, 3.0, 3.0]
+
+
+class FlakyOpenSearch:
+    """ Fails the first bulk request as a whole and rejects the first item of the second one. """
+
+    class transport:
+        serializer = serializer
+
+    def __init__(self):
+        self.requests = []
+
+    def bulk(self, body: str, index: str):
+        self.requests.append(body)
+        if len(self.requests) == 1:
+            raise OpenSearchConnectionError("N/A", "connection reset", None)
+        actions = [json.loads(line) for line in body.splitlines()[0::2]]
+        return {"items": [{"index": {"_id": action["index"]["_id"],
+                                     "status": 429 if len(self.requests) == 2 and position == 0 else 201}}
+                          for position, action in enumerate(actions)]}
+
+
+def test_bulk_index_retries_failed_requests_and_rejected_items(monkeypatch):
+    monkeypatch.setattr("retriever.opensearch.time.sleep", lambda seconds: None)
+    client = OpenSearchClient({"host": "localhost", "port": 9200, "use_ssl": False}, alias_name="sg-products")
+    client.opensearch = FlakyOpenSearch()
+
+    num_success, failures = client.bulk_index([{"id": str(position), "title": "Wally"} for position in range(3)],
+                                              id_field="id")
+
+    assert (num_success, failures) == (3, [])
+    assert [len(body.splitlines()) // 2 for body in client.opensearch.requests] == [3, 3, 1]
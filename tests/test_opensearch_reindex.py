@@ -0,0 +1,81 @@
+import pytest
+
+from retriever.opensearch import OpenSearchClient
+
+
+def products(num_products: int) -> list:
+    return [{"id": str(position), "title": f"product {position}"} for position in range(num_products)]
+
+
+@pytest.fixture
+def client(stand_in):
+    return OpenSearchClient(stand_in.config, alias_name="sg-products")
+
+
+def test_reindex_switches_the_alias_after_loading(client, stand_in):
+    switched = []
+    client.add_alias_listener(lambda alias_name, index_name: switched.append((alias_name, index_name)))
+
+    index_name = client.reindex(products(25), id_field="id", chunk_size=10)
+
+    assert client.current_index_for() == index_name
+    assert client.count_docs()["count"] == 25
+    assert switched == [("sg-products", index_name)]
+    assert stand_in.indices[index_name].settings["index.number_of_replicas"] == "1"
+
+
+def test_reindex_accepts_repeated_ids_updates_and_deletes(client):
+    documents = products(3) + [
+        {"id": "1", "title": "product 1 again"},
+        {"_op_type": "update", "_id": "2", "doc": {"title": "product 2 updated"}},
+        {"_op_type": "delete", "_id": "0"},
+        {"title": "product without id"}
+    ]
+
+    index_name = client.reindex(documents, id_field="id")
+
+    assert client.current_index_for() == index_name
+    assert client.count_docs()["count"] == 3
+
+
+def test_failed_reindex_keeps_the_alias_on_the_previous_index(client, stand_in):
+    previous_index = client.reindex(products(5), id_field="id")
+
+    # An update of a document that does not exist fails
+    with pytest.raises(Exception, match="failed for 1 items"):
+        client.reindex(products(5) + [{"_op_type": "update", "_id": "missing", "doc": {}}], id_field="id")
+
+    assert client.current_index_for() == previous_index
+    assert list(stand_in.indices) == [previous_index]
+
+
+def test_reindex_waits_for_the_health_status(client, stand_in, monkeypatch):
+    monkeypatch.setattr(stand_in, "health", lambda target: (200, {"status": "yellow", "timed_out": True}))
+
+    with pytest.raises(Exception, match="did not reach status green"):
+        client.reindex(products(2), id_field="id")
+
+    assert client.current_index_for() is None
+    assert stand_in.indices == {}
+
+
+def test_old_generations_are_removed(client, stand_in, monkeypatch):
+    names = iter(["sg-products-1", "sg-products-2", "sg-products-3"])
+    monkeypatch.setattr("retriever.opensearch.new_index_name", lambda alias_name: next(names))
+
+    for _ in range(3):
+        client.reindex(products(2), id_field="id", keep_generations=1)
+
+    assert sorted(stand_in.indices) == ["sg-products-2", "sg-products-3"]
+    assert client.current_index_for() == "sg-products-3"
+
+
+def test_reindex_within_the_same_second_keeps_the_current_index(client, monkeypatch):
+    monkeypatch.setattr("retriever.opensearch.new_index_name", lambda alias_name: "sg-products-20230901120000")
+
+    first_index = client.reindex(products(2), id_field="id")
+    second_index = client.reindex(products(3), id_field="id")
+
+    assert (first_index, second_index) == ("sg-products-20230901120000", "sg-products-20230901120000-1")
+    assert client.count_docs(first_index)["count"] == 2
+    assert client.count_docs()["count"] == 3
@@ -0,0 +1,99 @@
+import os
+
+import pytest
+
+from retriever.opensearch import OpenSearchClient
+from retriever.opensearch_template import COMPONENT, INDEX_TEMPLATE, OpenSearchTemplate, compose_components, \
+    plan_templates, sync_templates
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StaticTemplate:
+    """ Template set with fixed bodies instead of the files in config_files. """
+
+    def __init__(self, index_template_name: str, components: dict, composed_of: list, version: int = 1):
+        self.index_template_name = index_template_name
+        self.components = components
+        self.body = {"index_patterns": [f"{index_template_name}-*"], "composed_of": composed_of, "version": version}
+
+    def component_bodies(self) -> dict:
+        return self.components
+
+    def index_template_body(self) -> dict:
+        return self.body
+
+
+def product_template(mappings: str = "sg_product_component_mappings") -> OpenSearchTemplate:
+    return OpenSearchTemplate(client=None,
+                              index_template_name="sg_product_index_template",
+                              component_name_settings="sg_product_component_settings",
+                              component_name_dyn_mappings="sg_product_component_dynamic_mappings",
+                              component_name_mappings=mappings)
+
+
+@pytest.fixture
+def in_repo_root(monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+
+
+def test_a_configured_variant_replaces_the_listed_component():
+    assert compose_components(["settings", "mappings", "extra"], ["settings", "mappings_fp16", "new"]) == \
+        ["settings", "mappings_fp16", "extra", "new"]
+
+
+def test_the_index_template_uses_the_configured_components(in_repo_root):
+    composed_of = product_template("sg_product_component_mappings_fp16").index_template_body()["composed_of"]
+
+    assert composed_of == ["sg_product_component_settings", "sg_product_component_dynamic_mappings",
+                           "sg_product_component_mappings_fp16"]
+
+
+def test_the_plan_compares_versions_and_components():
+    shared = {"shared_settings": {"version": 2}}
+    templates = [StaticTemplate("products", {**shared, "product_mappings": {"version": 1}},
+                                ["shared_settings", "product_mappings"]),
+                 StaticTemplate("stores", {**shared, "store_mappings": {"version": 3}},
+                                ["shared_settings", "store_mappings"])]
+    current_components = {"shared_settings": {"version": 2}, "product_mappings": {"version": 1},
+                          "store_mappings": {"version": 2}}
+    current_index_templates = {"products": {"version": 1, "composed_of": ["shared_settings"]},
+                               "stores": {"version": 1, "composed_of": ["shared_settings", "store_mappings"]}}
+
+    actions = plan_templates(templates, current_components, current_index_templates)
+
+    assert [(action["kind"], action["name"], action["needs_update"]) for action in actions] == [
+        (COMPONENT, "shared_settings", False),
+        (COMPONENT, "product_mappings", False),
+        (COMPONENT, "store_mappings", True),
+        (INDEX_TEMPLATE, "products", True),
+        (INDEX_TEMPLATE, "stores", False)
+    ]
+    assert actions[2]["current_version"] == 2
+    assert actions[2]["required_version"] == 3
+
+
+def test_sync_updates_components_before_index_templates(stand_in, in_repo_root):
+    client = OpenSearchClient(stand_in.config)
+    calls = []
+    set_component_template = client.set_component_template
+    set_index_template = client.set_index_template
+    client.set_component_template = lambda name, body: (calls.append(name), set_component_template(name, body))
+    client.set_index_template = lambda name, body: (calls.append(name), set_index_template(name, body))
+
+    sync_templates(client, [product_template()])
+
+    assert calls[-1] == "sg_product_index_template"
+    assert sorted(calls[:-1]) == ["sg_product_component_dynamic_mappings", "sg_product_component_mappings",
+                                  "sg_product_component_settings"]
+    assert not any(action["needs_update"] for action in sync_templates(client, [product_template()]))
+
+
+def test_a_dry_run_changes_nothing(stand_in, in_repo_root):
+    client = OpenSearchClient(stand_in.config)
+
+    actions = sync_templates(client, [product_template()], dry_run=True)
+
+    assert all(action["needs_update"] for action in actions)
+    assert client.get_component_templates() == {}
+    assert client.get_index_templates() == {}
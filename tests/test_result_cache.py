@@ -0,0 +1,104 @@
+import pytest
+
+from retriever import result_cache
+from retriever.result_cache import QueryResultCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(result_cache.time, "monotonic", fake_clock.monotonic)
+    return fake_clock
+
+
+def counting(value):
+    calls = []
+
+    def compute():
+        calls.append(value)
+        return value
+    return compute, calls
+
+
+def test_queries_are_normalized_before_the_lookup(clock):
+    cache = QueryResultCache()
+    compute, calls = counting("hits")
+
+    cache.get_or_compute("sg-products", "Red  Brick", 10, "knn", compute)
+    assert cache.get_or_compute("sg-products", " red brick ", 10, "knn", compute) == "hits"
+    cache.get_or_compute("sg-products", "red brick", 5, "knn", compute)
+
+    assert len(calls) == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = QueryResultCache(ttl_seconds=10)
+    compute, calls = counting("hits")
+
+    cache.get_or_compute("sg-products", "brick", 10, "knn", compute)
+    clock.now += 11
+    cache.get_or_compute("sg-products", "brick", 10, "knn", compute)
+
+    assert len(calls) == 2
+
+
+def test_the_least_recently_used_entry_is_evicted(clock):
+    cache = QueryResultCache(max_items=2)
+    compute, calls = counting("hits")
+
+    for query in ("a", "b", "a", "c", "a", "b"):
+        cache.get_or_compute("sg-products", query, 10, "knn", compute)
+
+    assert len(calls) == 4
+    assert cache.stats()["items"] == 2
+
+
+def test_an_alias_switch_drops_the_entries_of_that_alias(clock):
+    cache = QueryResultCache()
+    compute, calls = counting("hits")
+    cache.get_or_compute("sg-products", "brick", 10, "knn", compute)
+    cache.get_or_compute("sg-content", "opening hours", 10, "knn", compute)
+
+    cache.on_alias_switched("sg-products", "sg-products-2")
+    cache.get_or_compute("sg-products", "brick", 10, "knn", compute)
+    cache.get_or_compute("sg-content", "opening hours", 10, "knn", compute)
+
+    assert len(calls) == 3
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_a_switch_by_another_process_is_picked_up_after_the_check_interval(clock):
+    generations = {"sg-products": "sg-products-1"}
+    cache = QueryResultCache(resolve_generation=generations.get, generation_check_interval=30)
+    compute, calls = counting("hits")
+    cache.get_or_compute("sg-products", "brick", 10, "knn", compute)
+
+    generations["sg-products"] = "sg-products-2"
+    clock.now += 10
+    cache.get_or_compute("sg-products", "brick", 10, "knn", compute)
+    assert len(calls) == 1
+
+    clock.now += 30
+    cache.get_or_compute("sg-products", "brick", 10, "knn", compute)
+    assert len(calls) == 2
+
+
+def test_a_result_computed_during_an_invalidation_is_not_stored(clock):
+    cache = QueryResultCache()
+
+    def compute_while_switching():
+        cache.on_alias_switched("sg-products", "sg-products-2")
+        return "hits of the previous index"
+
+    assert cache.get_or_compute("sg-products", "brick", 10, "knn", compute_while_switching) == \
+        "hits of the previous index"
+    assert cache.stats()["items"] == 0
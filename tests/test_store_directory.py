@@ -0,0 +1,65 @@
+import pytest
+
+from retriever.opensearch import OpenSearchClient
+from retriever.store_directory import StoreDirectory, edit_distance, normalize_city
+
+STORES = [
+    {"store_name": "Lego Store Utrecht", "city": "Utrecht"},
+    {"store_name": "Lego Store Den Bosch", "city": "'s-Hertogenbosch"},
+    {"store_name": "Lego Store Den Haag", "city": "Den Haag"},
+    {"store_name": "Lego Store Amsterdam", "city": "Amsterdam"},
+    {"store_name": "Lego Store Amstelveen", "city": "Amstelveen"},
+    {"store_name": "Lego Store Zoetermeer", "city": "Zoetermeer"}
+]
+
+
+@pytest.fixture
+def directory():
+    directory = StoreDirectory(client=None, generation_check_interval=3600)
+    directory.load(STORES, generation="sg-stores-1")
+    return directory
+
+
+def test_cities_are_normalized():
+    assert normalize_city(" 's-Hertogenbosch ") == "s hertogenbosch"
+    assert normalize_city("Düsseldorf") == "dusseldorf"
+    assert edit_distance("utrech", "utrecht") == 1
+
+
+@pytest.mark.parametrize("city, store_name", [
+    ("utrecht", "Lego Store Utrecht"),
+    ("S Hertogenbosch", "Lego Store Den Bosch"),
+    ("zoeter", "Lego Store Zoetermeer"),
+    ("Amsterdm", "Lego Store Amsterdam"),
+    ("den  haag", "Lego Store Den Haag")
+])
+def test_lookup_by_exact_prefix_and_fuzzy_match(directory, city, store_name):
+    assert [store["store_name"] for store in directory.lookup(city)] == [store_name]
+
+
+@pytest.mark.parametrize("city", ["ams", "Rotterdam", "", "-"])
+def test_ambiguous_and_unknown_cities_are_not_found(directory, city):
+    assert directory.lookup(city) == []
+
+
+@pytest.mark.parametrize("query, city", [
+    ("When does the store in Den Haag open?", "Den Haag"),
+    ("opening hours 's-Hertogenbosch", "'s-Hertogenbosch"),
+    ("Is the shop in Zoetermer open on sunday?", "Zoetermeer"),
+    ("What are the opening hours?", None)
+])
+def test_extract_city_from_the_query(directory, query, city):
+    assert directory.extract_city(query) == ({"city": city} if city else None)
+
+
+def test_the_stores_are_loaded_again_after_an_alias_switch(stand_in):
+    client = OpenSearchClient(stand_in.config, alias_name="sg-stores")
+    client.reindex(STORES[:1])
+    directory = StoreDirectory(client)
+    client.add_alias_listener(directory.on_alias_switched)
+    assert directory.lookup("Den Haag") == []
+
+    client.reindex(STORES)
+
+    assert directory.generation == client.current_index_for()
+    assert directory.find_store("den haag")["store_name"] == "Lego Store Den Haag"
@@ -1,5 +1,14 @@
 __all__ = [
     'load_json_body_from_file',
+    'batched',
+    'get_metrics',
+    'set_metrics',
+    'NoOpMetrics',
+    'PrometheusMetrics',
+    'TracingMetrics',
+    'serve_prometheus',
 ]
 
 from util.file_util import load_json_body_from_file
+from util.iter_util import batched
+from util.metrics import get_metrics, set_metrics, NoOpMetrics, PrometheusMetrics, TracingMetrics, serve_prometheus
@@ -1,12 +1,21 @@
+import copy
 import json
+import os
+from functools import lru_cache
 
 
 def load_json_body_from_file(file_name: str):
     """
-    Load the contents of the file with the provided name and return as a json object.
+    Load the contents of the file with the provided name and return as a json object. The parsed contents are cached
+    until the file changes, every call returns a copy that the caller can change.
     :param file_name: The name of the file.
     :return: The contents of the file.
     """
+    return copy.deepcopy(_load_json(file_name, os.path.getmtime(file_name)))
+
+
+@lru_cache(maxsize=128)
+def _load_json(file_name: str, modified_at: float):
     with open(file_name, 'r') as file:
         data = file.read()
 
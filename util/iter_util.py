@@ -0,0 +1,13 @@
+from typing import Iterable, Iterator
+
+
+def batched(items: Iterable, batch_size: int) -> Iterator[list]:
+    """ Group the items of an iterable or generator in lists of at most batch_size items. """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,178 @@
+"""
+Lightweight metrics for the hot path of a query: routing, embedding, OpenSearch, result mapping and the LLM.
+
+The code records timings and counters through get_metrics(). By default that returns NoOpMetrics, which costs next to
+nothing. An application opts in with set_metrics(PrometheusMetrics()) to collect histograms that are exported in the
+Prometheus text format, or with set_metrics(TracingMetrics()) to record every timed stage as an OpenTelemetry span.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+metrics_log = logging.getLogger("metrics")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class NoOpMetrics:
+    """ Metrics that record nothing, the default when the application did not configure metrics. """
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        yield
+
+    def observe(self, name: str, seconds: float, **labels):
+        pass
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        pass
+
+
+class PrometheusMetrics(NoOpMetrics):
+    """
+    Collects a histogram per timer name and labels and a counter per counter name and labels. The histograms use
+    cumulative buckets in seconds like the Prometheus client libraries do.
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS, prefix: str = "sg_"):
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self.histograms[key] = histogram
+            for position, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram["buckets"][position] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def snapshot(self) -> dict:
+        """ Count, total and average seconds per histogram and the value per counter, to show in a dashboard. """
+        with self.lock:
+            timers = {_series_name(name, labels): {"count": histogram["count"], "sum": histogram["sum"],
+                                                   "avg": histogram["sum"] / histogram["count"]}
+                      for (name, labels), histogram in self.histograms.items()}
+            counters = {_series_name(name, labels): value for (name, labels), value in self.counters.items()}
+        return {"timers": timers, "counters": counters}
+
+    def to_prometheus_text(self) -> str:
+        """ Export all histograms and counters in the Prometheus text exposition format. """
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.histograms}):
+                metric = f"{self.prefix}{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for (series, labels), histogram in sorted(self.histograms.items()):
+                    if series != name:
+                        continue
+                    for bound, count in zip(self.buckets, histogram["buckets"]):
+                        lines.append(f"{metric}_bucket{_labels(labels + (('le', repr(bound)),))} {count}")
+                    lines.append(f"{metric}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+                    lines.append(f"{metric}_sum{_labels(labels)} {histogram['sum']}")
+                    lines.append(f"{metric}_count{_labels(labels)} {histogram['count']}")
+            for name in sorted({name for name, _ in self.counters}):
+                metric = f"{self.prefix}{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for (series, labels), value in sorted(self.counters.items()):
+                    if series == name:
+                        lines.append(f"{metric}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class TracingMetrics(NoOpMetrics):
+    """
+    Records every timer as an OpenTelemetry span with the labels as attributes, nested timers become child spans.
+    Counters are added as events to the current span. Requires the opentelemetry-api package, the exporter is
+    configured by the application through the OpenTelemetry SDK.
+    """
+
+    def __init__(self, tracer_name: str = "openai-aws-opensearch"):
+        try:
+            from opentelemetry import trace
+        except ImportError as error:
+            raise ImportError("TracingMetrics requires the opentelemetry-api package") from error
+
+        self.trace = trace
+        self.tracer = trace.get_tracer(tracer_name)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        with self.tracer.start_as_current_span(name, attributes=labels):
+            yield
+
+    def observe(self, name: str, seconds: float, **labels):
+        self.trace.get_current_span().add_event(name, attributes={**labels, "seconds": seconds})
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        self.trace.get_current_span().add_event(name, attributes={**labels, "amount": amount})
+
+
+_metrics = NoOpMetrics()
+
+
+def get_metrics():
+    return _metrics
+
+
+def set_metrics(metrics):
+    """ Replace the metrics of the process, pass NoOpMetrics() to stop recording. """
+    global _metrics
+    _metrics = metrics
+
+
+def serve_prometheus(metrics: PrometheusMetrics, port: int = 9464, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """ Serve the Prometheus text export on /metrics from a daemon thread. """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.to_prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            metrics_log.debug(format % args)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    metrics_log.info(f"Serving Prometheus metrics on http://{host}:{port}/metrics")
+    return server
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+def _series_name(name: str, labels: tuple) -> str:
+    return name + "".join(f"[{value}]" for _, value in labels)